@@ -0,0 +1,117 @@
+import time
+import random
+import string
+import argparse
+import multiprocessing
+
+
+def generate_payload(size):
+    # Looks roughly like what a page pipeline sends back to the main
+    # process: a page configuration dictionary plus some render info.
+    config = {}
+    cur_size = 0
+    while cur_size < size:
+        key = ''.join(random.choice(string.ascii_lowercase)
+                      for _ in range(8))
+        value = ''.join(random.choice(string.ascii_letters)
+                        for _ in range(64))
+        config[key] = value
+        cur_size += len(key) + len(value)
+    return (1, 0, [({'job_spec': ('pages', 'foo.md')},
+                    {'item_spec': 'foo.md', 'config': config,
+                     'render_info': {'used_source_names': []}},
+                    True)])
+
+
+def _producer(queue, payload, count):
+    for _ in range(count):
+        queue.put(payload)
+    queue.put(None)
+
+
+def bench_transport(transport, producer_count, payload_size, count):
+    from piecrust.workerpool import create_queue
+
+    queue = create_queue(transport)
+    payload = generate_payload(payload_size)
+
+    producers = []
+    for _ in range(producer_count):
+        p = multiprocessing.Process(target=_producer,
+                                    args=(queue, payload, count))
+        p.daemon = True
+        producers.append(p)
+
+    start_time = time.perf_counter()
+    for p in producers:
+        p.start()
+
+    done = 0
+    received = 0
+    while done < producer_count:
+        res = queue.get()
+        if res is None:
+            done += 1
+        else:
+            received += 1
+    elapsed = time.perf_counter() - start_time
+
+    for p in producers:
+        p.join()
+    return received, elapsed
+
+
+def run_benchmarks(transports, producer_count=4, payload_size=16384,
+                   count=1000):
+    print("%d producers, %d payloads of ~%d bytes each." %
+          (producer_count, count, payload_size))
+    for t in transports:
+        received, elapsed = bench_transport(
+            t, producer_count, payload_size, count)
+        print("  %-8s %8.3fs  %10.1f msg/s" %
+              (t, elapsed, received / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='bench_queues',
+        description=("Benchmarks the transports available for sending "
+                     "results from bake workers to the main process."))
+    parser.add_argument(
+        '-t', '--transport',
+        action='append',
+        help="The transport(s) to benchmark.")
+    parser.add_argument(
+        '-w', '--workers',
+        help="The number of producer processes.",
+        type=int,
+        default=4)
+    parser.add_argument(
+        '-s', '--size',
+        help="The approximate size of each payload, in bytes.",
+        type=int,
+        default=16384)
+    parser.add_argument(
+        '-c', '--count',
+        help="The number of payloads sent by each producer.",
+        type=int,
+        default=1000)
+
+    result = parser.parse_args()
+    run_benchmarks(result.transport or ['simple', 'fast', 'shm'],
+                   producer_count=result.workers,
+                   payload_size=result.size,
+                   count=result.count)
+
+
+if __name__ == '__main__':
+    main()
+else:
+    from invoke import task
+
+    @task
+    def benchqueues(ctx, workers=4, size=16384, count=1000):
+        run_benchmarks(['simple', 'fast', 'shm'],
+                       producer_count=workers,
+                       payload_size=size,
+                       count=count)
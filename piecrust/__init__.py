@@ -19,7 +19,7 @@ DEFAULT_THEME_SOURCE = 'https://bitbucket.org/ludovicchabant/'
 
 PIECRUST_URL = 'https://bolt80.com/piecrust/'
 
-CACHE_VERSION = 34
+CACHE_VERSION = 37
 
 try:
     from piecrust.__version__ import APP_VERSION
@@ -32,6 +32,39 @@ class GitSourceControl(SourceControl):
                 res.edited_files.append(line[3:])
         return res
 
+    def getRootDir(self):
+        return self._run('rev-parse', '--show-toplevel',
+                         raise_on_error=True).strip()
+
+    def getRevision(self):
+        return self._run('rev-parse', 'HEAD', raise_on_error=True).strip()
+
+    def getChangedPaths(self, since_rev, pathspecs):
+        """ Returns the paths, relative to the root of the repository, of
+            all the files that are different in the working tree compared to
+            the given revision. This includes untracked and ignored files.
+        """
+        out = self._run('diff', '--name-only', '--no-renames', '-z',
+                        since_rev, '--', *pathspecs, raise_on_error=True)
+        paths = set(_split_z(out))
+        out = self._run('ls-files', '--others', '--full-name', '-z',
+                        '--', *pathspecs, raise_on_error=True)
+        paths.update(_split_z(out))
+        return paths
+
+    def getTreeIds(self, pathspecs):
+        """ Returns the IDs of the trees for the given directories in the
+            current revision, keyed by their paths relative to the root of
+            the repository. Untracked directories are not returned.
+        """
+        out = self._run('ls-tree', '-d', '--full-name', '-z', 'HEAD',
+                        '--', *pathspecs, raise_on_error=True)
+        res = {}
+        for line in _split_z(out):
+            info, path = line.split('\t', 1)
+            res[path] = info.split(' ')[2]
+        return res
+
     def _doCommit(self, paths, message, author):
         self._run('add', *paths)
 
@@ -49,16 +82,24 @@ class GitSourceControl(SourceControl):
         finally:
             os.remove(temp)
 
-    def _run(self, cmd, *args, **kwargs):
+    def _run(self, cmd, *args, raise_on_error=False, **kwargs):
         exe = [self.git]
         exe.append(cmd)
         exe += args
 
         logger.debug("Running Git: " + str(exe))
         proc = subprocess.Popen(
-            exe, stdout=subprocess.PIPE, cwd=self.root_dir)
-        out, _ = proc.communicate()
+            exe, stdout=subprocess.PIPE,
+            stderr=(subprocess.PIPE if raise_on_error else None),
+            cwd=self.root_dir)
+        out, err = proc.communicate()
+        if raise_on_error and proc.returncode != 0:
+            raise Exception("Git command '%s' failed: %s" %
+                            (cmd, _s(err).strip()))
 
         encoded_out = _s(out)
         return encoded_out
 
+
+def _split_z(out):
+    return [p for p in out.split('\0') if p]
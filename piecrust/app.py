@@ -9,7 +9,9 @@ from piecrust import (
     THEME_DIR, PLUGINS_DIR,
     CONFIG_PATH, THEME_CONFIG_PATH)
 from piecrust.appconfig import PieCrustConfiguration
-from piecrust.cache import ExtensibleCache, NullExtensibleCache
+from piecrust.cache import (
+    ExtensibleCache, NullExtensibleCache,
+    MtimeIndex, ContentHashIndex, GitIndex)
 from piecrust.configuration import ConfigurationError
 from piecrust.environment import StandardEnvironment
 from piecrust.page import Page
@@ -141,6 +143,23 @@ class PieCrust(object):
     def cache_dir(self):
         return os.path.join(self.root_dir, CACHE_DIR, self.cache_key)
 
+    @cached_property
+    def file_times(self):
+        mode = self.config.get('baker/change_detection')
+        if mode == 'hash':
+            return ContentHashIndex(self.cache.getCache('app'))
+        if mode == 'git':
+            dirs = list(self.templates_dirs)
+            for src in self.sources:
+                src_dir = getattr(src, 'fs_endpoint_path', None)
+                if src_dir:
+                    dirs.append(src_dir)
+            return GitIndex(self.cache.getCache('app'), self.root_dir, dirs)
+        if mode not in (None, 'mtime'):
+            raise ConfigurationError(
+                "Unknown change detection mode: %s" % mode)
+        return MtimeIndex()
+
     @cached_property
     def sources(self):
         defs = {}
@@ -243,6 +262,22 @@ class PieCrust(object):
             cache_key,
             lambda: Page(source, content_item))
 
+    def reloadContents(self, *, reload_templates=False):
+        """ Forgets what was loaded from the website's files so far, so that
+            this app can keep being used after some of them changed.
+        """
+        for src in self.sources:
+            src.clearCache()
+        self.env.page_repository.clear()
+        self.env.rendered_segments_repository.clear()
+
+        # Some indices only look for changes when they're loaded.
+        self.__dict__.pop('file_times', None)
+
+        if reload_templates:
+            for engine in self.plugin_loader.getTemplateEngines():
+                engine.clearCache()
+
     def resolvePath(self, path):
         path = multi_replace(path, {'%theme_dir%': self.theme_dir})
         return os.path.join(self.root_dir, path)
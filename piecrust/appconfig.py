@@ -49,6 +49,8 @@ class PieCrustConfiguration(Configuration):
         self._cache_hash_mod = ''
         self._custom_paths = []
         self._post_fixups = []
+        self._loaded_text = None
+        self._used_keys = set()
         self.theme_config = theme_config
         # Set the values after we set the rest, since our validation needs
         # our attributes.
@@ -78,6 +80,26 @@ class PieCrustConfiguration(Configuration):
         self._post_fixups.append(_fixup)
         self._cache_hash_mod += '&val[%s=%s]' % (path, repr(value))
 
+    def __getitem__(self, key):
+        self._used_keys.add(key)
+        return super(PieCrustConfiguration, self).__getitem__(key)
+
+    def getUsedKeys(self):
+        """ Returns the key paths of all the settings that were read so
+            far through `get`, `has`, or the subscript operator.
+        """
+        return self._used_keys
+
+    def getLoadedValues(self):
+        """ Returns a copy of the configuration as it was loaded from the
+            configuration files, before any changes made at runtime.
+        """
+        self._ensureLoaded()
+        if self._loaded_text is None:
+            return None
+        return json.loads(self._loaded_text,
+                          object_pairs_hook=collections.OrderedDict)
+
     def setAll(self, values, validate=False):
         # Override base class implementation
         values = self._processConfigs({}, values)
@@ -121,6 +143,7 @@ class PieCrustConfiguration(Configuration):
             if actual_cache_key == cache_key:
                 # The cached version has the same key! Awesome!
                 self._values['__cache_valid'] = True
+                self._loaded_text = config_text
                 return
             logger.debug("Outdated cache key '%s' (expected '%s')." % (
                 actual_cache_key, cache_key))
@@ -158,6 +181,7 @@ class PieCrustConfiguration(Configuration):
         self._values['__cache_key'] = cache_key
         config_text = json.dumps(self._values)
         self._cache.write('config.json', config_text)
+        self._loaded_text = config_text
 
         self._values['__cache_valid'] = False
 
@@ -34,7 +34,18 @@ default_configuration = collections.OrderedDict({
         'no_bake_setting': 'draft',
         'bake_future': False,
         'workers': None,
-        'batch_size': None
+        'batch_size': None,
+        'worker_transport': None,
+        'worker_start_method': None,
+        'warm_workers': False,
+        'worker_max_jobs': None,
+        'worker_max_memory': None,
+        'inline_threshold': 8,
+        'change_detection': 'mtime',
+        'cache_durability': 'sync',
+        'watch_checkpoint_interval': 60,
+        'cache_memory': None,
+        'worker_cache_memory': None
     }),
     'server': collections.OrderedDict({
         'serve_future': True,
@@ -45,7 +56,8 @@ default_configuration = collections.OrderedDict({
     }),
     'pipelines': collections.OrderedDict({
         'asset': collections.OrderedDict({
-            'processors': ['all', '-uglifyjs', '-cleancss']
+            'processors': ['all', '-uglifyjs', '-cleancss'],
+            'worker_backend': 'thread'
         })
     })
 })
@@ -2,26 +2,67 @@ import time
 import os.path
 import hashlib
 import logging
+import threading
 from piecrust.chefutil import (
     format_timed_scope, format_timed)
+from piecrust.configuration import (
+    ConfigurationError, are_key_paths_related, get_changed_dict_key_paths)
 from piecrust.environment import ExecutionStats
 from piecrust.pipelines.base import (
     PipelineJobCreateContext, PipelineJobResultHandleContext, PipelineManager,
     get_pipeline_name_for_source)
+from piecrust.pipelines._pagerecords import PagePipelineRecordEntry
 from piecrust.pipelines.records import (
     MultiRecordHistory, MultiRecord,
     load_records)
-from piecrust.sources.base import REALM_USER, REALM_THEME, REALM_NAMES
+from piecrust.sources.base import REALM_NAMES
 
 
 logger = logging.getLogger(__name__)
 
 
+def get_bake_records_name(out_dir, *, suffix=''):
+    records_id = hashlib.md5(out_dir.encode('utf8')).hexdigest()
+    return '%s%s.records' % (records_id, suffix)
+
+
 def get_bake_records_path(app, out_dir, *, suffix=''):
     records_cache = app.cache.getCache('baker')
-    records_id = hashlib.md5(out_dir.encode('utf8')).hexdigest()
-    records_name = '%s%s.records' % (records_id, suffix)
-    return records_cache.getCachePath(records_name)
+    return records_cache.getCachePath(
+        get_bake_records_name(out_dir, suffix=suffix))
+
+
+def save_bake_records(records, records_path, *, rotate_previous=True,
+                      previous_records=None):
+    # Write the new records first: entries we didn't need during the bake
+    # might still have to be read from the previous records file.
+    tmp_path = records_path + '.tmp'
+    with format_timed_scope(logger, "saved bake records.",
+                            level=logging.DEBUG, colored=False):
+        records.save(tmp_path)
+
+    # The previous records file can't be open while we move it around (at
+    # least not on Windows), and shouldn't be read after that anyway.
+    if previous_records is not None:
+        previous_records.close()
+
+    if rotate_previous:
+        records_dir, records_fn = os.path.split(records_path)
+        records_id, _ = os.path.splitext(records_fn)
+        for i in range(8, -1, -1):
+            suffix = '' if i == 0 else '.%d' % i
+            records_path_i = os.path.join(
+                records_dir,
+                '%s%s.records' % (records_id, suffix))
+            if os.path.exists(records_path_i):
+                records_path_next = os.path.join(
+                    records_dir,
+                    '%s.%s.records' % (records_id, i + 1))
+                if os.path.exists(records_path_next):
+                    os.remove(records_path_next)
+                os.rename(records_path_i, records_path_next)
+
+    os.replace(tmp_path, records_path)
 
 
 class Baker(object):
@@ -31,7 +72,10 @@ class Baker(object):
                  forbidden_pipelines=None,
                  allowed_sources=None,
                  rotate_bake_records=True,
-                 keep_unused_records=False):
+                 keep_unused_records=False,
+                 previous_records=None,
+                 save_bake_records=True,
+                 worker_backend=None):
         self.appfactory = appfactory
         self.app = app
         self.out_dir = out_dir
@@ -41,9 +85,21 @@ class Baker(object):
         self.allowed_sources = allowed_sources
         self.rotate_bake_records = rotate_bake_records
         self.keep_unused_records = keep_unused_records
+        self.previous_records = previous_records
+        self.save_bake_records = save_bake_records
+        self.worker_backend = worker_backend
+        self._changed_templates = None
+        self._changed_config_keys = None
 
     def bake(self):
         start_time = time.perf_counter()
+        # Files changed during the bake should be picked up next time, and
+        # file systems don't stamp modification times with a clock as
+        # precise as ours, so remember when we started, not when we ended.
+        # Make sure the file times index doesn't think it was created later
+        # than that.
+        self.app.file_times
+        bake_time = time.time()
 
         # Setup baker.
         logger.debug("  Bake Output: %s" % self.out_dir)
@@ -52,19 +108,27 @@ class Baker(object):
         # Get into bake mode.
         self.app.config.set('baker/is_baking', True)
         self.app.config.set('site/asset_url_format', '%page_uri%/%filename%')
+        self.app.cache.setDurability(
+            self.app.config.get('baker/cache_durability'))
+        self.app.env.setCacheMemoryBudgets(
+            self.app.config.get('baker/cache_memory'))
 
         stats = self.app.env.stats
         stats.registerTimer('LoadSourceContents', raise_if_registered=False)
         stats.registerTimer('CacheTemplates', raise_if_registered=False)
 
         # Make sure the output directory exists.
-        if not os.path.isdir(self.out_dir):
+        out_dir_existed = os.path.isdir(self.out_dir)
+        if not out_dir_existed:
             os.makedirs(self.out_dir, 0o755)
 
-        # Load/create the bake records.
+        # Load/create the bake records, unless we were given the ones from
+        # a previous bake that we kept in memory.
         records_path = get_bake_records_path(
             self.app, self.out_dir)
-        if not self.force and os.path.isfile(records_path):
+        if self.previous_records is not None:
+            previous_records = self.previous_records
+        elif os.path.isfile(records_path):
             with format_timed_scope(logger, "loaded previous bake records",
                                     level=logging.DEBUG, colored=False):
                 previous_records = load_records(records_path)
@@ -72,12 +136,51 @@ class Baker(object):
             previous_records = MultiRecord()
         current_records = MultiRecord()
 
+        # Keep the previous records around for their job timings (and for
+        # the workers), even if we end up baking everything from scratch.
+        loaded_records = previous_records
+        if self.force:
+            previous_records = MultiRecord()
+
         # Figure out if we need to clean the cache because important things
         # have changed.
         is_cache_valid = self._handleCacheValidity(previous_records,
                                                    current_records)
         if not is_cache_valid:
             previous_records = MultiRecord()
+        elif not out_dir_existed and previous_records.records:
+            # The output directory is gone (like when baking on a new
+            # machine with a cache from somewhere else), so we have to
+            # write everything again. The caches are still good, unless
+            # some templates or settings changed since last time.
+            if self._changed_templates or self._changed_config_keys:
+                self.app.cache.clearCaches(except_names=['app', 'baker'])
+            self._changed_templates = None
+            self._changed_config_keys = None
+            previous_records = MultiRecord()
+
+        # Take a snapshot of all the input files. If nothing changed since
+        # last time, there's nothing to do and we can bail out early without
+        # even starting any worker.
+        if self._canSnapshotInputs():
+            current_records.input_snapshots = _get_input_snapshots(self.app)
+        self.app.file_times.save()
+        if (is_cache_valid and out_dir_existed and
+                not self._changed_config_keys and
+                previous_records.success and
+                current_records.input_snapshots is not None and
+                current_records.input_snapshots ==
+                previous_records.input_snapshots):
+            logger.info(format_timed(
+                start_time, "nothing to bake, output is up to date"))
+            self.app.env.reportCacheStats()
+            previous_records.stats = _merge_execution_stats(stats)
+            self.app.cache.flush()
+            # Whoever called us can still look at the records we return,
+            # but we're done with the file they came from.
+            previous_records.loadAllEntries()
+            self.app.config.set('baker/is_baking', False)
+            return previous_records
 
         # Create the bake records history which tracks what's up-to-date
         # or not since last time we baked to the given output folder.
@@ -88,41 +191,65 @@ class Baker(object):
         for cache_name in ['app', 'baker', 'pages', 'renders']:
             self.app.cache.getCache(cache_name)
 
+        # Start with an empty cache for the segments that worker processes
+        # render for each other, so that it only has renders from this bake.
+        # Create it now, before the workers all try to do it at once.
+        self.app.cache.clearCache('shared_renders')
+        shared_renders = self.app.cache.getPackedCache(
+            'shared_renders', batch_size=1)
+        shared_renders.initialize()
+        shared_renders.close()
+
         # Create the pipelines.
         ppmngr = self._createPipelineManager(record_histories)
+        _carry_over_source_deps(ppmngr, loaded_records)
 
         # Done with all the setup, let's start the actual work.
         logger.info(format_timed(start_time, "setup baker"))
 
-        # Load all sources, pre-cache templates.
+        # Pre-cache templates.
         load_start_time = time.perf_counter()
         self._populateTemplateCaches()
         logger.info(format_timed(load_start_time, "cache templates"))
 
-        # Create the worker processes.
+        # Get ready to create the worker pools. They're created on demand,
+        # depending on what kind of workers the pipelines need.
         pool_userdata = _PoolUserData(self, ppmngr)
-        pool = self._createWorkerPool(records_path, pool_userdata)
+        pool_userdata.loaded_records = loaded_records
+        pool_userdata.worker_spawn_cost = _get_worker_spawn_cost(
+            loaded_records)
+        pool = _WorkerPools(self, records_path, pool_userdata)
 
-        # Bake the realms.
-        self._bakeRealms(pool, ppmngr, record_histories)
+        # Bake all the pipeline passes.
+        self._bakePipelinePasses(pool, ppmngr, record_histories)
 
         # Handle deletions, collapse records, etc.
         ppmngr.postJobRun()
+        _carry_over_job_times(ppmngr)
         ppmngr.deleteStaleOutputs()
         ppmngr.collapseRecords(self.keep_unused_records)
 
-        # All done with the workers. Close the pool and get reports.
+        # All done with the workers. Close the pools and get reports.
+        # Also remember what settings were read by PieCrust itself, as
+        # opposed to those only used by the templates of some pages.
         pool_stats = pool.close()
+        _add_used_config_keys(self.app, stats, previous_records)
+        self.app.env.reportCacheStats()
         current_records.stats = _merge_execution_stats(stats, *pool_stats)
+        current_records.config_values = self.app.config.getLoadedValues()
 
         # Shutdown the pipelines.
         ppmngr.shutdownPipelines()
+        self.app.file_times.save()
+        self.app.cache.flush()
 
         # Backup previous records, save the current ones.
-        current_records.bake_time = time.time()
+        current_records.bake_time = bake_time
         current_records.out_dir = self.out_dir
-        _save_bake_records(current_records, records_path,
-                           rotate_previous=self.rotate_bake_records)
+        if self.save_bake_records:
+            save_bake_records(current_records, records_path,
+                              rotate_previous=self.rotate_bake_records,
+                              previous_records=loaded_records)
 
         # All done.
         self.app.config.set('baker/is_baking', False)
@@ -130,31 +257,60 @@ class Baker(object):
 
         return current_records
 
+    def _canSnapshotInputs(self):
+        # Partial bakes only produce partial records, so we can't use them
+        # to tell if the whole website is up to date.
+        return (self.allowed_pipelines is None and
+                self.forbidden_pipelines is None and
+                self.allowed_sources is None)
+
     def _handleCacheValidity(self, previous_records, current_records):
         start_time = time.perf_counter()
 
+        self._changed_templates = None
+        self._changed_config_keys = None
+
         reason = None
         if self.force:
             reason = "ordered to"
-        elif not self.app.config.get('__cache_valid'):
-            # The configuration file was changed, or we're running a new
-            # version of the app.
-            reason = "not valid anymore"
         elif previous_records.invalidated:
             # We have no valid previous bake records.
             reason = "need bake records regeneration"
         else:
-            # Check if any template has changed since the last bake. Since
+            if not self.app.config.get('__cache_valid'):
+                # The configuration file was changed, or we're running a new
+                # version of the app. If only some settings used by the
+                # templates of some pages changed, we only need to re-bake
+                # those pages. Otherwise, we re-bake everything.
+                changed_config_keys = _get_changed_config_keys(
+                    self.app, previous_records)
+                if changed_config_keys is None:
+                    reason = "not valid anymore"
+                elif not _can_invalidate_config_keys(
+                        previous_records, changed_config_keys):
+                    reason = "configuration modified"
+                elif changed_config_keys:
+                    logger.debug("Configuration modified: %s" %
+                                 ', '.join(sorted(changed_config_keys)))
+                    self._changed_config_keys = changed_config_keys
+
+        if reason is None:
+            # Check if any template has changed since the last bake. If we
+            # know what templates each page used last time, we only need to
+            # re-bake the pages using those templates. Otherwise, since
             # there could be some advanced conditional logic going on, we'd
-            # better just force a bake from scratch if that's the case.
-            max_time = 0
-            for d in self.app.templates_dirs:
-                for dpath, _, filenames in os.walk(d):
-                    for fn in filenames:
-                        full_fn = os.path.join(dpath, fn)
-                        max_time = max(max_time, os.path.getmtime(full_fn))
-            if max_time >= previous_records.bake_time:
-                reason = "templates modified"
+            # better just force a bake from scratch.
+            changed_templates = _get_changed_templates(
+                self.app, previous_records)
+            if changed_templates:
+                if _are_all_entries_tracking(
+                        previous_records,
+                        lambda e: e.getAllUsedTemplates()):
+                    logger.debug("Templates modified: %s" %
+                                 ', '.join(sorted(changed_templates)))
+                    self._changed_templates = changed_templates
+                else:
+                    reason = "templates modified"
 
         if reason is not None:
             # We have to bake everything from scratch.
@@ -182,7 +338,9 @@ class Baker(object):
         has_any_pp = False
         ppmngr = PipelineManager(
             self.app, self.out_dir,
-            record_histories=record_histories)
+            record_histories=record_histories, force=self.force,
+            changed_templates=self._changed_templates,
+            changed_config_keys=self._changed_config_keys)
         ok_pp = self.allowed_pipelines
         nok_pp = self.forbidden_pipelines
         ok_src = self.allowed_sources
@@ -207,71 +365,93 @@ class Baker(object):
                             "out. There's nothing to do.")
         return ppmngr
 
+    def _getWorkerStartMethod(self):
+        start_method = self.app.config.get('baker/worker_start_method')
+        if start_method is None and self.app.config.get('baker/warm_workers'):
+            start_method = _get_warm_start_method()
+        return start_method
+
+    def _usesWarmForkedWorkers(self):
+        # Only worker processes forked from this one share what it has
+        # already loaded... for everything else, it would be wasted work.
+        return (self.app.config.get('baker/warm_workers') and
+                self._getWorkerStartMethod() == 'fork')
+
     def _populateTemplateCaches(self):
         engine_name = self.app.config.get('site/default_template_engine')
         for engine in self.app.plugin_loader.getTemplateEngines():
             if engine_name in engine.ENGINE_NAMES:
-                engine.populateCache()
+                # Templates cached in memory are only any good to workers
+                # that are forked from us.
+                if (not engine.CACHES_IN_MEMORY_ONLY or
+                        self._usesWarmForkedWorkers()):
+                    engine.populateCache()
                 break
 
-    def _bakeRealms(self, pool, ppmngr, record_histories):
-        # Bake the realms -- user first, theme second, so that a user item
-        # can override a theme item.
-        # Do this for as many times as we have pipeline passes left to do.
-        realm_list = [REALM_USER, REALM_THEME]
-        pp_by_pass_and_realm = _get_pipeline_infos_by_pass_and_realm(
-            ppmngr.getPipelineInfos())
-
-        for pp_pass_num in sorted(pp_by_pass_and_realm.keys()):
-            logger.debug("Pipelines pass %d" % pp_pass_num)
-            pp_by_realm = pp_by_pass_and_realm[pp_pass_num]
-            for realm in realm_list:
-                pplist = pp_by_realm.get(realm)
-                if pplist is not None:
-                    self._bakeRealm(pool, ppmngr, record_histories,
-                                    pp_pass_num, realm, pplist)
-
-    def _bakeRealm(self, pool, ppmngr, record_histories,
-                   pp_pass_num, realm, pplist):
-        start_time = time.perf_counter()
+    def _bakePipelinePasses(self, pool, ppmngr, record_histories):
+        # Bake all the pipeline passes of all the sources. Each source goes
+        # through its passes in order, and each pass starts as soon as
+        # what it depends on is done, instead of waiting for all the other
+        # sources to be done with the previous pass. For a given pass, the
+        # user realm goes first and the theme realm second, so that a user
+        # item can override a theme item.
+        scheduler = _BakeScheduler(ppmngr.getPipelineInfos(),
+                                   record_histories)
+        pool.userdata.scheduler = scheduler
+
+        while not scheduler.is_done:
+            steps = scheduler.getReadySteps()
+            if steps:
+                self._bakeSteps(pool, scheduler, record_histories, steps)
+            else:
+                scheduler.waitForProgress(pool)
+
+        # Our steps are done once their last job's result is handled, which
+        # can be slightly before the pools are done with it.
+        pool.wait()
 
+    def _bakeSteps(self, pool, scheduler, record_histories, steps):
         job_count = 0
-        job_descs = {}
-        realm_name = REALM_NAMES[realm].lower()
-        pool.userdata.cur_pass = pp_pass_num
-
-        for ppinfo in pplist:
-            src = ppinfo.source
-            pp = ppinfo.pipeline
-            jcctx = PipelineJobCreateContext(pp_pass_num, pp.record_name,
+        queued_jobs = []
+
+        # Create all the jobs first, so we know how much work there is
+        # before deciding where to run it.
+        for step in steps:
+            src = step.ppinfo.source
+            pp = step.ppinfo.pipeline
+            jcctx = PipelineJobCreateContext(step.pass_num, pp.record_name,
                                              record_histories)
 
+            scheduler.startStep(step)
             jobs, job_desc = pp.createJobs(jcctx)
-            if jobs is not None:
-                new_job_count = len(jobs)
-                job_count += new_job_count
-                pool.queueJobs(jobs)
-                if job_desc:
-                    job_descs.setdefault(job_desc, []).append(src.name)
-            else:
-                new_job_count = 0
-
+            new_job_count = len(jobs) if jobs else 0
             logger.debug(
                 "Queued %d jobs for source '%s' using pipeline '%s' "
-                "(%s)." %
-                (new_job_count, src.name, pp.PIPELINE_NAME, realm_name))
+                "(%s, pass %d)." %
+                (new_job_count, src.name, pp.PIPELINE_NAME,
+                 REALM_NAMES[step.realm].lower(), step.pass_num))
+
+            if new_job_count == 0:
+                scheduler.endStep(step)
+                continue
+
+            job_count += new_job_count
+            step.job_desc = job_desc
+            step.job_count = new_job_count
+            step.jobs_left = new_job_count
+            costs = _get_job_costs(
+                jobs, pool.userdata.loaded_records, pp.record_name,
+                step.pass_num)
+            queued_jobs.append((pp, jobs, costs))
 
         if job_count == 0:
-            logger.debug("No jobs queued! Bailing out of this bake pass.")
             return
 
-        pool.wait()
-
-        logger.info(format_timed(
-            start_time, "%d jobs completed (%s)." %
-            (job_count, ', '.join(
-                ['%s %s' % (d, ', '.join(sn))
-                 for d, sn in job_descs.items()]))))
+        inline = pool.shouldRunInline(queued_jobs)
+        if inline:
+            logger.debug("Running %d jobs in the main process." % job_count)
+        for pp, jobs, costs in queued_jobs:
+            pool.getPool(pp, inline=inline).queueJobs(jobs, costs=costs)
 
     def _logErrors(self, item_spec, errors):
         logger.error("Errors found in %s:" % item_spec)
@@ -284,23 +464,73 @@ class Baker(object):
         if self.app.debug:
             logger.error(exc_data['traceback'])
 
-    def _createWorkerPool(self, previous_records_path, pool_userdata):
-        from piecrust.workerpool import WorkerPool
+    def _createWorkerPool(self, backend, previous_records_path,
+                          pool_userdata):
+        from piecrust.workerpool import (
+            WorkerPool, BACKEND_THREAD, BACKEND_INLINE)
         from piecrust.baking.worker import BakeWorkerContext, BakeWorker
 
         worker_count = self.app.config.get('baker/workers')
         batch_size = self.app.config.get('baker/batch_size')
 
+        if backend in [BACKEND_THREAD, BACKEND_INLINE]:
+            # Worker threads, or jobs running inline, share our app,
+            # records and pipelines. Threads are cheap so they can be
+            # started as soon as there's a job for them.
+            ctx = BakeWorkerContext(
+                self.appfactory,
+                self.out_dir,
+                force=self.force,
+                app=self.app,
+                previous_records=pool_userdata.loaded_records,
+                ppmngr=pool_userdata.ppmngr)
+            return WorkerPool(
+                worker_count=worker_count,
+                batch_size=batch_size,
+                backend=backend,
+                worker_spawn_cost=0,
+                worker_class=BakeWorker,
+                initargs=(ctx,),
+                callback=self._handleWorkerResult,
+                error_callback=self._handleWorkerError,
+                userdata=pool_userdata)
+
+        transport = self.app.config.get('baker/worker_transport')
+        max_jobs = self.app.config.get('baker/worker_max_jobs')
+        max_memory = self.app.config.get('baker/worker_max_memory')
+        if max_memory:
+            max_memory = max_memory * 1024 * 1024
+
+        start_method = self._getWorkerStartMethod()
+
+        # Forked workers can share our already loaded app and records.
+        app = None
+        previous_records = None
+        if self._usesWarmForkedWorkers():
+            app = self.app
+            previous_records = pool_userdata.loaded_records
+
         ctx = BakeWorkerContext(
             self.appfactory,
             self.out_dir,
             force=self.force,
             previous_records_path=previous_records_path,
             allowed_pipelines=self.allowed_pipelines,
-            forbidden_pipelines=self.forbidden_pipelines)
+            forbidden_pipelines=self.forbidden_pipelines,
+            app=app,
+            previous_records=previous_records)
         pool = WorkerPool(
             worker_count=worker_count,
             batch_size=batch_size,
+            transport=transport,
+            start_method=start_method,
+            # Even when workers are forked, the ones replacing crashed or
+            # retired workers are started by a fork server.
+            preload_modules=_worker_preload_modules,
+            max_jobs_per_worker=max_jobs,
+            max_worker_memory=max_memory,
+            backend=backend,
+            worker_spawn_cost=pool_userdata.worker_spawn_cost,
             worker_class=BakeWorker,
             initargs=(ctx,),
             callback=self._handleWorkerResult,
@@ -309,7 +539,15 @@ class Baker(object):
         return pool
 
     def _handleWorkerResult(self, job, res, userdata):
-        cur_pass = userdata.cur_pass
+        source_name, item_spec = job['job_spec']
+        step = userdata.scheduler.getRunningStep(source_name)
+        try:
+            self._handleWorkerResultForStep(job, res, userdata, step)
+        finally:
+            userdata.scheduler.onJobDone(step)
+
+    def _handleWorkerResultForStep(self, job, res, userdata, step):
+        cur_pass = step.pass_num
         source_name, item_spec = job['job_spec']
 
         # Make the pipeline do custom handling to update the record entry.
@@ -319,14 +557,27 @@ class Baker(object):
         ppmrctx = PipelineJobResultHandleContext(record, job, cur_pass)
         pipeline.handleJobResult(res, ppmrctx)
 
-        # Set the overall success flags if there was an error.
+        # Remember how long this job took, for scheduling the next bake.
         record_entry = ppmrctx.record_entry
+        job_time = res.get('job_time')
+        if record_entry is not None and job_time is not None:
+            record_entry.job_times[cur_pass] = job_time
+
+        # Set the overall success flags if there was an error.
         if not record_entry.success:
             record.success = False
             userdata.records.success = False
             self._logErrors(job['item_spec'], record_entry.errors)
 
     def _handleWorkerError(self, job, exc_data, userdata):
+        source_name, item_spec = job['job_spec']
+        step = userdata.scheduler.getRunningStep(source_name)
+        try:
+            self._handleWorkerErrorForStep(job, exc_data, userdata)
+        finally:
+            userdata.scheduler.onJobDone(step)
+
+    def _handleWorkerErrorForStep(self, job, exc_data, userdata):
         # Set the overall success flag.
         source_name, item_spec = job['job_spec']
         ppinfo = userdata.ppmngr.getPipelineInfo(source_name)
@@ -349,34 +600,442 @@ class Baker(object):
             logger.error(exc_data['traceback'])
 
 
+class _WorkerPools:
+    """ The worker pools for a bake, created on demand for each kind of
+        worker backend that the pipelines need.
+    """
+    def __init__(self, baker, records_path, userdata):
+        self.userdata = userdata
+        self._baker = baker
+        self._records_path = records_path
+        self._pools = {}
+
+    def shouldRunInline(self, queued_jobs):
+        """ Returns whether the given jobs, as a list of
+            `(pipeline, jobs, costs)` tuples, are better off running in
+            the main process than being sent to workers.
+        """
+        from piecrust.workerpool import BACKEND_PROCESS
+
+        threshold = self._baker.app.config.get('baker/inline_threshold')
+        if not threshold:
+            return False
+        job_count = sum([len(jobs) for _, jobs, _ in queued_jobs])
+        if job_count <= threshold:
+            return True
+
+        # If we know how long those jobs took last time, see if they would
+        # even make up for the time it takes to start a worker process...
+        # unless we've already started some.
+        pool = self._pools.get(BACKEND_PROCESS)
+        if pool is not None and pool.started_worker_count > 0:
+            return False
+        total_cost = 0
+        for _, _, costs in queued_jobs:
+            if costs is None or None in costs:
+                return False
+            total_cost += sum(costs)
+        return total_cost < self.userdata.worker_spawn_cost
+
+    def getPool(self, pipeline, *, inline=False):
+        from piecrust.workerpool import BACKEND_INLINE
+
+        if inline:
+            backend = BACKEND_INLINE
+        else:
+            backend = _get_worker_backend(self._baker, pipeline)
+        pool = self._pools.get(backend)
+        if pool is None:
+            logger.debug("Creating '%s' worker pool." % backend)
+            pool = self._baker._createWorkerPool(
+                backend, self._records_path, self.userdata)
+            self._pools[backend] = pool
+        return pool
+
+    def wait(self):
+        for pool in self._pools.values():
+            pool.wait()
+
+    def checkErrors(self):
+        # This raises any error the pools ran into, like all their workers
+        # dying.
+        for pool in self._pools.values():
+            pool.wait(0)
+
+    def close(self):
+        res = []
+        for pool in self._pools.values():
+            res += pool.close()
+        return res
+
+
+def _get_worker_backend(baker, pipeline):
+    from piecrust.workerpool import (
+        BACKEND_PROCESS, BACKEND_THREAD, BACKEND_INLINE)
+
+    # Worker threads share the app with everything else, which only works
+    # for pipelines that don't mess with it. Otherwise, an overridden
+    # backend falls back to running jobs inline, which still shares the
+    # app, but safely.
+    backend = baker.worker_backend
+    if backend is not None:
+        if backend == BACKEND_THREAD and not pipeline.THREAD_SAFE:
+            return BACKEND_INLINE
+        return backend
+
+    backend = (baker.app.config.get('pipelines/%s/worker_backend' %
+                                    pipeline.PIPELINE_NAME) or
+               BACKEND_PROCESS)
+    if backend == BACKEND_THREAD and not pipeline.THREAD_SAFE:
+        raise ConfigurationError(
+            "Pipeline '%s' can't run in worker threads." %
+            pipeline.PIPELINE_NAME)
+    return backend
+
+
 class _PoolUserData:
     def __init__(self, baker, ppmngr):
         self.baker = baker
         self.ppmngr = ppmngr
         self.records = ppmngr.record_histories.current
-        self.cur_pass = 0
-
-
-def _get_pipeline_infos_by_pass_and_realm(pp_infos):
-    pp_by_pass_and_realm = {}
-    for pp_info in pp_infos:
-        pp_pass_num = pp_info.pipeline.PASS_NUM
-        if isinstance(pp_pass_num, list):
-            for ppn in pp_pass_num:
-                _add_pipeline_info_to_pass_and_realm_dict(
-                    ppn, pp_info, pp_by_pass_and_realm)
-        else:
-            _add_pipeline_info_to_pass_and_realm_dict(
-                pp_pass_num, pp_info, pp_by_pass_and_realm)
-    return pp_by_pass_and_realm
+        self.loaded_records = None
+        self.worker_spawn_cost = None
+        self.scheduler = None
+
+
+class _BakeStep:
+    """ A pipeline pass for a given source.
+    """
+    def __init__(self, ppinfo, pass_num):
+        self.ppinfo = ppinfo
+        self.pass_num = pass_num
+        self.realm = ppinfo.source.config['realm']
+        self.dependencies = _NOT_COMPUTED
+        self.is_started = False
+        self.is_done = False
+        self.job_desc = None
+        self.job_count = 0
+        self.jobs_left = 0
+        self.start_time = None
+
+    @property
+    def source_name(self):
+        return self.ppinfo.source.name
+
+
+_NOT_COMPUTED = object()
+
+
+class _BakeScheduler:
+    """ Figures out which pipeline passes can run, based on what they
+        depend on, and keeps track of them as their jobs complete.
+    """
+    def __init__(self, ppinfos, record_histories):
+        steps = []
+        for ppinfo in ppinfos:
+            pass_nums = ppinfo.pipeline.PASS_NUM
+            if not isinstance(pass_nums, list):
+                pass_nums = [pass_nums]
+            for pass_num in pass_nums:
+                steps.append(_BakeStep(ppinfo, pass_num))
+        steps.sort(key=lambda s: (s.pass_num, s.realm))
+
+        self.record_histories = record_histories
+        self._steps = steps
+        self._running = {}
+        self._has_progress = False
+        self._cond = threading.Condition()
+
+    @property
+    def is_done(self):
+        return all([s.is_done for s in self._steps])
+
+    def getRunningStep(self, source_name):
+        return self._running[source_name]
+
+    def getReadySteps(self):
+        return [s for s in self._steps
+                if not s.is_started and self._isReady(s)]
+
+    def startStep(self, step):
+        step.is_started = True
+        step.start_time = time.perf_counter()
+        self._running[step.source_name] = step
+
+    def endStep(self, step):
+        with self._cond:
+            step.is_done = True
+            self._has_progress = True
+            self._cond.notify_all()
+
+        if step.job_count > 0:
+            desc = step.source_name
+            if step.job_desc:
+                desc = '%s %s' % (step.job_desc, desc)
+            logger.info(format_timed(
+                step.start_time, "%d jobs completed (%s)." %
+                (step.job_count, desc)))
+
+    def onJobDone(self, step):
+        with self._cond:
+            step.jobs_left -= 1
+            is_done = (step.jobs_left == 0)
+        if is_done:
+            self.endStep(step)
+
+    def waitForProgress(self, pool):
+        if not any([s.is_started and not s.is_done for s in self._steps]):
+            raise Exception("No pipeline pass is running or can be run.")
+
+        with self._cond:
+            while not self._has_progress:
+                self._cond.wait(0.5)
+                # Workers can all die on us, in which case no more jobs
+                # will ever be done.
+                pool.checkErrors()
+            self._has_progress = False
+
+    def _isReady(self, step):
+        # Our own previous passes must be done, along with the same pass
+        # for any realm that comes before us.
+        for other in self._steps:
+            if other.is_done:
+                continue
+            if (other.source_name == step.source_name and
+                    other.pass_num < step.pass_num):
+                return False
+            if other.pass_num == step.pass_num and other.realm < step.realm:
+                return False
+
+        # Now we can ask the pipeline what else it needs.
+        if step.dependencies is _NOT_COMPUTED:
+            pp = step.ppinfo.pipeline
+            ctx = PipelineJobCreateContext(
+                step.pass_num, pp.record_name, self.record_histories)
+            step.dependencies = pp.getPassDependencies(ctx)
+
+        deps = step.dependencies
+        for other in self._steps:
+            if other.is_done or other.pass_num >= step.pass_num:
+                continue
+            if deps is None:
+                return False
+            if other.pass_num in deps:
+                source_names = deps[other.pass_num]
+                if source_names is None or other.source_name in source_names:
+                    return False
+        return True
+
+
+_worker_preload_modules = [
+    'piecrust.app',
+    'piecrust.baking.worker',
+    'piecrust.pipelines.asset',
+    'piecrust.pipelines.page',
+    'piecrust.rendering',
+    'piecrust.templating.jinjaengine',
+    'jinja2']
+
+
+def _get_warm_start_method():
+    import multiprocessing
+    methods = multiprocessing.get_all_start_methods()
+    if 'fork' in methods:
+        return 'fork'
+    if 'forkserver' in methods:
+        return 'forkserver'
+    return None
+
+
+def _get_job_costs(jobs, loaded_records, record_name, pass_num):
+    # Use how long each job took during the last bake as an estimate of
+    # how long it will take this time.
+    if loaded_records is None:
+        return None
+    previous_record = None
+    for r in loaded_records.records:
+        if r.name == record_name:
+            previous_record = r
+            break
+    if previous_record is None:
+        return None
+
+    costs = []
+    any_known = False
+    for job in jobs:
+        spec = job.get('record_entry_spec', job['job_spec'][1])
+        prev_entry = previous_record.getEntry(spec)
+        cost = None
+        if prev_entry is not None:
+            cost = prev_entry.job_times.get(pass_num)
+            any_known = any_known or (cost is not None)
+        costs.append(cost)
+    if any_known:
+        return costs
+    return None
+
+
+_DEFAULT_WORKER_SPAWN_COST = 0.5
+
+
+def _get_worker_spawn_cost(loaded_records):
+    # See how long it took to start a worker process during the last bake,
+    # on average.
+    stats = loaded_records.stats if loaded_records else None
+    if stats is not None:
+        count = stats.counters.get('WorkerProcessCount')
+        if count:
+            return stats.timers.get('WorkerProcessInit', 0) / count
+    return _DEFAULT_WORKER_SPAWN_COST
+
+
+def _carry_over_job_times(ppmngr):
+    # Entries that didn't need a job for some passes keep the timings
+    # from the last time those jobs ran.
+    for ppinfo in ppmngr.getPipelineInfos():
+        for prev, cur in ppinfo.record_history.diffs:
+            if prev is not None and cur is not None:
+                for pass_num, t in prev.job_times.items():
+                    cur.job_times.setdefault(pass_num, t)
+
+
+def _carry_over_source_deps(ppmngr, loaded_records):
+    # Pipelines can remember which items depend on which other sources,
+    # even when we bake from scratch, so they can schedule those items in
+    # the right pass from the start.
+    for ppinfo in ppmngr.getPipelineInfos():
+        for r in loaded_records.records:
+            if r.name == ppinfo.pipeline.record_name:
+                source_deps = r.user_data.get('source_deps')
+                if source_deps:
+                    cur_record = ppinfo.record_history.current
+                    cur_record.user_data['source_deps'] = dict(source_deps)
+                break
 
 
-def _add_pipeline_info_to_pass_and_realm_dict(pp_pass_num, pp_info,
-                                              pp_by_pass_and_realm):
-    pp_by_realm = pp_by_pass_and_realm.setdefault(pp_pass_num, {})
-    pplist = pp_by_realm.setdefault(
-        pp_info.pipeline.source.config['realm'], [])
-    pplist.append(pp_info)
+def _get_changed_templates(app, previous_records):
+    changed_templates = set()
+    for d in app.templates_dirs:
+        for dpath, _, filenames in os.walk(d):
+            for fn in filenames:
+                full_fn = os.path.join(dpath, fn)
+                if (app.file_times.getMtime(full_fn) >=
+                        previous_records.bake_time):
+                    name = os.path.relpath(full_fn, d).replace(os.sep, '/')
+                    changed_templates.add(name)
+
+    # Templates that were deleted since last time also count.
+    for name in _get_all_used_templates(previous_records):
+        if not any((os.path.isfile(os.path.join(d, name))
+                    for d in app.templates_dirs)):
+            changed_templates.add(name)
+
+    return changed_templates
+
+
+def _get_all_used_templates(records):
+    res = set()
+    for rec in records.records:
+        for e in rec.getEntries():
+            if isinstance(e, PagePipelineRecordEntry):
+                used_templates = e.getAllUsedTemplates()
+                if used_templates is not None:
+                    res |= used_templates[0] | used_templates[1]
+    return res
+
+
+def _are_all_entries_tracking(records, getter):
+    for rec in records.records:
+        for e in rec.getEntries():
+            if (isinstance(e, PagePipelineRecordEntry) and
+                    getter(e) is None):
+                return False
+    return True
+
+
+def _get_changed_config_keys(app, previous_records):
+    prev_values = previous_records.config_values
+    cur_values = app.config.getLoadedValues()
+    if prev_values is None or cur_values is None:
+        return None
+
+    # The cache key changes with the app version, the configuration file
+    # paths, variants, etc.
+    if prev_values.get('__cache_key') != cur_values.get('__cache_key'):
+        return None
+
+    return get_changed_dict_key_paths(prev_values, cur_values)
+
+
+def _can_invalidate_config_keys(previous_records, changed_config_keys):
+    # Settings read by PieCrust itself (as opposed to settings only read
+    # by templates) could change anything, like what pages exist, or
+    # where they get baked. They could also have been cached by some
+    # components, so we don't know which pages used them.
+    stats = previous_records.stats
+    if stats is None:
+        return False
+    used_keys = stats.manifests.get('ConfigKeysUsed')
+    if used_keys is None:
+        return False
+    for uk in set(used_keys):
+        for ck in changed_config_keys:
+            if are_key_paths_related(uk, ck):
+                logger.debug("Setting '%s' is used by PieCrust." % ck)
+                return False
+
+    return _are_all_entries_tracking(
+        previous_records, lambda e: e.getAllUsedConfigKeys())
+
+
+def _add_used_config_keys(app, stats, previous_records):
+    # Pages that didn't change didn't get loaded, so the settings they
+    # would have read wouldn't show up if we didn't keep the previous ones.
+    used_keys = set(app.config.getUsedKeys())
+    if previous_records.stats is not None:
+        used_keys.update(
+            previous_records.stats.manifests.get('ConfigKeysUsed', []))
+
+    stats.registerManifest('ConfigKeysUsed', raise_if_registered=False)
+    for k in sorted(used_keys):
+        stats.addManifestEntry('ConfigKeysUsed', k)
+
+
+def _get_input_snapshots(app):
+    """ Returns a fingerprint of the files in each source and templates
+        directory, or `None` if some source doesn't come from the file-system.
+    """
+    from piecrust.sources.fs import FSContentSourceBase
+    from piecrust.sources.generator import GeneratorSourceBase
+
+    dirs = list(app.templates_dirs)
+    for src in app.sources:
+        if isinstance(src, FSContentSourceBase):
+            dirs.append(src.fs_endpoint_path)
+        elif not isinstance(src, GeneratorSourceBase):
+            # Generator sources only depend on other sources, but we can't
+            # know anything about other kinds of sources.
+            return None
+
+    snapshots = {}
+    for d in dirs:
+        fp = app.file_times.getDirFingerprint(d)
+        if fp is not None:
+            snapshots[d] = fp
+            continue
+
+        h = hashlib.md5()
+        for dpath, dnames, filenames in os.walk(d):
+            dnames.sort()
+            for fn in sorted(filenames):
+                full_fn = os.path.join(dpath, fn)
+                try:
+                    fp = app.file_times.getFingerprint(full_fn)
+                except OSError:
+                    continue
+                h.update(('%s:%s\n' % (full_fn, fp)).encode('utf8'))
+        snapshots[d] = h.hexdigest()
+    return snapshots
 
 
 def _merge_execution_stats(base_stats, *other_stats):
@@ -386,25 +1045,3 @@ def _merge_execution_stats(base_stats, *other_stats):
         if ps is not None:
             total_stats.mergeStats(ps)
     return total_stats
-
-
-def _save_bake_records(records, records_path, *, rotate_previous):
-    if rotate_previous:
-        records_dir, records_fn = os.path.split(records_path)
-        records_id, _ = os.path.splitext(records_fn)
-        for i in range(8, -1, -1):
-            suffix = '' if i == 0 else '.%d' % i
-            records_path_i = os.path.join(
-                records_dir,
-                '%s%s.records' % (records_id, suffix))
-            if os.path.exists(records_path_i):
-                records_path_next = os.path.join(
-                    records_dir,
-                    '%s.%s.records' % (records_id, i + 1))
-                if os.path.exists(records_path_next):
-                    os.remove(records_path_next)
-                os.rename(records_path_i, records_path_next)
-
-    with format_timed_scope(logger, "saved bake records.",
-                            level=logging.DEBUG, colored=False):
-        records.save(records_path)
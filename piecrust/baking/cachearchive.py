@@ -0,0 +1,460 @@
+import io
+import os
+import os.path
+import re
+import json
+import time
+import zlib
+import pickle
+import collections
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import logging
+from piecrust import APP_VERSION, CACHE_DIR, CACHE_VERSION
+from piecrust.baking.baker import (
+    get_bake_records_name, get_bake_records_path, save_bake_records)
+from piecrust.cache import PackedCache, get_file_hash
+from piecrust.pipelines.records import load_records
+
+
+logger = logging.getLogger(__name__)
+
+
+ARCHIVE_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+CACHE_PREFIX = 'cache/'
+
+# Caches that only make sense during a bake, and aren't worth archiving.
+_SKIPPED_CACHES = ['shared_renders']
+
+# Caches whose items are pickled objects. Nothing else in an archive is
+# unpickled when relocating it, except for the bake records.
+_PICKLED_CACHES = ['pages', 'renders']
+
+
+class CacheArchiveError(Exception):
+    pass
+
+
+def export_cache(app, out_dir, archive_path):
+    """ Writes the website's cache, along with the bake records for the
+        given output directory, into a single archive.
+
+        The archive also has a manifest of all the website's files, keyed
+        by their path relative to the website's root, along with the hash
+        of their contents. When the archive is imported on another machine,
+        or in another directory, this is used to figure out which files
+        are still the same, and which cache entries are still valid.
+    """
+    records_path = get_bake_records_path(app, out_dir)
+    if not os.path.isfile(records_path):
+        raise CacheArchiveError(
+            "No bake records found for output directory '%s'. "
+            "Bake the website first." % out_dir)
+
+    # Make sure everything is on disk.
+    app.cache.flush()
+
+    inputs = {}
+    for path in _get_input_paths(app, out_dir):
+        rel_path = os.path.relpath(path, app.root_dir).replace(os.sep, '/')
+        inputs[rel_path] = [get_file_hash(path), os.stat(path).st_mtime_ns]
+
+    manifest = {
+        'version': ARCHIVE_VERSION,
+        'app_version': APP_VERSION,
+        'cache_version': CACHE_VERSION,
+        'root_dir': app.root_dir,
+        'out_dir': os.path.abspath(out_dir),
+        'records_name': os.path.basename(records_path),
+        'config_cache_key': _get_config_cache_key(app),
+        'inputs': inputs}
+
+    def _filter_member(tarinfo):
+        name = os.path.basename(tarinfo.name)
+        if name.endswith(('.tmp', '-shm')):
+            return None
+        # Only keep the bake records for our output directory, and not
+        # their older versions.
+        if ('.records' in name and
+                tarinfo.name.startswith(CACHE_PREFIX + 'baker/') and
+                name != manifest['records_name']):
+            return None
+        return tarinfo
+
+    cache_dir = app.cache_dir
+    with tarfile.open(archive_path, 'w:gz') as tf:
+        manifest_data = json.dumps(manifest).encode('utf8')
+        info = tarfile.TarInfo(MANIFEST_NAME)
+        info.size = len(manifest_data)
+        info.mtime = time.time()
+        tf.addfile(info, io.BytesIO(manifest_data))
+
+        for name in sorted(os.listdir(cache_dir)):
+            if name in _SKIPPED_CACHES:
+                continue
+            tf.add(os.path.join(cache_dir, name),
+                   arcname=CACHE_PREFIX + name,
+                   filter=_filter_member)
+
+    return manifest
+
+
+def import_cache(app, out_dir, archive_path):
+    """ Replaces the website's cache with the one from the given archive,
+        made with `export_cache`.
+
+        Paths in the cache and in the bake records are moved over from
+        where the archive was made to this website's root and the given
+        output directory. Files whose contents didn't change since the
+        archive was made get their modification time back to what it was
+        back then, so that the cache entries that depend on them are
+        still valid.
+
+        The archive is checked, extracted and relocated next to the
+        current cache, which is only replaced once all that worked.
+        Archives contain pickled objects, which can run arbitrary code when
+        loaded, so only import archives from a trusted source.
+
+        Returns the number of files that are still the same, and the
+        number of files that changed or are new.
+    """
+    cache_dir = app.cache_dir
+    try:
+        tf = tarfile.open(archive_path, 'r:*')
+    except (OSError, tarfile.TarError) as ex:
+        raise CacheArchiveError(
+            "Can't open cache archive '%s': %s" % (archive_path, ex))
+
+    with tf:
+        manifest = _read_manifest(tf)
+        members = _get_cache_members(tf, archive_path)
+
+        # Extract next to the current cache, so it can be swapped in
+        # quickly once everything is ready.
+        cache_parent_dir = os.path.dirname(cache_dir)
+        if not os.path.isdir(cache_parent_dir):
+            os.makedirs(cache_parent_dir, 0o755)
+        tmp_dir = tempfile.mkdtemp(prefix='import-', dir=cache_parent_dir)
+        try:
+            try:
+                tf.extractall(tmp_dir, members=members)
+            except (OSError, EOFError, zlib.error, tarfile.TarError) as ex:
+                raise CacheArchiveError(
+                    "Can't extract cache archive '%s': %s" %
+                    (archive_path, ex))
+            _relocate_cache(app, out_dir, manifest, tmp_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    # Now swap the new cache in.
+    for pc in app.cache.packed_caches.values():
+        pc.close(discard=True)
+    if os.path.isdir(cache_dir):
+        old_dir = tmp_dir + '-old'
+        os.rename(cache_dir, old_dir)
+        os.rename(tmp_dir, cache_dir)
+        shutil.rmtree(old_dir)
+    else:
+        os.rename(tmp_dir, cache_dir)
+
+    # Restore the modification times of the files that didn't change.
+    same_count = 0
+    changed_count = 0
+    for rel_path, (content_hash, mtime_ns) in manifest['inputs'].items():
+        path = os.path.join(app.root_dir, *rel_path.split('/'))
+        try:
+            if get_file_hash(path) != content_hash:
+                changed_count += 1
+                continue
+            st = os.stat(path)
+            os.utime(path, ns=(st.st_atime_ns, mtime_ns))
+            same_count += 1
+        except OSError:
+            # The file was deleted.
+            continue
+    for path in _get_input_paths(app, out_dir):
+        rel_path = os.path.relpath(path, app.root_dir).replace(os.sep, '/')
+        if rel_path not in manifest['inputs']:
+            changed_count += 1
+
+    return same_count, changed_count
+
+
+def _get_cache_members(tf, archive_path):
+    members = []
+    try:
+        all_members = tf.getmembers()
+    except (OSError, EOFError, zlib.error, tarfile.TarError) as ex:
+        raise CacheArchiveError(
+            "Can't read cache archive '%s': %s" % (archive_path, ex))
+    for m in all_members:
+        if not m.name.startswith(CACHE_PREFIX):
+            continue
+        if not (m.isfile() or m.isdir()):
+            raise CacheArchiveError(
+                "Unexpected item in cache archive: %s" % m.name)
+        m.name = m.name[len(CACHE_PREFIX):]
+        if (os.path.isabs(m.name) or
+                '..' in m.name.replace('\\', '/').split('/')):
+            raise CacheArchiveError(
+                "Invalid path in cache archive: %s" % m.name)
+        members.append(m)
+    return members
+
+
+def _relocate_cache(app, out_dir, manifest, cache_dir):
+    path_map = []
+    new_out_dir = os.path.abspath(out_dir)
+    if manifest['out_dir'] != new_out_dir:
+        path_map.append((manifest['out_dir'], new_out_dir))
+    if manifest['root_dir'] != app.root_dir:
+        path_map.append((manifest['root_dir'], app.root_dir))
+    # Relocate the longest paths first, in case the output directory is
+    # inside the website's root.
+    path_map.sort(key=lambda i: len(i[0]), reverse=True)
+
+    records_path = os.path.join(
+        cache_dir, 'baker', manifest['records_name'])
+    if path_map:
+        logger.debug("Relocating cache from: %s" % manifest['root_dir'])
+        _relocate_cache_files(cache_dir, path_map, records_path)
+
+    # The configuration's cache key depends on where the configuration
+    # files are, so it's different here even if they're the same files.
+    old_config_key = manifest['config_cache_key']
+    new_config_key = _get_config_cache_key(app)
+    config_cache_path = os.path.join(cache_dir, 'app', 'config.json')
+    if os.path.isfile(config_cache_path):
+        with open(config_cache_path, 'r', encoding='utf8') as fp:
+            config_values = json.load(
+                fp, object_pairs_hook=collections.OrderedDict)
+        if config_values.get('__cache_key') == old_config_key:
+            config_values['__cache_key'] = new_config_key
+            st = os.stat(config_cache_path)
+            with open(config_cache_path, 'w', encoding='utf8') as fp:
+                json.dump(config_values, fp)
+            os.utime(config_cache_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        else:
+            os.remove(config_cache_path)
+
+    if os.path.isfile(records_path):
+        records = load_records(records_path)
+        records.loadAllEntries()
+        _relocate_object(records, path_map, {})
+
+        config_values = records.config_values
+        if (config_values is not None and
+                config_values.get('__cache_key') == old_config_key):
+            config_values['__cache_key'] = new_config_key
+
+        os.remove(records_path)
+        save_bake_records(records,
+                          os.path.join(cache_dir, 'baker',
+                                       get_bake_records_name(out_dir)),
+                          rotate_previous=False)
+
+
+def _read_manifest(tf):
+    try:
+        fp = tf.extractfile(MANIFEST_NAME)
+    except KeyError:
+        fp = None
+    except (OSError, EOFError, zlib.error, tarfile.TarError) as ex:
+        raise CacheArchiveError("Can't read cache archive: %s" % ex)
+    if fp is None:
+        raise CacheArchiveError("Not a PieCrust cache archive.")
+    with fp:
+        try:
+            manifest = json.loads(fp.read().decode('utf8'))
+        except (OSError, EOFError, zlib.error, ValueError) as ex:
+            raise CacheArchiveError(
+                "Can't read cache archive manifest: %s" % ex)
+
+    if manifest.get('version') != ARCHIVE_VERSION:
+        raise CacheArchiveError(
+            "Unsupported cache archive version: %s" %
+            manifest.get('version'))
+    if (manifest['app_version'] != APP_VERSION or
+            manifest['cache_version'] != CACHE_VERSION):
+        raise CacheArchiveError(
+            "Cache archive was made with a different version of PieCrust "
+            "(%s), it can't be used with this one (%s)." %
+            (manifest['app_version'], APP_VERSION))
+    return manifest
+
+
+def _get_config_cache_key(app):
+    values = app.config.getLoadedValues()
+    if values is None:
+        return None
+    return values.get('__cache_key')
+
+
+def _get_input_paths(app, out_dir):
+    skipped_dirs = [
+        os.path.join(app.root_dir, CACHE_DIR),
+        os.path.abspath(out_dir)]
+    for dirpath, dirnames, filenames in os.walk(app.root_dir):
+        dirnames[:] = [
+            d for d in dirnames
+            if (not d.startswith('.') and
+                os.path.join(dirpath, d) not in skipped_dirs)]
+        for fn in filenames:
+            yield os.path.join(dirpath, fn)
+
+
+def _relocate_cache_files(cache_dir, path_map, records_path):
+    for dirpath, _, filenames in os.walk(cache_dir):
+        rel_dir = os.path.relpath(dirpath, cache_dir)
+        cache_name = rel_dir.split(os.sep)[0]
+        for fn in filenames:
+            path = os.path.join(dirpath, fn)
+            if path == records_path or fn.endswith(('-wal', '-shm')):
+                continue
+            pickled = (cache_name in _PICKLED_CACHES or
+                       fn.endswith('.pickle'))
+            if fn == PackedCache.DB_FILENAME:
+                _relocate_packed_cache(path, path_map, pickled)
+            else:
+                _relocate_cache_file(path, path_map, pickled)
+
+
+def _relocate_packed_cache(path, path_map, pickled):
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            rows = conn.execute(
+                "SELECT key, time, data FROM items").fetchall()
+            conn.execute("DELETE FROM items")
+            conn.executemany(
+                "INSERT OR REPLACE INTO items VALUES (?, ?, ?)",
+                [(_relocate_cache_key(k, path_map), t,
+                  _relocate_data(d, path_map, pickled))
+                 for k, t, d in rows])
+    finally:
+        conn.close()
+
+
+def _relocate_cache_file(path, path_map, pickled):
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    new_data = _relocate_data(data, path_map, pickled)
+    if new_data is not data:
+        # Keep the original modification time, since that's what the
+        # file-system caches use to know if an item is still valid.
+        st = os.stat(path)
+        with open(path, 'wb') as fp:
+            fp.write(new_data)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def _relocate_data(data, path_map, pickled):
+    """ Relocates the paths in some cached data, which is either pickled
+        objects, or text. Returns the same object if nothing changed.
+    """
+    if isinstance(data, str):
+        new_text = _relocate_text(data, path_map)
+        return new_text if new_text != data else data
+
+    if pickled:
+        try:
+            obj = pickle.loads(data)
+        except Exception:
+            pass
+        else:
+            new_data = pickle.dumps(
+                _relocate_object(obj, path_map, {}),
+                pickle.HIGHEST_PROTOCOL)
+            return new_data if new_data != data else data
+
+    try:
+        text = data.decode('utf8')
+    except UnicodeDecodeError:
+        return data
+    new_text = _relocate_text(text, path_map)
+    return new_text.encode('utf8') if new_text != text else data
+
+
+def _relocate_text(text, path_map):
+    # Like `_relocate_path`, only replace whole paths, or the beginning
+    # of longer paths, and not other paths that merely start the same.
+    for old_path, new_path in path_map:
+        pattern = r'(?<![\w.\-/\\])%s(?![\w.\-])' % re.escape(old_path)
+        text = re.sub(pattern, lambda m: new_path, text)
+    return text
+
+
+def _relocate_cache_key(key, path_map):
+    # Page cache keys look like `source_name@item_spec`.
+    name, sep, spec = key.partition('@')
+    if sep:
+        return name + sep + _relocate_path(spec, path_map)
+    return _relocate_path(key, path_map)
+
+
+def _relocate_path(path, path_map):
+    for old_path, new_path in path_map:
+        if path == old_path or path.startswith(old_path + os.sep):
+            return new_path + path[len(old_path):]
+    return path
+
+
+def _relocate_object(obj, path_map, memo):
+    if isinstance(obj, str):
+        return _relocate_path(obj, path_map)
+    if obj is None or isinstance(obj, (bytes, int, float, bool)):
+        return obj
+
+    obj_id = id(obj)
+    if obj_id in memo:
+        return memo[obj_id]
+
+    if isinstance(obj, dict):
+        memo[obj_id] = obj
+        items = list(obj.items())
+        obj.clear()
+        for k, v in items:
+            obj[_relocate_object(k, path_map, memo)] = \
+                _relocate_object(v, path_map, memo)
+        return obj
+
+    if isinstance(obj, list):
+        memo[obj_id] = obj
+        obj[:] = [_relocate_object(v, path_map, memo) for v in obj]
+        return obj
+
+    if isinstance(obj, (tuple, set, frozenset)):
+        values = [_relocate_object(v, path_map, memo) for v in obj]
+        if hasattr(obj, '_fields'):
+            res = obj.__class__(*values)
+        else:
+            res = obj.__class__(values)
+        memo[obj_id] = res
+        return res
+
+    # Some other object... relocate its attributes.
+    memo[obj_id] = obj
+    attr_names = set(getattr(obj, '__dict__', {}).keys())
+    for cls in obj.__class__.__mro__:
+        slots = cls.__dict__.get('__slots__', ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        attr_names.update(slots)
+    for name in attr_names:
+        if name in ('__dict__', '__weakref__'):
+            continue
+        try:
+            val = getattr(obj, name)
+        except AttributeError:
+            continue
+        new_val = _relocate_object(val, path_map, memo)
+        if new_val is not val:
+            try:
+                setattr(obj, name, new_val)
+            except AttributeError:
+                pass
+    return obj
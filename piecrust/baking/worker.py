@@ -1,5 +1,6 @@
 import time
 import logging
+from piecrust.environment import ExecutionStats
 from piecrust.pipelines.base import (
     PipelineManager, PipelineJobRunContext,
     get_pipeline_name_for_source)
@@ -14,13 +15,28 @@ logger = logging.getLogger(__name__)
 class BakeWorkerContext(object):
     def __init__(self, appfactory, out_dir, *,
                  force=False, previous_records_path=None,
-                 allowed_pipelines=None, forbidden_pipelines=None):
+                 allowed_pipelines=None, forbidden_pipelines=None,
+                 app=None, previous_records=None, ppmngr=None):
         self.appfactory = appfactory
         self.out_dir = out_dir
         self.force = force
         self.previous_records_path = previous_records_path
         self.allowed_pipelines = allowed_pipelines
         self.forbidden_pipelines = forbidden_pipelines
+        # When workers are forked from the main process, they can re-use
+        # its app and previous records instead of loading their own.
+        self.app = app
+        self.previous_records = previous_records
+        # When workers are threads in the main process (or when jobs run
+        # right on the main thread), they can also re-use its pipelines.
+        self.ppmngr = ppmngr
+
+    def __getstate__(self):
+        # Workers that aren't forked from the main process (like the ones
+        # started by a fork server) have to load their own stuff.
+        state = dict(self.__dict__)
+        state.update(app=None, previous_records=None, ppmngr=None)
+        return state
 
 
 class BakeWorker(IWorker):
@@ -29,28 +45,52 @@ class BakeWorker(IWorker):
         self.app = None
         self.stats = None
         self.previous_records = None
+        self.ppmngr = None
         self._work_start_time = time.perf_counter()
-        self._sources = {}
-        self._ppctx = None
 
     def initialize(self):
-        # Create the app local to this worker.
-        app = self.ctx.appfactory.create()
+        if self.ctx.ppmngr is not None:
+            self._initializeThread()
+            return
+
+        # Create the app local to this worker, unless we inherited an
+        # already loaded one from the main process.
+        if self.ctx.app is not None:
+            app = self.ctx.app
+            app.env.stats.reset()
+            app.env.resetCacheStats()
+        else:
+            app = self.ctx.appfactory.create()
         app.config.set('baker/is_baking', True)
         app.config.set('baker/worker_id', self.wid)
         app.config.set('site/asset_url_format', '%page_uri%/%filename%')
-
+        app.cache.setDurability(app.config.get('baker/cache_durability'))
+        worker_budget = app.config.get('baker/worker_cache_memory')
+        if worker_budget is None:
+            worker_budget = app.config.get('baker/cache_memory')
+        app.env.setCacheMemoryBudgets(worker_budget)
+
+        # Only the main page's segments are saved in the file-system cache,
+        # but the segments of any other page we render (e.g. in a listing)
+        # are shared with the other workers, so they don't have to render
+        # them again.
         app.env.fs_cache_only_for_main_page = True
+        app.env.rendered_segments_repository.shared_cache = \
+            app.cache.getPackedCache('shared_renders', batch_size=1)
 
         stats = app.env.stats
-        stats.registerTimer("Worker_%d_Total" % self.wid)
-        stats.registerTimer("Worker_%d_Init" % self.wid)
+        stats.registerTimer("Worker_%d_Total" % self.wid,
+                            raise_if_registered=False)
+        stats.registerTimer("Worker_%d_Init" % self.wid,
+                            raise_if_registered=False)
 
         self.app = app
         self.stats = stats
 
         # Load previous record
-        if self.ctx.previous_records_path:
+        if self.ctx.previous_records is not None:
+            previous_records = self.ctx.previous_records
+        elif self.ctx.previous_records_path:
             previous_records = load_records(self.ctx.previous_records_path)
         else:
             previous_records = MultiRecord()
@@ -77,6 +117,25 @@ class BakeWorker(IWorker):
         stats.stepTimerSince(
             "Worker_%d_Init" % self.wid, self._work_start_time)
 
+    def _initializeThread(self):
+        # We're running in the main process, so we share its app, records
+        # and pipelines. We only keep our own stats, since
+        # the pipelines already report theirs to the app.
+        self.app = self.ctx.app
+        self.previous_records = self.ctx.previous_records
+        self.ppmngr = self.ctx.ppmngr
+
+        stats = ExecutionStats()
+        stats.registerTimer("Worker_%d_Total" % self.wid)
+        stats.registerTimer("Worker_%d_Init" % self.wid)
+        for ppinfo in self.ppmngr.getPipelineInfos():
+            stats.registerTimer("PipelineJobs_%s" % ppinfo.pipeline_name,
+                                raise_if_registered=False)
+        self.stats = stats
+
+        stats.stepTimerSince(
+            "Worker_%d_Init" % self.wid, self._work_start_time)
+
     def process(self, job):
         source_name, item_spec = job['job_spec']
         logger.debug("Received job: %s@%s" % (source_name, item_spec))
@@ -91,19 +150,36 @@ class BakeWorker(IWorker):
         }
         pp.run(job, runctx, ppres)
 
-        # Log time spent in this pipeline.
+        # Log time spent in this pipeline, and send it back so the master
+        # process can schedule this job better next time.
         self.stats.stepTimerSince("PipelineJobs_%s" % pp.PIPELINE_NAME,
                                   job_start)
+        ppres['job_time'] = time.perf_counter() - job_start
 
         return ppres
 
     def getStats(self):
-        stats = self.app.env.stats
+        stats = self.stats
         stats.stepTimerSince("Worker_%d_Total" % self.wid,
                              self._work_start_time)
+
+        # Tell the main process what settings we read, unless we're sharing
+        # its app (in which case it already knows).
+        if self.ctx.ppmngr is None:
+            stats.registerManifest('ConfigKeysUsed',
+                                   raise_if_registered=False)
+            for k in sorted(self.app.config.getUsedKeys()):
+                stats.addManifestEntry('ConfigKeysUsed', k)
+
+            # Also report how our own in-memory caches did.
+            self.app.env.reportCacheStats()
         return stats
 
     def shutdown(self):
-        for src, pp in self._sources.values():
-            pp.shutdown(self._ppctx)
+        # Make sure the pipelines are done writing their outputs before
+        # this worker goes away. Pipelines shared with the main process
+        # are shut down by the baker.
+        if self.ctx.ppmngr is None and self.ppmngr is not None:
+            self.ppmngr.shutdownPipelines()
+            self.app.cache.flush()
 
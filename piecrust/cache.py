@@ -1,10 +1,17 @@
 import os
 import os.path
+import sys
+import time
 import shutil
 import pickle
+import sqlite3
 import hashlib
 import logging
+import threading
+import collections
 import repoze.lru
+from piecrust.chefutil import format_timed_scope
+from piecrust.configuration import ConfigurationError
 
 
 logger = logging.getLogger(__name__)
@@ -14,6 +21,8 @@ class ExtensibleCache(object):
     def __init__(self, base_dir):
         self.base_dir = base_dir
         self.caches = {}
+        self.packed_caches = {}
+        self.writer = None
 
     @property
     def enabled(self):
@@ -26,13 +35,45 @@ class ExtensibleCache(object):
             if not os.path.isdir(c_dir):
                 os.makedirs(c_dir, 0o755)
 
-            c = SimpleCache(c_dir)
+            c = SimpleCache(c_dir, writer=self.writer)
             self.caches[name] = c
         return c
 
+    def getPackedCache(self, name, batch_size=256):
+        c = self.packed_caches.get(name)
+        if c is None:
+            c_dir = os.path.join(self.base_dir, name)
+            if not os.path.isdir(c_dir):
+                os.makedirs(c_dir, 0o755)
+
+            c = PackedCache(c_dir, batch_size=batch_size)
+            self.packed_caches[name] = c
+        return c
+
     def getCacheDir(self, name):
         return os.path.join(self.base_dir, name)
 
+    def setDurability(self, mode):
+        """ Sets how cache files are written. With `sync`, each file is
+            synced to disk as soon as it's written. With `write_behind`,
+            files are written on a background thread, and only synced to
+            disk when `flush` is called.
+        """
+        if mode == 'write_behind':
+            if self.writer is None:
+                self.writer = BackgroundCacheWriter()
+                for c in self.caches.values():
+                    c.writer = self.writer
+        elif mode in (None, 'sync'):
+            if self.writer is not None:
+                self.writer.flush()
+                self.writer = None
+                for c in self.caches.values():
+                    c.writer = None
+        else:
+            raise ConfigurationError(
+                "Unknown cache durability mode: %s" % mode)
+
     def getCacheNames(self, except_names=None):
         _, dirnames, __ = next(os.walk(self.base_dir))
         if except_names is None:
@@ -40,6 +81,14 @@ class ExtensibleCache(object):
         return [dn for dn in dirnames if dn not in except_names]
 
     def clearCache(self, name):
+        packed_cache = self.packed_caches.get(name)
+        if packed_cache is not None:
+            packed_cache.close(discard=True)
+
+        # Don't let pending writes re-create files after we're done.
+        if self.writer is not None:
+            self.writer.wait()
+
         cache_dir = self.getCacheDir(name)
         if os.path.isdir(cache_dir):
             logger.debug("Cleaning cache: %s" % cache_dir)
@@ -53,10 +102,17 @@ class ExtensibleCache(object):
         for name in self.getCacheNames(except_names=except_names):
             self.clearCache(name)
 
+    def flush(self):
+        for c in self.packed_caches.values():
+            c.flush()
+        if self.writer is not None:
+            self.writer.flush()
+
 
 class SimpleCache(object):
-    def __init__(self, base_dir):
+    def __init__(self, base_dir, writer=None):
         self.base_dir = base_dir
+        self.writer = writer
         if not os.path.isdir(base_dir):
             raise Exception("Cache directory doesn't exist: %s" % base_dir)
 
@@ -73,6 +129,9 @@ class SimpleCache(object):
 
     def getCacheTime(self, path):
         cache_path = self.getCachePath(path)
+        pending = self._getPending(cache_path)
+        if pending is not None:
+            return pending[0]
         try:
             return os.path.getmtime(cache_path)
         except os.error:
@@ -80,18 +139,38 @@ class SimpleCache(object):
 
     def has(self, path):
         cache_path = self.getCachePath(path)
+        if self._getPending(cache_path) is not None:
+            return True
         return os.path.isfile(cache_path)
 
     def read(self, path):
+        pending = self._getPending(self.getCachePath(path))
+        if pending is not None:
+            return pending[1]
         with self.openRead(path, mode='r', encoding='utf8') as fp:
             return fp.read()
 
+    def readBytes(self, path):
+        pending = self._getPending(self.getCachePath(path))
+        if pending is not None:
+            return pending[1]
+        with self.openRead(path, mode='rb') as fp:
+            return fp.read()
+
     def openRead(self, path, mode='r', encoding=None):
         cache_path = self.getCachePath(path)
         return open(cache_path, mode=mode, encoding=encoding)
 
     def write(self, path, content):
-        with self.openWrite(path, mode='w', encoding='utf8') as fp:
+        if self.writer is not None:
+            self.writer.queueWrite(self.getCachePath(path), content)
+            return
+
+        if isinstance(content, bytes):
+            mode, encoding = 'wb', None
+        else:
+            mode, encoding = 'w', 'utf8'
+        with self.openWrite(path, mode=mode, encoding=encoding) as fp:
             fp.write(content)
             fp.flush()
             os.fsync(fp)
@@ -108,6 +187,277 @@ class SimpleCache(object):
             path = '__index__' + path
         return os.path.join(self.base_dir, path)
 
+    def _getPending(self, cache_path):
+        if self.writer is not None:
+            return self.writer.getPending(cache_path)
+        return None
+
+
+class BackgroundCacheWriter(object):
+    """ Writes cache files on a background thread, without syncing each
+        of them to disk. Files are written to a temporary file first, and
+        then moved into place, so that a bake that gets killed doesn't
+        leave partially written files behind.
+    """
+    def __init__(self):
+        self._pending = collections.OrderedDict()
+        self._written = set()
+        self._initThread()
+
+    def queueWrite(self, path, content):
+        self._ensureThread()
+        with self._cond:
+            self._pending[path] = (time.time(), content)
+            self._cond.notify_all()
+
+    def getPending(self, path):
+        self._ensureThread()
+        with self._cond:
+            return self._pending.get(path)
+
+    def wait(self):
+        """ Waits until all pending files are written.
+        """
+        self._ensureThread()
+        with self._cond:
+            while self._pending:
+                self._cond.wait()
+
+    def flush(self):
+        """ Waits until all pending files are written, and syncs them
+            to disk.
+        """
+        self.wait()
+        with self._cond:
+            written = self._written
+            self._written = set()
+        if not written:
+            return
+
+        # Sync the files we wrote, and then the directories they're in, so
+        # that they're also properly moved into place. Directories can't be
+        # synced on Windows.
+        dirnames = set()
+        with format_timed_scope(
+                logger, "synced %d cache files" % len(written),
+                level=logging.DEBUG, colored=False):
+            for path in written:
+                _fsync_path(path, os.O_RDWR)
+                dirnames.add(os.path.dirname(path))
+            if os.name != 'nt':
+                for dirname in dirnames:
+                    _fsync_path(dirname, os.O_RDONLY)
+
+    def _initThread(self):
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = os.getpid()
+
+    def _ensureThread(self):
+        if self._pid != os.getpid():
+            # We're in a forked process: our parent will write what was
+            # pending, and our thread didn't survive the fork anyway.
+            self._pending = collections.OrderedDict()
+            self._written = set()
+            self._initThread()
+
+        if self._thread is None:
+            self._thread = threading.Thread(
+                name='CacheWriter', daemon=True, target=self._run)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                path, item = next(iter(self._pending.items()))
+
+            try:
+                _write_file_atomically(path, item[1])
+            except Exception as ex:
+                logger.warning("Couldn't write cache file '%s': %s" %
+                               (path, ex))
+
+            with self._cond:
+                # Only forget about this file if it wasn't written again
+                # in the meantime.
+                if self._pending.get(path) is item:
+                    del self._pending[path]
+                self._written.add(path)
+                self._cond.notify_all()
+
+
+def _fsync_path(path, flags):
+    try:
+        fd = os.open(path, flags)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_file_atomically(path, content):
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname, 0o755, exist_ok=True)
+
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    if isinstance(content, bytes):
+        with open(tmp_path, 'wb') as fp:
+            fp.write(content)
+    else:
+        with open(tmp_path, 'w', encoding='utf8') as fp:
+            fp.write(content)
+    os.replace(tmp_path, path)
+
+
+class PackedCache(object):
+    """ A cache that keeps all its items in a single SQLite database,
+        instead of one file per item. The database is memory-mapped, and
+        can be shared by several processes.
+
+        Items are written in batches: they're only visible to other
+        processes once `batch_size` of them were written, or once `flush`
+        is called. With a `batch_size` of 1, items are visible as soon as
+        they're written.
+    """
+    DB_FILENAME = 'packed.db'
+    MMAP_SIZE = 256 * 1024 * 1024
+    WAL_RETRIES = 100
+
+    def __init__(self, base_dir, batch_size=256):
+        self.base_dir = base_dir
+        self.batch_size = batch_size
+        self._pending = {}
+        self._conn = None
+        self._conn_pid = None
+        self._lock = threading.Lock()
+
+    def isValid(self, path, time):
+        cache_time = self.getCacheTime(path)
+        if cache_time is None:
+            return False
+        if isinstance(time, list):
+            for t in time:
+                if cache_time < t:
+                    return False
+            return True
+        return cache_time >= time
+
+    def getCacheTime(self, path):
+        row = self._get(path, 'time')
+        if row is None:
+            return None
+        return row[0]
+
+    def has(self, path):
+        return self._get(path, 'time') is not None
+
+    def read(self, path):
+        row = self._get(path, 'data')
+        if row is None:
+            raise KeyError("No such cache item: %s" % path)
+        return row[1]
+
+    def readBytes(self, path):
+        return self.read(path)
+
+    def write(self, path, content):
+        with self._lock:
+            self._pending[path] = (time.time(), content)
+            if len(self._pending) >= self.batch_size:
+                self._flushPending()
+
+    def flush(self):
+        with self._lock:
+            if self._pending:
+                self._flushPending()
+
+    def initialize(self):
+        """ Creates the database, if needed. This should be done before
+            several processes start using it at the same time.
+        """
+        with self._lock:
+            self._getConnection()
+
+    def close(self, discard=False):
+        with self._lock:
+            if discard:
+                self._pending = {}
+            elif self._pending:
+                self._flushPending()
+            if self._conn is not None and self._conn_pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+    def getCachePath(self, path):
+        raise Exception("Packed caches don't have paths for their items.")
+
+    def _get(self, path, column):
+        with self._lock:
+            item = self._pending.get(path)
+            if item is not None:
+                return item
+
+            conn = self._getConnection()
+            rows = conn.execute(
+                "SELECT time, %s FROM items WHERE key = ?" % column,
+                (path,)).fetchall()
+            if rows:
+                return rows[0]
+            return None
+
+    def _flushPending(self):
+        items = [(k, t, c) for k, (t, c) in self._pending.items()]
+        self._pending = {}
+        try:
+            conn = self._getConnection()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO items VALUES (?, ?, ?)", items)
+        except sqlite3.Error as ex:
+            # It's only a cache... those items will just be written again
+            # next time.
+            logger.warning("Couldn't write %d items to cache '%s': %s" %
+                           (len(items), self.base_dir, ex))
+
+    def _getConnection(self):
+        # Connections can't be shared with forked worker processes.
+        if self._conn is None or self._conn_pid != os.getpid():
+            path = os.path.join(self.base_dir, self.DB_FILENAME)
+            conn = sqlite3.connect(path, timeout=30,
+                                   check_same_thread=False)
+            self._setWALMode(conn)
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA mmap_size = %d" % self.MMAP_SIZE)
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS items "
+                    "(key TEXT PRIMARY KEY, time REAL, data BLOB)")
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def _setWALMode(self, conn):
+        # Changing the journal mode needs an exclusive lock, which fails
+        # right away (without waiting on the busy timeout) if other
+        # processes are using the database. This happens when several
+        # workers open a brand new cache at the same time, so only do it
+        # if the database isn't already set up, and retry for a bit.
+        for i in range(self.WAL_RETRIES):
+            try:
+                mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+                if mode.lower() != 'wal':
+                    conn.execute("PRAGMA journal_mode = WAL")
+                return
+            except sqlite3.OperationalError:
+                if i == self.WAL_RETRIES - 1:
+                    raise
+                time.sleep(0.05)
+
 
 class NullCache(object):
     def isValid(self, path, time):
@@ -122,6 +472,9 @@ class NullCache(object):
     def read(self, path):
         raise Exception("Null cache has no data.")
 
+    def readBytes(self, path):
+        raise Exception("Null cache has no data.")
+
     def write(self, path, content):
         pass
 
@@ -140,6 +493,12 @@ class NullExtensibleCache(object):
     def getCache(self, name):
         return self.null_cache
 
+    def getPackedCache(self, name, batch_size=256):
+        return self.null_cache
+
+    def setDurability(self, mode):
+        pass
+
     def getCacheDir(self, name):
         raise NotImplementedError()
 
@@ -152,6 +511,9 @@ class NullExtensibleCache(object):
     def clearCaches(self, except_names=None):
         pass
 
+    def flush(self):
+        pass
+
 
 def _make_fs_cache_key(key):
     return hashlib.md5(key.encode('utf8')).hexdigest()
@@ -160,20 +522,64 @@ def _make_fs_cache_key(key):
 class MemCache(object):
     """ Simple memory cache. It can be backed by a simple file-system
         cache, but items need to be pickle-able to do this.
+
+        By default, it keeps up to `size` items. If it's given a memory
+        budget with `setMaxBytes`, it keeps as many items as fit in that
+        budget instead, using `size_getter` to estimate how big they are.
+
+        It can also have a `shared_cache`, i.e. a cache shared with other
+        processes, in which items that aren't saved to the file-system
+        cache are published, and where items are looked for after the
+        file-system cache.
     """
-    def __init__(self, size=2048):
+    def __init__(self, size=2048, size_getter=None):
         self.cache = repoze.lru.LRUCache(size)
         self.fs_cache = None
+        self.shared_cache = None
+        self.size = size
+        self.size_getter = size_getter or get_data_size
         self._last_access_hit = None
         self._invalidated_fs_items = set()
         self._missed_keys = []
         self._misses = 0
         self._hits = 0
+        self._shared_hits = 0
 
     @property
     def last_access_hit(self):
         return self._last_access_hit
 
+    @property
+    def item_count(self):
+        return len(self.cache.data)
+
+    @property
+    def evictions(self):
+        return self.cache.evictions
+
+    @property
+    def max_bytes(self):
+        return getattr(self.cache, 'max_bytes', None)
+
+    @property
+    def resident_bytes(self):
+        return getattr(self.cache, 'resident_bytes', None)
+
+    def setMaxBytes(self, max_bytes):
+        if max_bytes == self.max_bytes:
+            return
+        if max_bytes:
+            self.cache = SizedLRUCache(max_bytes, self.size_getter)
+        else:
+            self.cache = repoze.lru.LRUCache(self.size)
+
+    def resetStats(self):
+        self.cache.evictions = 0
+        self._missed_keys = []
+        self._misses = 0
+        self._hits = 0
+        self._shared_hits = 0
+
     def invalidate(self, key):
         logger.debug("Invalidating cache item '%s'." % key)
         self.cache.invalidate(key)
@@ -182,14 +588,20 @@ class MemCache(object):
             fs_key = _make_fs_cache_key(key)
             self._invalidated_fs_items.add(fs_key)
 
+    def clear(self):
+        self.cache.clear()
+        self._invalidated_fs_items = set()
+
     def put(self, key, item, save_to_fs=True):
         self.cache.put(key, item)
-        if self.fs_cache and save_to_fs:
+        if self.fs_cache is not None:
             fs_key = _make_fs_cache_key(key)
-            with self.fs_cache.openWrite(fs_key, mode='wb') as fp:
-                pickle.dump(item, fp, pickle.HIGHEST_PROTOCOL)
-                fp.flush()
-                os.fsync(fp)
+            if save_to_fs:
+                self.fs_cache.write(
+                    fs_key, pickle.dumps(item, pickle.HIGHEST_PROTOCOL))
+            elif self.shared_cache is not None:
+                self.shared_cache.write(
+                    fs_key, pickle.dumps(item, pickle.HIGHEST_PROTOCOL))
 
     def get(self, key, item_maker, fs_cache_time=None, save_to_fs=True):
         self._last_access_hit = True
@@ -204,15 +616,21 @@ class MemCache(object):
                     "No file-system cache time was given for '%s'. "
                     "This would result in degraded performance." % key)
 
-            # Try first from the file-system cache.
+            # Try first from the file-system cache, and then from the
+            # cache shared with other processes.
             fs_key = _make_fs_cache_key(key)
-            if (fs_key not in self._invalidated_fs_items and
-                    self.fs_cache.isValid(fs_key, fs_cache_time)):
-                with self.fs_cache.openRead(fs_key, mode='rb') as fp:
-                    item = pickle.load(fp)
-                self.cache.put(key, item)
-                self._hits += 1
-                return item
+            if fs_key not in self._invalidated_fs_items:
+                item = self._loadItem(
+                    self.fs_cache, key, fs_key, fs_cache_time)
+                if item is None and self.shared_cache is not None:
+                    item = self._loadItem(
+                        self.shared_cache, key, fs_key, fs_cache_time)
+                    if item is not None:
+                        self._shared_hits += 1
+                if item is not None:
+                    self.cache.put(key, item)
+                    self._hits += 1
+                    return item
 
         # Look into the mem-cache.
         item = item_maker()
@@ -221,12 +639,406 @@ class MemCache(object):
         self._misses += 1
         self._missed_keys.append(key)
 
-        # Save to the file-system if needed.
-        if self.fs_cache is not None and save_to_fs:
-            with self.fs_cache.openWrite(fs_key, mode='wb') as fp:
-                pickle.dump(item, fp, pickle.HIGHEST_PROTOCOL)
-                fp.flush()
-                os.fsync(fp)
+        # Save to the file-system if needed, or at least share it with
+        # other processes.
+        if self.fs_cache is not None:
+            if save_to_fs:
+                self.fs_cache.write(
+                    fs_key, pickle.dumps(item, pickle.HIGHEST_PROTOCOL))
+            elif self.shared_cache is not None:
+                self.shared_cache.write(
+                    fs_key, pickle.dumps(item, pickle.HIGHEST_PROTOCOL))
 
         return item
 
+    def _loadItem(self, cache, key, fs_key, fs_cache_time):
+        try:
+            if not cache.isValid(fs_key, fs_cache_time):
+                return None
+            return pickle.loads(cache.readBytes(fs_key))
+        except Exception as ex:
+            # The file could have been left corrupted by a bake that got
+            # killed, or a shared cache could be busy... either way, it's
+            # only a cache, so just re-create the item.
+            logger.debug("Can't read cache item '%s': %s" % (key, ex))
+            return None
+
+
+class SizedLRUCache(object):
+    """ An LRU cache that evicts items once their total estimated size
+        goes over a given number of bytes. The size of an item is estimated
+        when it's added, and again when it's accessed if it wasn't known
+        at first (i.e. if `size_getter` returned `None`).
+    """
+    UNKNOWN_ITEM_SIZE = 1024
+
+    def __init__(self, max_bytes, size_getter):
+        self.max_bytes = max_bytes
+        self.size_getter = size_getter
+        self.resident_bytes = 0
+        self.evictions = 0
+        self.data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return default
+            self.data.move_to_end(key)
+            if entry[2]:
+                # We didn't know how big this item was, maybe we do now.
+                self._setEntry(key, entry[0])
+                self._evict()
+            return entry[0]
+
+    def put(self, key, val):
+        with self._lock:
+            self._setEntry(key, val)
+            self._evict()
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self.data.pop(key, None)
+            if entry is not None:
+                self.resident_bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self.data = collections.OrderedDict()
+            self.resident_bytes = 0
+
+    def _setEntry(self, key, val):
+        size = self.size_getter(val)
+        is_size_unknown = size is None
+        if is_size_unknown:
+            size = self.UNKNOWN_ITEM_SIZE
+
+        prev_entry = self.data.get(key)
+        if prev_entry is not None:
+            self.resident_bytes -= prev_entry[1]
+        self.data[key] = (val, size, is_size_unknown)
+        self.data.move_to_end(key)
+        self.resident_bytes += size
+
+    def _evict(self):
+        # Always keep the most recent item, even if it's too big.
+        while self.resident_bytes > self.max_bytes and len(self.data) > 1:
+            _, (_, size, _) = self.data.popitem(last=False)
+            self.resident_bytes -= size
+            self.evictions += 1
+
+
+def get_data_size(obj):
+    """ Returns an estimate of how many bytes of memory some plain data
+        (strings, numbers, lists, dictionaries, etc.) takes.
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += get_data_size(k) + get_data_size(v)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for v in obj:
+            size += get_data_size(v)
+    return size
+
+
+class MtimeIndex(object):
+    """ Tells when files were last modified, based on their modification
+        times on disk.
+    """
+    def getMtime(self, path):
+        return os.path.getmtime(path)
+
+    def getFingerprint(self, path):
+        return _get_stat_fingerprint(os.stat(path))
+
+    def getDirFingerprint(self, path):
+        return None
+
+    def save(self):
+        pass
+
+
+class ContentHashIndex(object):
+    """ Tells when files were last modified, based on a persistent index of
+        their contents' hashes. A file whose contents didn't change keeps
+        the modification time it had when it was first indexed, even if it
+        was touched, checked out again, or restored from a backup.
+
+        Files are only hashed again when their size or modification time
+        on disk changes.
+    """
+    INDEX_FILENAME = 'content_hashes.pickle'
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._entries = None
+        self._dirty = False
+
+    def getMtime(self, path):
+        return self._getEntry(path)[3]
+
+    def getFingerprint(self, path):
+        return self._getEntry(path)[2]
+
+    def getDirFingerprint(self, path):
+        return None
+
+    def save(self):
+        if not self._dirty or not isinstance(self.cache, SimpleCache):
+            return
+        # Write to a temporary file first so that worker processes never
+        # read a partially written index.
+        tmp_path = '%s.%d.tmp' % (self.INDEX_FILENAME, os.getpid())
+        with self.cache.openWrite(tmp_path, mode='wb') as fp:
+            pickle.dump(self._entries, fp, pickle.HIGHEST_PROTOCOL)
+        os.replace(self.cache.getCachePath(tmp_path),
+                   self.cache.getCachePath(self.INDEX_FILENAME))
+        self._dirty = False
+
+    def _getEntry(self, path):
+        self._ensureLoaded()
+
+        st = os.stat(path)
+        entry = self._entries.get(path)
+        if (entry is not None and
+                entry[0] == st.st_mtime_ns and entry[1] == st.st_size):
+            return entry
+
+        content_hash = get_file_hash(path)
+        if entry is not None and entry[2] == content_hash:
+            mtime = entry[3]
+        else:
+            mtime = st.st_mtime
+        entry = (st.st_mtime_ns, st.st_size, content_hash, mtime)
+        self._entries[path] = entry
+        self._dirty = True
+        return entry
+
+    def _ensureLoaded(self):
+        if self._entries is not None:
+            return
+
+        self._entries = {}
+        if self.cache.has(self.INDEX_FILENAME):
+            try:
+                with self.cache.openRead(self.INDEX_FILENAME,
+                                         mode='rb') as fp:
+                    self._entries = pickle.load(fp)
+            except Exception as ex:
+                logger.debug("Error loading content hash index: %s" % ex)
+
+
+class GitIndex(object):
+    """ Tells when files were last modified, using the Git repository the
+        website lives in to figure out what files changed since the last
+        time the index was saved. Files that Git says didn't change aren't
+        even looked at on disk, and keep the modification time they had
+        when they were first indexed.
+
+        Files outside of the repository, or outside of the given
+        directories, are always checked on disk.
+    """
+    INDEX_FILENAME = 'git_index.pickle'
+
+    def __init__(self, cache, root_dir, dirs):
+        self.cache = cache
+        self.root_dir = root_dir
+        self.dirs = [os.path.normpath(d) for d in dirs]
+        self._start_time = time.time()
+        self._entries = None
+        self._base_time = None
+        self._dirty_paths = set()
+        self._use_git_changes = False
+        self._tree_ids = {}
+        self._revision = None
+        self._loaded_state = None
+        self._git_root_dir = None
+        self._dirty = False
+
+    def getMtime(self, path):
+        return self._getEntry(path)[2]
+
+    def getFingerprint(self, path):
+        return repr(self._getEntry(path)[2])
+
+    def getDirFingerprint(self, path):
+        self._ensureLoaded()
+
+        path = os.path.normpath(path)
+        tree_id = self._tree_ids.get(path)
+        if tree_id is None:
+            return None
+
+        h = hashlib.md5(tree_id.encode('utf8'))
+        for p in sorted(self._dirty_paths):
+            if _is_path_in_dir(p, path):
+                try:
+                    fp = _get_stat_fingerprint(os.stat(p))
+                except OSError:
+                    fp = 'missing'
+                h.update(('%s:%s\n' % (p, fp)).encode('utf8'))
+        return h.hexdigest()
+
+    def save(self):
+        if (self._revision is None or
+                not isinstance(self.cache, SimpleCache)):
+            return
+        state = (self._revision, self._dirty_paths)
+        if not self._dirty and state == self._loaded_state:
+            return
+
+        data = {'revision': self._revision,
+                'dirty_paths': self._dirty_paths,
+                'base_time': self._base_time,
+                'entries': self._entries}
+        tmp_path = '%s.%d.tmp' % (self.INDEX_FILENAME, os.getpid())
+        with self.cache.openWrite(tmp_path, mode='wb') as fp:
+            pickle.dump(data, fp, pickle.HIGHEST_PROTOCOL)
+        os.replace(self.cache.getCachePath(tmp_path),
+                   self.cache.getCachePath(self.INDEX_FILENAME))
+        self._loaded_state = state
+        self._dirty = False
+
+    def _getEntry(self, path):
+        self._ensureLoaded()
+
+        path = os.path.normpath(path)
+        if (self._use_git_changes and
+                path not in self._dirty_paths and
+                any((_is_path_in_dir(path, d) for d in self.dirs))):
+            entry = self._entries.get(path)
+            if entry is None:
+                # Git says this file never changed since we started
+                # indexing this repository.
+                entry = (None, None, self._base_time)
+                self._entries[path] = entry
+                self._dirty = True
+            return entry
+
+        return self._statEntry(path)
+
+    def _statEntry(self, path):
+        st = os.stat(path)
+        entry = self._entries.get(path)
+        if (entry is not None and
+                entry[0] == st.st_mtime_ns and entry[1] == st.st_size):
+            return entry
+
+        entry = (st.st_mtime_ns, st.st_size, st.st_mtime)
+        self._entries[path] = entry
+        self._dirty = True
+        return entry
+
+    def _ensureLoaded(self):
+        if self._entries is not None:
+            return
+
+        self._entries = {}
+        data = None
+        if self.cache.has(self.INDEX_FILENAME):
+            try:
+                with self.cache.openRead(self.INDEX_FILENAME,
+                                         mode='rb') as fp:
+                    data = pickle.load(fp)
+                self._entries = data['entries']
+                self._loaded_state = (data['revision'], data['dirty_paths'])
+            except Exception as ex:
+                logger.debug("Error loading Git index: %s" % ex)
+                data = None
+
+        from piecrust.admin.scm.git import GitSourceControl
+        scm = GitSourceControl(self.root_dir, {})
+        try:
+            self._git_root_dir = scm.getRootDir()
+            repo_dir = self._mapRepoPath('')
+            self.dirs = [d for d in self.dirs
+                         if _is_path_in_dir(d, repo_dir)]
+            if not self.dirs:
+                logger.debug("Website isn't in a Git repository.")
+                return
+
+            pathspecs = [os.path.realpath(d) for d in self.dirs]
+            revision = scm.getRevision()
+            dirty_paths = self._mapRepoPaths(
+                scm.getChangedPaths(revision, pathspecs))
+            tree_ids = {
+                self._mapRepoPath(p): tid
+                for p, tid in scm.getTreeIds(pathspecs).items()}
+        except Exception as ex:
+            logger.debug("Can't get Git status, will check all files on "
+                         "disk: %s" % ex)
+            return
+
+        self._revision = revision
+        self._dirty_paths = dirty_paths
+        self._tree_ids = tree_ids
+        if data is None:
+            self._resetEntries()
+            return
+
+        # Everything that changed since the last time we saved the index,
+        # including files that were dirty back then, needs to be looked at
+        # again.
+        try:
+            changed = self._mapRepoPaths(
+                scm.getChangedPaths(data['revision'], pathspecs))
+        except Exception as ex:
+            # The last revision might not be available anymore, like in
+            # a shallow clone.
+            logger.debug("Can't get Git changes since revision %s, will "
+                         "check all files on disk: %s" %
+                         (data['revision'], ex))
+            self._resetEntries()
+            return
+        changed |= data['dirty_paths']
+
+        logger.debug("Git reports %d changed files since revision %s." %
+                     (len(changed), data['revision']))
+        for p in changed - dirty_paths:
+            try:
+                self._statEntry(p)
+            except OSError:
+                if self._entries.pop(p, None) is not None:
+                    self._dirty = True
+        self._base_time = data['base_time']
+        self._use_git_changes = True
+
+    def _resetEntries(self):
+        # Start indexing from scratch. Everything gets checked on disk this
+        # time, and files we don't look at until next time will be assumed
+        # to be as old as when we started using this index.
+        self._entries = {}
+        self._base_time = self._start_time
+        self._dirty = True
+
+    def _mapRepoPath(self, path):
+        # Git gives us real paths, but we want paths based on the website's
+        # root directory as we know it.
+        real_root_dir = os.path.realpath(self.root_dir)
+        return os.path.normpath(os.path.join(
+            self.root_dir,
+            os.path.relpath(os.path.join(self._git_root_dir, path),
+                            real_root_dir)))
+
+    def _mapRepoPaths(self, paths):
+        return set([self._mapRepoPath(p) for p in paths])
+
+
+def _get_stat_fingerprint(st):
+    return '%d:%d' % (st.st_mtime_ns, st.st_size)
+
+
+def _is_path_in_dir(path, dir_path):
+    return path == dir_path or path.startswith(dir_path + os.sep)
+
+
+def get_file_hash(path):
+    h = hashlib.md5()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(65536), b''):
+            h.update(chunk)
+    return h.hexdigest()
@@ -56,6 +56,10 @@ class BakeCommand(ChefCommand):
             '--profile',
             help="Run the bake several times, for profiling.",
             type=int, default=-1)
+        parser.add_argument(
+            '--watch',
+            help="Keep running, and re-bake whatever changes.",
+            action='store_true')
 
     def run(self, ctx):
         from piecrust.chefutil import format_timed
@@ -64,6 +68,9 @@ class BakeCommand(ChefCommand):
         out_dir = (ctx.args.output or
                    os.path.join(ctx.app.root_dir, '_counter'))
 
+        if ctx.args.watch:
+            return self._runWatch(ctx, out_dir)
+
         success = True
         avg_stats = ExecutionStats()
         avg_stats.registerTimer('Total')
@@ -110,14 +117,43 @@ class BakeCommand(ChefCommand):
         logger.info(format_timed(start_time, 'done baking'))
         return 0 if success else 1
 
-    def _doBake(self, ctx, out_dir):
-        from piecrust.baking.baker import Baker
+    def _runWatch(self, ctx, out_dir):
+        from piecrust.serving import procloop
+
+        if not hasattr(procloop, 'BakeWatchLoop'):
+            logger.error("Watching for changes requires `watchdog`.")
+            return 1
 
+        allowed_pipelines, forbidden_pipelines = self._getPipelines(ctx)
+        loop = procloop.BakeWatchLoop(
+            ctx.appfactory, out_dir,
+            force=ctx.args.force,
+            allowed_pipelines=allowed_pipelines,
+            forbidden_pipelines=forbidden_pipelines,
+            allowed_sources=ctx.args.sources,
+            config_overrides=self._getConfigOverrides(ctx))
+        loop.start()
+
+        try:
+            while True:
+                time.sleep(1)
+                loop.checkpointRecords()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            procloop.server_shutdown = True
+            loop.checkpointRecords(force=True)
+        return 0
+
+    def _getConfigOverrides(self, ctx):
+        overrides = {}
         if ctx.args.workers > 0:
-            ctx.app.config.set('baker/workers', ctx.args.workers)
+            overrides['baker/workers'] = ctx.args.workers
         if ctx.args.batch_size > 0:
-            ctx.app.config.set('baker/batch_size', ctx.args.batch_size)
+            overrides['baker/batch_size'] = ctx.args.batch_size
+        return overrides
 
+    def _getPipelines(self, ctx):
         allowed_pipelines = None
         forbidden_pipelines = None
         if ctx.args.html_only:
@@ -140,7 +176,15 @@ class BakeCommand(ChefCommand):
                 allowed_pipelines = None
             if not forbidden_pipelines:
                 forbidden_pipelines = None
+        return allowed_pipelines, forbidden_pipelines
+
+    def _doBake(self, ctx, out_dir):
+        from piecrust.baking.baker import Baker
+
+        for k, v in self._getConfigOverrides(ctx).items():
+            ctx.app.config.set(k, v)
 
+        allowed_pipelines, forbidden_pipelines = self._getPipelines(ctx)
         baker = Baker(
             ctx.appfactory, ctx.app, out_dir,
             force=ctx.args.force,
@@ -207,7 +251,6 @@ class ShowRecordCommand(ChefCommand):
             help="Show manifest entries from the records.")
 
     def run(self, ctx):
-        import fnmatch
         from piecrust.baking.baker import get_bake_records_path
         from piecrust.pipelines.records import load_records
 
@@ -268,19 +311,9 @@ class ShowRecordCommand(ChefCommand):
                         "`--pipelines`." % (rec.name, ppname))
                     continue
 
-                entries_to_show = []
-
-                for e in rec.getEntries():
-                    if ctx.args.fails and e.success:
-                        continue
-                    if in_pattern and not fnmatch.fnmatch(e.item_spec,
-                                                          in_pattern):
-                        continue
-                    if out_pattern and not any(
-                            [fnmatch.fnmatch(op, out_pattern)
-                             for op in e.getAllOutputPaths()]):
-                        continue
-                    entries_to_show.append(e)
+                entries_to_show = rec.queryEntries(
+                    spec_pattern=in_pattern, out_pattern=out_pattern,
+                    failed_only=ctx.args.fails)
 
                 if entries_to_show:
                     logger.info("Record: %s" % rec.name)
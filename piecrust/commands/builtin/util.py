@@ -65,6 +65,80 @@ class PurgeCommand(ChefCommand):
             shutil.rmtree(cache_dir)
 
 
+class CacheCommand(ChefCommand):
+    def __init__(self):
+        super(CacheCommand, self).__init__()
+        self.name = 'cache'
+        self.description = ("Exports or imports the website's cache, so "
+                            "it can be re-used somewhere else.")
+
+    def setupParser(self, parser, app):
+        subparsers = parser.add_subparsers()
+        p = subparsers.add_parser(
+            'export',
+            help="Writes the website's cache, and the records of the last "
+            "bake, to an archive.")
+        p.add_argument(
+            'archive',
+            help="The path of the archive to create.")
+        p.add_argument(
+            '-o', '--output',
+            help="The output directory of the bake to export "
+            "(defaults to `_counter`)")
+        p.set_defaults(sub_func=self._export)
+
+        p = subparsers.add_parser(
+            'import',
+            help="Replaces the website's cache with the one from an "
+            "archive created with `chef cache export`. Archives contain "
+            "pickled Python objects, which can run arbitrary code when "
+            "loaded, so only import archives that you trust.")
+        p.add_argument(
+            'archive',
+            help="The path of the archive to import.")
+        p.add_argument(
+            '-o', '--output',
+            help="The output directory of the next bake "
+            "(defaults to `_counter`)")
+        p.set_defaults(sub_func=self._import)
+
+    def run(self, ctx):
+        if not hasattr(ctx.args, 'sub_func'):
+            ctx.parser.parse_args(['cache', '--help'])
+            return
+        return ctx.args.sub_func(ctx)
+
+    def _export(self, ctx):
+        from piecrust.baking.cachearchive import (
+            export_cache, CacheArchiveError)
+
+        out_dir = (ctx.args.output or
+                   os.path.join(ctx.app.root_dir, '_counter'))
+        try:
+            manifest = export_cache(ctx.app, out_dir, ctx.args.archive)
+        except CacheArchiveError as ex:
+            logger.error(str(ex))
+            return 1
+        logger.info("Exported cache to: %s (%d files indexed)" %
+                    (ctx.args.archive, len(manifest['inputs'])))
+
+    def _import(self, ctx):
+        from piecrust.baking.cachearchive import (
+            import_cache, CacheArchiveError)
+
+        out_dir = (ctx.args.output or
+                   os.path.join(ctx.app.root_dir, '_counter'))
+        try:
+            same_count, changed_count = import_cache(
+                ctx.app, out_dir, ctx.args.archive)
+        except CacheArchiveError as ex:
+            logger.error(str(ex))
+            return 1
+        logger.info("Imported cache from: %s (%d files unchanged, "
+                    "%d files changed or added)" %
+                    (ctx.args.archive, same_count, changed_count))
+
+
 class ImportCommand(ChefCommand):
     def __init__(self):
         super(ImportCommand, self).__init__()
@@ -157,6 +157,46 @@ def try_get_dict_values(*args, default=None):
     return default
 
 
+def get_changed_dict_key_paths(old, new):
+    """ Returns the key paths of all the values that are different between
+        the two given dictionaries, including the ones that were added or
+        removed.
+    """
+    old_values = {}
+    new_values = {}
+    _recurse_flatten_dict(old, None, old_values)
+    _recurse_flatten_dict(new, None, new_values)
+
+    res = set()
+    missing = object()
+    for k in set(old_values.keys()) | set(new_values.keys()):
+        if old_values.get(k, missing) != new_values.get(k, missing):
+            res.add(k)
+    return res
+
+
+def _recurse_flatten_dict(cur, parent_path, out):
+    for k, v in cur.items():
+        key_path = k
+        if parent_path is not None:
+            key_path = parent_path + '/' + k
+
+        if isinstance(v, dict) and v:
+            _recurse_flatten_dict(v, key_path, out)
+        else:
+            out[key_path] = v
+
+
+def are_key_paths_related(path1, path2):
+    """ Returns whether the two given key paths point to the same value,
+        or if one points to a value that contains the other.
+    """
+    if path1 == path2 or not path1 or not path2:
+        return True
+    return (path1.startswith(path2 + '/') or
+            path2.startswith(path1 + '/'))
+
+
 def set_dict_value(d, key, value):
     bits = key.split('/')
     bitslen = len(bits)
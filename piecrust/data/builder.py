@@ -1,4 +1,5 @@
 import logging
+import collections.abc
 from piecrust.data.assetor import Assetor
 from piecrust.data.base import MergedMapping
 from piecrust.data.linker import Linker
@@ -62,7 +63,8 @@ def build_page_data(ctx):
 
     # TODO: handle slugified taxonomy terms.
 
-    site_data = app.config.getAll()
+    site_data = _SiteConfigData(app.env.render_ctx_stack,
+                                app.config.getAll())
     providers_data = DataProvidersData(page)
 
     # Put the site data first so that `MergedMapping` doesn't load stuff
@@ -87,6 +89,61 @@ def add_layout_data(page_data, contents):
     page_data._prependMapping(contents)
 
 
+class _SiteConfigData(collections.abc.Mapping):
+    """ Exposes the site configuration to templates, while keeping track
+        of which settings the page being rendered is using.
+    """
+    def __init__(self, render_ctx_stack, values, path=''):
+        self._render_ctx_stack = render_ctx_stack
+        self._values = values
+        self._path = path
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError("No such attribute: %s" % self._subp(name))
+
+    def __getitem__(self, name):
+        key_path = self._subp(name)
+        try:
+            val = self._values[name]
+        except KeyError:
+            # Not having the setting is also something we depend on.
+            self._addUsedKey(key_path)
+            raise
+
+        if isinstance(val, dict):
+            return _SiteConfigData(self._render_ctx_stack, val, key_path)
+        self._addUsedKey(key_path)
+        return val
+
+    def __iter__(self):
+        self._addUsedIterKey()
+        return iter(self._values)
+
+    def __len__(self):
+        self._addUsedIterKey()
+        return len(self._values)
+
+    def _subp(self, name):
+        if self._path:
+            return '%s/%s' % (self._path, name)
+        return name
+
+    def _addUsedIterKey(self):
+        # The root mapping gets enumerated by `MergedMapping` whenever the
+        # page data is merged, which doesn't mean the page depends on the
+        # whole configuration.
+        if self._path:
+            self._addUsedKey(self._path)
+
+    def _addUsedKey(self, key_path):
+        ctx = self._render_ctx_stack.current_ctx
+        if ctx is not None:
+            ctx.addUsedConfigKey(key_path)
+
+
 def get_default_pagination_source(page):
     app = page.app
     source_name = page.config.get('source') or page.config.get('blog')
@@ -78,9 +78,8 @@ class BlogDataProvider(DataProvider, collections.abc.Mapping):
 
     def _buildPosts(self):
         if self._posts is None:
-            it = PageIterator(self._sources[0], current_page=self._page)
-            self._onIteration()
-            self._posts = it
+            self._posts = PageIterator(self._sources[0],
+                                       current_page=self._page)
 
     def _buildArchives(self):
         if self._archives_built:
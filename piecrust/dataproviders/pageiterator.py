@@ -61,7 +61,6 @@ class PageIteratorDataProvider(DataProvider):
         super().__init__(source, page)
         self._app = source.app
         self._it = None
-        self._iterated = False
 
     def __len__(self):
         self._load()
@@ -77,14 +76,6 @@ class PageIteratorDataProvider(DataProvider):
 
         combined_source = _CombinedSource(list(reversed(self._sources)))
         self._it = PageIterator(combined_source, current_page=self._page)
-        self._it._load_event += self._onIteration
-
-    def _onIteration(self, it):
-        if not self._iterated:
-            rcs = self._app.env.render_ctx_stack
-            if rcs.current_ctx is not None:
-                rcs.current_ctx.addUsedSource(it._source)
-            self._iterated = True
 
     def _addSource(self, source):
         if self._it is not None:
@@ -306,6 +297,32 @@ class PageIterator:
             self._prev_page, self._next_page = (list(pn_it))
 
         self._load_event.fire(self)
+        self._addUsedItems()
+
+    def _addUsedItems(self):
+        # Tell the current page which items it's listing, and what settings
+        # could change what items get listed, so it only gets re-baked if
+        # any of that changes.
+        if not self._is_content_source:
+            return
+        rcs = self._source.app.env.render_ctx_stack
+        ctx = rcs.current_ctx
+        if ctx is None:
+            return
+
+        pages = [i._page for i in self._cache]
+        pages += [i._page for i in (self._prev_page, self._next_page)
+                  if i is not None]
+        setting_names = _get_used_setting_names(self._it)
+
+        if isinstance(self._source, _CombinedSource):
+            source_names = [s.name for s in self._source.sources]
+        else:
+            source_names = [self._source.name]
+        for sn in source_names:
+            item_specs = [p.content_spec for p in pages
+                          if p.source.name == sn]
+            ctx.addUsedSourceItems(sn, item_specs, setting_names)
 
     def _debugRenderDoc(self):
         return "Contains %d items" % len(self)
@@ -458,6 +475,26 @@ class PaginationDataBuilderIterator:
                 yield None
 
 
+def _get_used_setting_names(it):
+    # Walk the iterator chain and figure out what page settings are used
+    # for filtering and sorting. Page dates are always assumed to be used.
+    # If we don't know what an iterator does, return `None`.
+    names = []
+    while it is not None:
+        if isinstance(it, SettingSortIterator):
+            names.append(it.name)
+        elif isinstance(it, NoDraftsIterator):
+            names.append(it.no_draft_setting)
+        elif isinstance(it, (PageContentSourceIterator, _CombinedSource)):
+            break
+        elif not isinstance(it, (SliceIterator, DateSortIterator,
+                                 PruneFutureIterator,
+                                 PaginationDataBuilderIterator)):
+            return None
+        it = it.it
+    return names
+
+
 class GenericSourceIterator:
     def __init__(self, source):
         self.source = source
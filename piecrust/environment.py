@@ -2,6 +2,7 @@ import time
 import logging
 import datetime
 import contextlib
+from piecrust.configuration import ConfigurationError
 
 
 logger = logging.getLogger(__name__)
@@ -61,6 +62,14 @@ class ExecutionStats:
             v = self.manifests.setdefault(oc, [])
             self.manifests[oc] = v + ov
 
+    def reset(self):
+        for k in self.timers:
+            self.timers[k] = 0
+        for k in self.counters:
+            self.counters[k] = 0
+        for k in self.manifests:
+            self.manifests[k] = []
+
     def toData(self):
         return {
             'timers': self.timers.copy(),
@@ -76,14 +85,17 @@ class ExecutionStats:
 class Environment:
     def __init__(self):
         from piecrust.cache import MemCache
-        from piecrust.rendering import RenderingContextStack
+        from piecrust.page import get_page_size
+        from piecrust.rendering import (
+            RenderingContextStack, get_rendered_segments_size)
 
         self.app = None
         self.start_time = None
         self.start_datetime = None
         self.was_cache_cleaned = False
-        self.page_repository = MemCache()
-        self.rendered_segments_repository = MemCache()
+        self.page_repository = MemCache(size_getter=get_page_size)
+        self.rendered_segments_repository = MemCache(
+            size_getter=get_rendered_segments_size)
         self.render_ctx_stack = RenderingContextStack()
         self.fs_cache_only_for_main_page = False
         self.abort_source_use = False
@@ -101,13 +113,52 @@ class Environment:
         self.rendered_segments_repository.fs_cache = \
             app.cache.getCache('renders')
 
-    def _mergeCacheStats(self):
+    def setCacheMemoryBudgets(self, budgets):
+        """ Sets how much memory, in megabytes, the in-memory caches can
+            use. `budgets` is either one budget for each cache, or a
+            dictionary whose keys are `pages` and/or `rendered_segments`.
+            A budget of `None` means the cache only keeps a fixed number
+            of items.
+        """
+        repos = {
+            'pages': self.page_repository,
+            'rendered_segments': self.rendered_segments_repository}
+        if not isinstance(budgets, dict):
+            budgets = dict.fromkeys(repos.keys(), budgets)
+        for name, budget in budgets.items():
+            repo = repos.get(name)
+            if repo is None:
+                raise ConfigurationError(
+                    "Unknown in-memory cache '%s'. Valid caches are: %s" %
+                    (name, ', '.join(sorted(repos.keys()))))
+            if budget is not None:
+                try:
+                    budget = int(float(budget) * 1024 * 1024)
+                except (TypeError, ValueError):
+                    raise ConfigurationError(
+                        "Invalid memory budget for cache '%s': %s" %
+                        (name, budget))
+            repo.setMaxBytes(budget)
+
+    def resetCacheStats(self):
+        self.page_repository.resetStats()
+        self.rendered_segments_repository.resetStats()
+
+    def reportCacheStats(self):
         repos = [
             ('RenderedSegmentsRepo', self.rendered_segments_repository),
             ('PagesRepo', self.page_repository)]
         for name, repo in repos:
             self._stats.counters['%s_hit' % name] = repo._hits
             self._stats.counters['%s_miss' % name] = repo._misses
+            self._stats.counters['%s_evictions' % name] = repo.evictions
+            if repo.shared_cache is not None:
+                self._stats.counters['%s_sharedHit' % name] = \
+                    repo._shared_hits
+            self._stats.counters['%s_entries' % name] = repo.item_count
+            if repo.max_bytes:
+                self._stats.counters['%s_bytes' % name] = \
+                    repo.resident_bytes
             self._stats.manifests['%s_missedKeys' % name] = \
                 list(repo._missed_keys)
 
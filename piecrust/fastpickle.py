@@ -274,11 +274,19 @@ def _unpickle_object(state):
     class_def = getattr(mod, class_name)
     obj = class_def.__new__(class_def)
 
-    attr_names = list(state.keys())
-    for name in attr_names:
+    attrs = {}
+    for name, value in state.items():
         if name == '__class__' or name == '__module__':
             continue
-        obj.__dict__[name] = _unpickle_object(state[name])
+        attrs[name] = _unpickle_object(value)
+
+    # Objects without an instance dictionary (e.g. because they use
+    # `__slots__`) restore their own state.
+    setter = getattr(obj, '__setstate__', None)
+    if setter is not None:
+        setter(attrs)
+    else:
+        obj.__dict__.update(attrs)
 
     return obj
 
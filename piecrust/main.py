@@ -10,6 +10,7 @@ import colorama
 from piecrust import APP_VERSION
 from piecrust.app import (
     PieCrustFactory, PieCrustConfiguration)
+from piecrust.cache import NullExtensibleCache
 from piecrust.chefutil import (
     format_timed, log_friendly_exception, print_help_item)
 from piecrust.commands.base import CommandContext
@@ -50,6 +51,7 @@ class NullPieCrust:
         self.templates_dirs = []
         self.theme_dir = None
         self.cache_dir = None
+        self.cache = NullExtensibleCache()
         self.config = PieCrustConfiguration()
         self.plugin_loader = PluginLoader(self)
         self.env = None
@@ -354,6 +356,7 @@ def _run_chef(pre_args, argv):
     # Run the command!
     ctx = CommandContext(appfactory, app, parser, result)
     exit_code = result.func(ctx)
+    ctx.app.cache.flush()
     if exit_code is None:
         return 0
     if not isinstance(exit_code, int):
@@ -1,10 +1,10 @@
 import re
-import json
-import hashlib
+import sys
+import pickle
 import logging
 import datetime
-import collections
 from werkzeug.utils import cached_property
+from piecrust.cache import get_data_size
 from piecrust.configuration import (
     Configuration, ConfigurationError,
     parse_config_header,
@@ -137,6 +137,20 @@ class Page:
             self._flags |= FLAG_RAW_CACHE_VALID
 
 
+def get_page_size(page):
+    """ Returns an estimate of how much memory a page takes, for use in
+        the page repository. Returns `None` if the page hasn't been loaded
+        yet, since we don't know its size until then.
+    """
+    if page._config is None:
+        return None
+    size = sys.getsizeof(page)
+    size += get_data_size(page._config.getAll())
+    for seg in page._segments.values():
+        size += sys.getsizeof(seg) + get_data_size(seg.content)
+    return size
+
+
 def _compute_datetime(source_metadata, config):
     # Get the date/time from the source.
     dt = source_metadata.get('datetime')
@@ -265,25 +279,12 @@ def load_page(source, content_item):
 def _do_load_page(source, content_item):
     # Check the cache first.
     app = source.app
-    cache = app.cache.getCache('pages')
-    cache_token = "%s@%s" % (source.name, content_item.spec)
-    cache_path = hashlib.md5(cache_token.encode('utf8')).hexdigest() + '.json'
+    cache = app.cache.getPackedCache('pages')
+    cache_path = "%s@%s" % (source.name, content_item.spec)
     page_time = source.getItemMtime(content_item)
     if cache.isValid(cache_path, page_time):
         try:
-            cache_raw = cache.read(cache_path)
-            if not cache_raw:
-                for i in range(5):
-                    cache_raw = cache.read(cache_path)
-                    if cache_raw:
-                        logger.warn("Had to re-pull the cache %d time(s)!" % (i + 1))
-                        break
-                if not cache_raw:
-                    raise Exception("Cache is busted!")
-
-            cache_data = json.loads(
-                cache_raw,
-                object_pairs_hook=collections.OrderedDict)
+            cache_data = pickle.loads(cache.read(cache_path))
             config = PageConfiguration(
                 values=cache_data['config'],
                 validate=False)
@@ -307,7 +308,7 @@ def _do_load_page(source, content_item):
     cache_data = {
         'config': config.getAll(),
         'content': json_save_segments(content)}
-    cache.write(cache_path, json.dumps(cache_data))
+    cache.write(cache_path, pickle.dumps(cache_data, pickle.HIGHEST_PROTOCOL))
 
     app.env.stats.stepCounter('PageLoads')
 
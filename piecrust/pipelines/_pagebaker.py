@@ -1,5 +1,4 @@
 import os.path
-import copy
 import queue
 import shutil
 import logging
@@ -71,6 +70,10 @@ class PageBaker(object):
 
     def bake(self, page, prev_entry,
              force_segments=False, force_layout=False):
+        """ Bakes all the sub-pages of the given page. The segments or
+            layouts can be forced to re-render for all sub-pages with
+            `True`, or for some of them with a list of sub-page numbers.
+        """
         cur_sub = 1
         has_more_subs = True
         app = self.app
@@ -101,17 +104,17 @@ class PageBaker(object):
                     pass
 
             # Figure out if we need to bake this page.
-            bake_status = _get_bake_status(page, out_path,
-                                           force_segments, force_layout,
-                                           prev_sub_entry, cur_sub_entry)
+            bake_status = _get_bake_status(
+                page, out_path,
+                _is_sub_forced(force_segments, cur_sub),
+                _is_sub_forced(force_layout, cur_sub),
+                prev_sub_entry, cur_sub_entry)
 
             # If this page didn't bake because it's already up-to-date.
             # Keep trying for as many subs as we know this page has.
             if bake_status == STATUS_CLEAN:
-                cur_sub_entry['render_info'] = copy.deepcopy(
-                    prev_sub_entry['render_info'])
-                cur_sub_entry['flags'] = \
-                    SubPageFlags.FLAG_COLLAPSED_FROM_LAST_RUN
+                cur_sub_entry = prev_sub_entry.collapsedFromLastRun()
+                rendered_subs[-1] = cur_sub_entry
 
                 if prev_entry.num_subs >= cur_sub + 1:
                     cur_sub += 1
@@ -128,7 +131,7 @@ class PageBaker(object):
                 if bake_status == STATUS_INVALIDATE_AND_BAKE:
                     cache_key = sub_uri
                     self._rsr.invalidate(cache_key)
-                    cur_sub_entry['flags'] |= \
+                    cur_sub_entry.flags |= \
                         SubPageFlags.FLAG_RENDER_CACHE_INVALIDATED
 
                 logger.debug("  p%d -> %s" % (cur_sub, out_path))
@@ -141,12 +144,14 @@ class PageBaker(object):
                                   (page.content_spec, sub_uri)) from ex
 
             # Record what we did.
-            cur_sub_entry['flags'] |= SubPageFlags.FLAG_BAKED
-            cur_sub_entry['render_info'] = copy.deepcopy(rp.render_info)
+            # The render info belongs to a rendering context that we're
+            # done with, so there's no need to copy it.
+            cur_sub_entry.flags |= SubPageFlags.FLAG_BAKED
+            cur_sub_entry.render_info = rp.render_info
 
             # Copy page assets.
             if (cur_sub == 1 and
-                    cur_sub_entry['render_info']['used_assets']):
+                    cur_sub_entry.render_info['used_assets']):
                 if pretty_urls:
                     out_assets_dir = os.path.dirname(out_path)
                 else:
@@ -168,7 +173,7 @@ class PageBaker(object):
 
             # Figure out if we have more work.
             has_more_subs = False
-            if cur_sub_entry['render_info']['pagination_has_more']:
+            if cur_sub_entry.render_info['pagination_has_more']:
                 cur_sub += 1
                 has_more_subs = True
 
@@ -205,6 +210,12 @@ def _text_writer(q):
             break
 
 
+def _is_sub_forced(force, sub_num):
+    if isinstance(force, bool) or force is None:
+        return bool(force)
+    return sub_num in force
+
+
 STATUS_CLEAN = 0
 STATUS_BAKE = 1
 STATUS_INVALIDATE_AND_BAKE = 2
@@ -229,7 +240,7 @@ def _get_bake_status(page, out_path, force_segments, force_layout,
         out_path_time = os.path.getmtime(out_path)
     except OSError:
         # File doesn't exist, we'll need to bake.
-        cur_sub_entry['flags'] |= \
+        cur_sub_entry.flags |= \
             SubPageFlags.FLAG_FORCED_BY_NO_PREVIOUS
         return STATUS_BAKE
 
@@ -241,15 +252,15 @@ def _get_bake_status(page, out_path, force_segments, force_layout,
 
 
 def _compute_force_flags(prev_sub_entry, cur_sub_entry):
-    if prev_sub_entry and len(prev_sub_entry['errors']) > 0:
+    if prev_sub_entry and len(prev_sub_entry.errors) > 0:
         # Previous bake failed. We'll have to bake it again.
-        cur_sub_entry['flags'] |= \
+        cur_sub_entry.flags |= \
             SubPageFlags.FLAG_FORCED_BY_PREVIOUS_ERRORS
         return STATUS_BAKE
 
     if not prev_sub_entry:
         # No previous record, so most probably was never baked. Bake it.
-        cur_sub_entry['flags'] |= \
+        cur_sub_entry.flags |= \
             SubPageFlags.FLAG_FORCED_BY_NO_RECORD
         return STATUS_BAKE
 
@@ -1,3 +1,4 @@
+from piecrust.configuration import are_key_paths_related
 from piecrust.pipelines.records import RecordEntry, get_flag_descriptions
 
 
@@ -13,14 +14,39 @@ class SubPageFlags:
     FLAG_COLLAPSED_FROM_LAST_RUN = 2**7
 
 
+class SubPageRecordEntry:
+    """ The record entry for one sub-page of a baked page.
+    """
+    __slots__ = ('out_uri', 'out_path', 'flags', 'errors', 'render_info')
+
+    def __init__(self, out_uri, out_path, flags=SubPageFlags.FLAG_NONE,
+                 errors=None, render_info=None):
+        self.out_uri = out_uri
+        self.out_path = out_path
+        self.flags = flags
+        self.errors = errors if errors is not None else []
+        self.render_info = render_info
+
+    def __getstate__(self):
+        return dict((n, getattr(self, n)) for n in self.__slots__)
+
+    def __setstate__(self, state):
+        for n, v in state.items():
+            setattr(self, n, v)
+
+    def collapsedFromLastRun(self):
+        """ Returns a copy of this sub-page entry for a sub-page that
+            was up to date, and therefore not re-baked. The render info
+            isn't modified after baking, so it's shared, not copied.
+        """
+        return SubPageRecordEntry(
+            self.out_uri, self.out_path,
+            SubPageFlags.FLAG_COLLAPSED_FROM_LAST_RUN,
+            self.errors, self.render_info)
+
+
 def create_subpage_job_result(out_uri, out_path):
-    return {
-        'out_uri': out_uri,
-        'out_path': out_path,
-        'flags': SubPageFlags.FLAG_NONE,
-        'errors': [],
-        'render_info': None
-    }
+    return SubPageRecordEntry(out_uri, out_path)
 
 
 class PagePipelineRecordEntry(RecordEntry):
@@ -31,13 +57,21 @@ class PagePipelineRecordEntry(RecordEntry):
     FLAG_COLLAPSED_FROM_LAST_RUN = 2**3
     FLAG_IS_DRAFT = 2**4
     FLAG_ABORTED_FOR_SOURCE_USE = 2**5
+    FLAG_DEPENDENCIES_MODIFIED = 2**6
+
+    __slots__ = ('flags', 'config', 'config_hash', 'route_params',
+                 'timestamp', 'mtime', 'subs')
 
     def __init__(self):
         super().__init__()
         self.flags = self.FLAG_NONE
+        # Only the page settings the baker needs are kept here, along
+        # with a hash of all of them to tell if anything else changed.
         self.config = None
+        self.config_hash = None
         self.route_params = None
         self.timestamp = None
+        self.mtime = None
         self.subs = []
 
     @property
@@ -49,7 +83,7 @@ class PagePipelineRecordEntry(RecordEntry):
         if len(self.errors) > 0:
             return True
         for o in self.subs:
-            if len(o['errors']) > 0:
+            if len(o.errors) > 0:
                 return True
         return False
 
@@ -62,33 +96,119 @@ class PagePipelineRecordEntry(RecordEntry):
     def getAllErrors(self):
         yield from self.errors
         for o in self.subs:
-            yield from o['errors']
+            yield from o.errors
 
     def getAllUsedSourceNames(self):
         res_segments = set()
         res_layout = set()
         for o in self.subs:
-            pinfo = o.get('render_info')
+            pinfo = o.render_info
             if pinfo:
                 usn = pinfo['used_source_names']
                 res_segments |= set(usn['segments'])
                 res_layout |= set(usn['layout'])
         return res_segments, res_layout
 
+    def getAllUsedSourceItems(self):
+        """ Returns, for the segments and the layouts of all the sub-pages,
+            what items of each used source were listed, and what settings
+            were used to list them. A source maps to `None` if the pages
+            depend on all its items.
+        """
+        res_segments = {}
+        res_layout = {}
+        for o in self.subs:
+            _merge_sub_used_source_items(o, res_segments, res_layout)
+        return res_segments, res_layout
+
+    def getUsedSourceItemsPerSub(self):
+        """ Same as `getAllUsedSourceItems`, but for each sub-page on its
+            own, as a list of `(segments, layout)` tuples.
+        """
+        res = []
+        for o in self.subs:
+            res_segments = {}
+            res_layout = {}
+            _merge_sub_used_source_items(o, res_segments, res_layout)
+            res.append((res_segments, res_layout))
+        return res
+
+    def getAllUsedTemplates(self):
+        """ Returns the names of the templates used to render the segments
+            and the layouts of all the sub-pages, or `None` if that's
+            not known.
+        """
+        res_segments = set()
+        res_layout = set()
+        for o in self.subs:
+            pinfo = o.render_info
+            if pinfo:
+                ut = pinfo.get('used_templates')
+                if (ut is None or ut['segments'] is None or
+                        ut['layout'] is None):
+                    return None
+                res_segments |= set(ut['segments'])
+                res_layout |= set(ut['layout'])
+        return res_segments, res_layout
+
+    def getAllUsedConfigKeys(self):
+        """ Returns the key paths of the site settings used to render the
+            segments and the layouts of all the sub-pages, or `None` if
+            that's not known.
+        """
+        res_segments = set()
+        res_layout = set()
+        for o in self.subs:
+            pinfo = o.render_info
+            if pinfo:
+                uck = pinfo.get('used_config_keys')
+                if uck is None:
+                    return None
+                res_segments |= set(uck['segments'])
+                res_layout |= set(uck['layout'])
+        return res_segments, res_layout
+
+    def getChangedInputsUsage(self, changed_templates, changed_config_keys):
+        """ Returns whether any of the given templates or site settings
+            were used to render the segments, and the layouts, of this page.
+        """
+        in_segments = False
+        in_layout = False
+
+        if changed_templates:
+            used_templates = self.getAllUsedTemplates()
+            if used_templates is None:
+                return True, True
+            ut1, ut2 = used_templates
+            in_segments = not ut1.isdisjoint(changed_templates)
+            in_layout = not ut2.isdisjoint(changed_templates)
+
+        if changed_config_keys:
+            used_config_keys = self.getAllUsedConfigKeys()
+            if used_config_keys is None:
+                return True, True
+            uck1, uck2 = used_config_keys
+            in_segments = in_segments or _any_key_path_related(
+                uck1, changed_config_keys)
+            in_layout = in_layout or _any_key_path_related(
+                uck2, changed_config_keys)
+
+        return in_segments, in_layout
+
     def getAllOutputPaths(self):
         for o in self.subs:
-            yield o['out_path']
+            yield o.out_path
 
     def describe(self):
         d = super().describe()
         d['Flags'] = get_flag_descriptions(self.flags, flag_descriptions)
         for i, sub in enumerate(self.subs):
             d['Sub%02d' % i] = {
-                'URI': sub['out_uri'],
-                'Path': sub['out_path'],
+                'URI': sub.out_uri,
+                'Path': sub.out_path,
                 'Flags': get_flag_descriptions(
-                    sub['flags'], sub_flag_descriptions),
-                'RenderInfo': _describe_render_info(sub['render_info'])
+                    sub.flags, sub_flag_descriptions),
+                'RenderInfo': _describe_render_info(sub.render_info)
             }
         return d
 
@@ -100,7 +220,9 @@ flag_descriptions = {
     PagePipelineRecordEntry.FLAG_COLLAPSED_FROM_LAST_RUN: 'from last run',
     PagePipelineRecordEntry.FLAG_IS_DRAFT: 'draft',
     PagePipelineRecordEntry.FLAG_ABORTED_FOR_SOURCE_USE: ('aborted for '
-                                                          'source use')}
+                                                          'source use'),
+    PagePipelineRecordEntry.FLAG_DEPENDENCIES_MODIFIED: ('dependencies '
+                                                         'changed')}
 
 
 sub_flag_descriptions = {
@@ -122,5 +244,43 @@ def _describe_render_info(ri):
         'UsedPagination': ri['used_pagination'],
         'PaginationHasMore': ri['pagination_has_more'],
         'UsedAssets': ri['used_assets'],
-        'UsedSourceNames': ri['used_source_names']
+        'UsedSourceNames': ri['used_source_names'],
+        'UsedSourceItems': ri.get('used_source_items'),
+        'UsedTemplates': ri.get('used_templates'),
+        'UsedConfigKeys': ri.get('used_config_keys')
     }
+
+
+def _merge_sub_used_source_items(sub_entry, res_segments, res_layout):
+    pinfo = sub_entry.render_info
+    if not pinfo:
+        return
+    usi = pinfo.get('used_source_items')
+    usn = pinfo['used_source_names']
+    if usi is None:
+        usi = {'segments': {}, 'layout': {}}
+    _merge_used_source_items(res_segments, usn['segments'], usi['segments'])
+    _merge_used_source_items(res_layout, usn['layout'], usi['layout'])
+
+
+def _merge_used_source_items(res, used_source_names, used_source_items):
+    for sn in used_source_names:
+        usage = used_source_items.get(sn)
+        if usage is None or (sn in res and res[sn] is None):
+            res[sn] = None
+            continue
+
+        cur = res.setdefault(sn, {'items': set(), 'settings': set()})
+        cur['items'] |= set(usage['items'])
+        if usage['settings'] is None or cur['settings'] is None:
+            cur['settings'] = None
+        else:
+            cur['settings'] |= set(usage['settings'])
+
+
+def _any_key_path_related(key_paths, other_key_paths):
+    for kp in key_paths:
+        for okp in other_key_paths:
+            if are_key_paths_related(kp, okp):
+                return True
+    return False
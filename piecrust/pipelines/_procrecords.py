@@ -9,6 +9,8 @@ class AssetPipelineRecordEntry(RecordEntry):
     FLAG_BYPASSED_STRUCTURED_PROCESSING = 2**3
     FLAG_COLLAPSED_FROM_LAST_RUN = 2**4
 
+    __slots__ = ('flags', 'proc_tree', 'out_paths')
+
     def __init__(self):
         super().__init__()
         self.flags = self.FLAG_NONE
@@ -204,7 +204,8 @@ class ProcessingTreeRunner(object):
         # all dependencies (if any).
         base_dir = self._getNodeBaseDir(node)
         full_path = os.path.join(base_dir, node.path)
-        in_mtime = (full_path, os.path.getmtime(full_path))
+        file_times = proc.app.file_times
+        in_mtime = (full_path, file_times.getMtime(full_path))
         force_build = False
         try:
             deps = proc.getDependencies(full_path)
@@ -212,7 +213,7 @@ class ProcessingTreeRunner(object):
                 force_build = True
             elif deps is not None:
                 for dep in deps:
-                    dep_mtime = os.path.getmtime(dep)
+                    dep_mtime = file_times.getMtime(dep)
                     if dep_mtime > in_mtime[1]:
                         in_mtime = (dep, dep_mtime)
         except Exception as e:
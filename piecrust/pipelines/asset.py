@@ -20,6 +20,7 @@ logger = logging.getLogger(__name__)
 class AssetPipeline(ContentPipeline):
     PIPELINE_NAME = 'asset'
     RECORD_ENTRY_CLASS = AssetPipelineRecordEntry
+    THREAD_SAFE = True
 
     def __init__(self, source, ppctx):
         if not isinstance(source, FSContentSourceBase):
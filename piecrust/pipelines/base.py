@@ -11,10 +11,27 @@ class PipelineContext:
     """ The context for running a content pipeline.
     """
     def __init__(self, out_dir, *,
-                 worker_id=-1, force=None):
+                 worker_id=-1, force=None, changed_templates=None,
+                 changed_config_keys=None):
         self.out_dir = out_dir
         self.worker_id = worker_id
         self.force = force
+        self.changed_templates = changed_templates
+        self.changed_config_keys = changed_config_keys
+
+    @property
+    def has_changed_inputs(self):
+        """ Returns `True` if some templates or site settings changed since
+            the last bake, and pages using them need to be re-baked.
+        """
+        return bool(self.changed_templates or self.changed_config_keys)
+
+    def getChangedInputsUsage(self, entry):
+        """ Returns whether the given page record entry used any changed
+            templates or site settings for its segments, and its layouts.
+        """
+        return entry.getChangedInputsUsage(self.changed_templates,
+                                           self.changed_config_keys)
 
     @property
     def is_worker(self):
@@ -122,6 +139,8 @@ class ContentPipeline:
     PIPELINE_NAME = None
     RECORD_ENTRY_CLASS = None
     PASS_NUM = 0
+    # Whether jobs can run in worker threads that share the same app.
+    THREAD_SAFE = False
 
     def __init__(self, source, ctx):
         self.source = source
@@ -147,6 +166,19 @@ class ContentPipeline:
             create_job(self, item.spec)
             for item in self.source.getAllContents()], None
 
+    def getPassDependencies(self, ctx):
+        """ Returns what needs to be done before jobs can be created for
+            the pass given in the context (a `PipelineJobCreateContext`),
+            besides this pipeline's own previous passes.
+
+            This is a dictionary mapping previous pass numbers to lists of
+            source names, or to `None` for all sources. A pass missing
+            from the dictionary doesn't need to be done. Returning `None`
+            (the default) means waiting for all sources to be done with
+            all previous passes.
+        """
+        return None
+
     def createRecordEntry(self, item_spec):
         entry_class = self.RECORD_ENTRY_CLASS
         record_entry = entry_class()
@@ -201,12 +233,15 @@ def get_pipeline_name_for_source(source):
 
 class PipelineManager:
     def __init__(self, app, out_dir, *,
-                 record_histories=None, worker_id=-1, force=False):
+                 record_histories=None, worker_id=-1, force=False,
+                 changed_templates=None, changed_config_keys=None):
         self.app = app
         self.record_histories = record_histories
         self.out_dir = out_dir
         self.worker_id = worker_id
         self.force = force
+        self.changed_templates = changed_templates
+        self.changed_config_keys = changed_config_keys
 
         self._pipeline_classes = {}
         for pclass in app.plugin_loader.getPipelines():
@@ -230,7 +265,9 @@ class PipelineManager:
 
         pname = get_pipeline_name_for_source(source)
         ppctx = PipelineContext(self.out_dir,
-                                worker_id=self.worker_id, force=self.force)
+                                worker_id=self.worker_id, force=self.force,
+                                changed_templates=self.changed_templates,
+                                changed_config_keys=self.changed_config_keys)
         pp = self._pipeline_classes[pname](source, ppctx)
         pp.initialize()
 
@@ -250,13 +287,41 @@ class PipelineManager:
             ctx = PipelinePostJobRunContext(ppinfo.record_history)
             ppinfo.pipeline.postJobRun(ctx)
 
+        self._reportOutputPathConflicts()
+
+    def _reportOutputPathConflicts(self):
+        # Items overriding items from another realm (like user pages
+        # overriding theme pages) is expected, but not within a realm.
+        for out_path, owner, other in \
+                self.record_histories.output_paths.conflicts:
+            owner_src = self.app.getSource(owner[0].split('@')[0])
+            other_src = self.app.getSource(other[0].split('@')[0])
+            if owner_src.config['realm'] == other_src.config['realm']:
+                logger.error(
+                    "Page '%s' would get baked to '%s' "
+                    "but is overriden by '%s'." %
+                    (other[1], out_path, owner[1]))
+            else:
+                logger.debug(
+                    "Page '%s' would get baked to '%s' "
+                    "but is overriden by '%s'." %
+                    (other[1], out_path, owner[1]))
+
     def deleteStaleOutputs(self):
+        output_paths = self.record_histories.output_paths
         for ppinfo in self.getPipelineInfos():
             ctx = PipelineDeletionContext(ppinfo.record_history)
             to_delete = ppinfo.pipeline.getDeletions(ctx)
             current_record = ppinfo.record_history.current
             if to_delete is not None:
                 for path, reason in to_delete:
+                    # Don't delete what another item now bakes to the
+                    # same path.
+                    owner = output_paths.getOwner(path)
+                    if owner is not None:
+                        logger.debug("Not removing '%s': now baked by '%s'."
+                                     % (path, owner[1]))
+                        continue
                     logger.debug("Removing '%s': %s" % (path, reason))
                     current_record.deleted_out_paths.append(path)
                     try:
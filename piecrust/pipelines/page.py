@@ -1,10 +1,10 @@
-import copy
+import hashlib
 import logging
 from piecrust.pipelines.base import (
-    ContentPipeline, create_job, content_item_from_job)
+    ContentPipeline, create_job, content_item_from_job,
+    get_pipeline_name_for_source)
 from piecrust.pipelines._pagebaker import PageBaker, get_output_path
-from piecrust.pipelines._pagerecords import (
-    PagePipelineRecordEntry, SubPageFlags)
+from piecrust.pipelines._pagerecords import PagePipelineRecordEntry
 from piecrust.rendering import RenderingContext, render_page_segments
 from piecrust.sources.base import AbortedSourceUseError
 
@@ -22,6 +22,7 @@ class PagePipeline(ContentPipeline):
         self._pagebaker = None
         self._stats = source.app.env.stats
         self._draft_setting = self.app.config['baker/no_bake_setting']
+        self._tracked_setting_names = None
 
     def initialize(self):
         stats = self._stats
@@ -37,6 +38,8 @@ class PagePipeline(ContentPipeline):
         pass_num = ctx.pass_num
         if pass_num == 0:
             ctx.current_record.user_data['dirty_source_names'] = set()
+            ctx.current_record.user_data.setdefault('source_deps', {})
+            self._tracked_setting_names = self._getTrackedSettingNames(ctx)
             return self._createLoadJobs(ctx), "load"
         if pass_num == 1:
             return self._createSegmentJobs(ctx), "render"
@@ -44,16 +47,102 @@ class PagePipeline(ContentPipeline):
             return self._createLayoutJobs(ctx), "layout"
         raise Exception("Unexpected pipeline pass: %d" % pass_num)
 
+    def getPassDependencies(self, ctx):
+        # Loading pages and rendering their segments doesn't depend on
+        # other sources (pages using other sources get postponed).
+        if ctx.pass_num < 2:
+            return {}
+
+        # Rendering layouts requires knowing which sources are dirty, so
+        # all pages must have been loaded. Then, we need the pages from
+        # the sources we use to have their segments rendered. We only know
+        # this for pages that haven't changed since last time, or for pages
+        # we baked at some point in the past (see `postJobRun`).
+        page_source_names = [
+            s.name for s in self.app.sources
+            if get_pipeline_name_for_source(s) == self.PIPELINE_NAME]
+
+        used_source_names = set()
+        source_deps = ctx.current_record.user_data.get('source_deps', {})
+        history = ctx.record_histories.getHistory(ctx.record_name).copy()
+        history.build()
+        for prev, cur in history.diffs:
+            if cur is None or cur.hasFlag(
+                    PagePipelineRecordEntry.FLAG_IS_DRAFT |
+                    PagePipelineRecordEntry.FLAG_OVERRIDEN):
+                continue
+            if prev is None:
+                deps = source_deps.get(cur.item_spec)
+                if deps is None:
+                    used_source_names = None
+                    break
+                used_source_names |= set(deps[0]) | set(deps[1])
+                continue
+            if cur.hasFlag(PagePipelineRecordEntry.FLAG_SOURCE_MODIFIED):
+                used_source_names = None
+                break
+            usn1, usn2 = prev.getAllUsedSourceNames()
+            used_source_names |= usn1 | usn2
+
+        return {0: page_source_names, 1: used_source_names}
+
+    def _getTrackedSettingNames(self, ctx):
+        # Record entries only keep the page settings that the baker needs
+        # later: the draft setting, taxonomy terms, and whatever settings
+        # were used last time to sort or filter this source's pages.
+        from piecrust.sources.taxonomy import Taxonomy
+
+        names = {self._draft_setting}
+        for tn, tc in self.app.config.get('site/taxonomies').items():
+            names.add(Taxonomy(tn, tc).setting_name)
+        for rec in ctx.record_histories.previous.records:
+            uis = rec.user_data.get('used_item_settings')
+            if uis:
+                names.update(uis.get(self.source.name, ()))
+        return names
+
     def _createLoadJobs(self, ctx):
         # Here we load all the pages in the source, making sure they all
-        # have a valid cache for their configuration and contents.
+        # have a valid cache for their configuration and contents. Pages
+        # that haven't changed since last bake don't need to be loaded
+        # again: we just carry their record entry over.
         jobs = []
-        for item in self.source.getAllContents():
+        source = self.source
+        prev_record = ctx.previous_record
+        cur_record = ctx.current_record
+        item_specs = set()
+        for item in source.getAllContents():
+            item_specs.add(item.spec)
+            prev_entry = prev_record.getEntry(item.spec)
+            if (prev_entry is not None and not prev_entry.errors and
+                    prev_entry.mtime is not None and
+                    prev_entry.mtime == source.getItemMtime(item)):
+                cur_record.addEntry(self._carryOverLoadedEntry(prev_entry))
+                continue
+
             jobs.append(create_job(self, item.spec))
+
+        # Pages that were deleted since last time also make the source
+        # "dirty", since pages listing them need to be re-baked.
+        if any([e.item_spec not in item_specs
+                for e in prev_record.getEntries()]):
+            cur_record.user_data['dirty_source_names'].add(source.name)
+
         if len(jobs) > 0:
             return jobs
         return None
 
+    def _carryOverLoadedEntry(self, prev_entry):
+        new_entry = self.createRecordEntry(prev_entry.item_spec)
+        new_entry.flags = (prev_entry.flags &
+                           PagePipelineRecordEntry.FLAG_IS_DRAFT)
+        new_entry.config = prev_entry.config
+        new_entry.config_hash = prev_entry.config_hash
+        new_entry.route_params = prev_entry.route_params
+        new_entry.timestamp = prev_entry.timestamp
+        new_entry.mtime = prev_entry.mtime
+        return new_entry
+
     def _createSegmentJobs(self, ctx):
         jobs = []
 
@@ -66,9 +155,9 @@ class PagePipeline(ContentPipeline):
         history = ctx.record_histories.getHistory(ctx.record_name).copy()
         history.build()
 
-        cur_rec_used_paths = {}
-        history.current.user_data['used_paths'] = cur_rec_used_paths
-        all_records = ctx.record_histories.current.records
+        output_paths = ctx.record_histories.output_paths
+        has_changed_inputs = self.ctx.has_changed_inputs
+        source_deps = history.current.user_data.get('source_deps', {})
 
         for prev, cur in history.diffs:
             # Ignore pages that disappeared since last bake.
@@ -79,6 +168,31 @@ class PagePipeline(ContentPipeline):
             if cur.hasFlag(PagePipelineRecordEntry.FLAG_IS_DRAFT):
                 continue
 
+            # Pages whose segments use templates or settings that changed
+            # since last bake need to be re-rendered, just like if they were
+            # modified.
+            if prev and has_changed_inputs:
+                in_segments, _ = self.ctx.getChangedInputsUsage(prev)
+                if in_segments:
+                    cur.flags |= (
+                        PagePipelineRecordEntry.FLAG_SOURCE_MODIFIED |
+                        PagePipelineRecordEntry.FLAG_DEPENDENCIES_MODIFIED)
+                    ctx.current_record.user_data['dirty_source_names'].add(
+                        self.source.name)
+
+            # Check if this item has been overriden by a previous pipeline
+            # run... for instance, we could be the pipeline for a "theme pages"
+            # source, and some of our pages have been overriden by a user
+            # page that writes out to the same URL. We do this even for
+            # pages that haven't changed, since the overriding page could
+            # be new.
+            uri = uri_getter(cur.route_params)
+            out_path = get_output_path(app, out_dir, uri, pretty_urls)
+            if output_paths.claim(out_path, ctx.record_name,
+                                  cur.item_spec) is not None:
+                cur.flags |= PagePipelineRecordEntry.FLAG_OVERRIDEN
+                continue
+
             # Skip pages that haven't changed since last bake.
             if (prev and not cur.hasFlag(
                     PagePipelineRecordEntry.FLAG_SOURCE_MODIFIED)):
@@ -88,45 +202,27 @@ class PagePipeline(ContentPipeline):
             # content segments (we don't care about the layout yet), we
             # postpone them to the next pipeline pass immediately, because they
             # might need populated render caches for those sources' pages.
+            # If we don't have a previous record entry (like when baking from
+            # scratch), we still know what the page used the last time it
+            # was baked.
             if prev:
                 usn1, _ = prev.getAllUsedSourceNames()
-                if usn1:
-                    logger.debug("Postponing: %s" % cur.item_spec)
-                    cur.flags |= \
-                        PagePipelineRecordEntry.FLAG_ABORTED_FOR_SOURCE_USE
-                    continue
-
-            # Check if this item has been overriden by a previous pipeline
-            # run... for instance, we could be the pipeline for a "theme pages"
-            # source, and some of our pages have been overriden by a user
-            # page that writes out to the same URL.
-            uri = uri_getter(cur.route_params)
-            out_path = get_output_path(app, out_dir, uri, pretty_urls)
-            override = _find_used_path_spec(all_records, out_path)
-            if override is not None:
-                override_source_name, override_entry_spec = override
-                override_source = app.getSource(override_source_name)
-                if override_source.config['realm'] == \
-                        self.source.config['realm']:
-                    logger.error(
-                        "Page '%s' would get baked to '%s' "
-                        "but is overriden by '%s'." %
-                        (cur.item_spec, out_path, override_entry_spec))
-                else:
-                    logger.debug(
-                        "Page '%s' would get baked to '%s' "
-                        "but is overriden by '%s'." %
-                        (cur.item_spec, out_path, override_entry_spec))
-
-                cur.flags |= PagePipelineRecordEntry.FLAG_OVERRIDEN
+            else:
+                usn1, _ = source_deps.get(cur.item_spec, ((), ()))
+            if usn1:
+                logger.debug("Postponing: %s" % cur.item_spec)
+                cur.flags |= \
+                    PagePipelineRecordEntry.FLAG_ABORTED_FOR_SOURCE_USE
                 continue
 
             # Nope, all good, let's create a job for this item.
             cur.flags |= PagePipelineRecordEntry.FLAG_SEGMENTS_RENDERED
-            cur_rec_used_paths[out_path] = cur.item_spec
 
+            force_render = cur.hasFlag(
+                PagePipelineRecordEntry.FLAG_DEPENDENCIES_MODIFIED)
             jobs.append(create_job(self, cur.item_spec,
-                                   pass_num=pass_num))
+                                   pass_num=pass_num,
+                                   force_render=force_render))
 
         if len(jobs) > 0:
             return jobs
@@ -140,9 +236,12 @@ class PagePipeline(ContentPipeline):
             rec_dsn = rec.user_data.get('dirty_source_names')
             if rec_dsn:
                 dirty_source_names |= rec_dsn
+        used_source_checker = _UsedSourceChecker(
+            ctx.record_histories, dirty_source_names, self._draft_setting)
 
         jobs = []
         pass_num = ctx.pass_num
+        has_changed_inputs = self.ctx.has_changed_inputs
         history = ctx.record_histories.getHistory(ctx.record_name).copy()
         history.build()
         for prev, cur in history.diffs:
@@ -158,6 +257,17 @@ class PagePipeline(ContentPipeline):
             if cur.hasFlag(PagePipelineRecordEntry.FLAG_SEGMENTS_RENDERED):
                 do_bake = True
 
+            # Same for pages that were postponed on the previous pass
+            # because they use other sources in their segments.
+            is_postponed = (
+                cur.hasFlag(
+                    PagePipelineRecordEntry.FLAG_ABORTED_FOR_SOURCE_USE) and
+                not cur.hasFlag(
+                    PagePipelineRecordEntry.FLAG_SEGMENTS_RENDERED))
+            if is_postponed:
+                do_bake = True
+                force_segments = True
+
             # Now look at the stuff we baked for our own source on the second
             # pass.  For anything that wasn't baked (i.e. it was considered 'up
             # to date') we look at the records from last time, and if they say
@@ -166,13 +276,25 @@ class PagePipeline(ContentPipeline):
             #
             # The common example for this is a blog index page which hasn't
             # been touched, but needs to be re-baked because someone added or
-            # edited a post.
+            # edited a post. If we know what posts it listed, though, we only
+            # re-bake it if the edited posts are (or could now be) among them,
+            # and only the sub-pages that listed them.
             if prev:
-                usn1, usn2 = prev.getAllUsedSourceNames()
-                force_segments = any(map(lambda u: u in dirty_source_names,
-                                     usn1))
-                force_layout = any(map(lambda u: u in dirty_source_names,
-                                   usn2))
+                segments_subs, layout_subs = \
+                    used_source_checker.getAffectedSubs(prev)
+                force_segments = force_segments or segments_subs
+                force_layout = layout_subs
+
+                # Same thing for pages using templates or settings that
+                # changed. If the segments were already re-rendered in the
+                # previous pass, we only need to redo the layout.
+                if has_changed_inputs:
+                    in_segments, in_layout = \
+                        self.ctx.getChangedInputsUsage(prev)
+                    if in_segments and not _has_fresh_segments(cur):
+                        force_segments = True
+                    elif in_segments or in_layout:
+                        force_layout = True
 
                 if force_segments or force_layout:
                     # Yep, we need to force-rebake some aspect of this page.
@@ -184,10 +306,7 @@ class PagePipeline(ContentPipeline):
                     # don't have any work to do, but we need to carry over
                     # any information we have, otherwise the post bake step
                     # will think we need to delete last bake's outputs.
-                    cur.subs = copy.deepcopy(prev.subs)
-                    for cur_sub in cur.subs:
-                        cur_sub['flags'] = \
-                            SubPageFlags.FLAG_COLLAPSED_FROM_LAST_RUN
+                    cur.subs = [s.collapsedFromLastRun() for s in prev.subs]
 
             if do_bake:
                 jobs.append(create_job(self, cur.item_spec,
@@ -207,9 +326,14 @@ class PagePipeline(ContentPipeline):
             # entry with the information we got from the worker.
             new_entry = self.createRecordEntry(result['item_spec'])
             new_entry.flags = result['flags']
-            new_entry.config = result['config']
+            config = result['config']
+            new_entry.config = dict(
+                (n, config[n]) for n in self._tracked_setting_names
+                if n in config)
+            new_entry.config_hash = result['config_hash']
             new_entry.route_params = result['route_params']
             new_entry.timestamp = result['timestamp']
+            new_entry.mtime = result['mtime']
             ctx.record.addEntry(new_entry)
 
             # If this page was modified, flag its entire source as "dirty",
@@ -246,14 +370,44 @@ class PagePipeline(ContentPipeline):
         elif pass_num >= 2:
             return self._renderLayout(job, ctx, result)
 
+    def postJobRun(self, ctx):
+        # Remember which sources each page used in its segments and in its
+        # layout. This is kept across bakes, even when baking from scratch,
+        # so that we know right away which pages need to be postponed to the
+        # layout pass, instead of finding out by aborting their rendering.
+        #
+        # Also remember which settings were used to list other sources'
+        # pages, so those pages keep them in their record entries.
+        record = ctx.record_history.current
+        prev_source_deps = record.user_data.get('source_deps', {})
+        source_deps = {}
+        used_item_settings = {}
+        for cur in record.getEntries():
+            if any(s.render_info for s in cur.subs):
+                usn1, usn2 = cur.getAllUsedSourceNames()
+                source_deps[cur.item_spec] = (sorted(usn1), sorted(usn2))
+            else:
+                deps = prev_source_deps.get(cur.item_spec)
+                if deps is not None:
+                    source_deps[cur.item_spec] = deps
+
+            for usi in cur.getAllUsedSourceItems():
+                for sn, usage in usi.items():
+                    if usage is not None and usage['settings']:
+                        used_item_settings.setdefault(sn, set()).update(
+                            usage['settings'])
+        record.user_data['source_deps'] = source_deps
+        record.user_data['used_item_settings'] = dict(
+            (sn, sorted(names)) for sn, names in used_item_settings.items())
+
     def getDeletions(self, ctx):
         for prev, cur in ctx.record_history.diffs:
             if prev and not cur:
                 for sub in prev.subs:
-                    yield (sub['out_path'], 'previous source file was removed')
+                    yield (sub.out_path, 'previous source file was removed')
             elif prev and cur:
-                prev_out_paths = [o['out_path'] for o in prev.subs]
-                cur_out_paths = [o['out_path'] for o in cur.subs]
+                prev_out_paths = [o.out_path for o in prev.subs]
+                cur_out_paths = [o.out_path for o in cur.subs]
                 diff = set(prev_out_paths) - set(cur_out_paths)
                 for p in diff:
                     yield (p, 'source file changed outputs')
@@ -270,8 +424,10 @@ class PagePipeline(ContentPipeline):
 
         result['flags'] = PagePipelineRecordEntry.FLAG_NONE
         result['config'] = page.config.getAll()
+        result['config_hash'] = _get_config_hash(result['config'])
         result['route_params'] = content_item.metadata['route_params']
         result['timestamp'] = page.datetime.timestamp()
+        result['mtime'] = page.content_mtime
 
         if page.was_modified:
             result['flags'] |= PagePipelineRecordEntry.FLAG_SOURCE_MODIFIED
@@ -292,7 +448,8 @@ class PagePipeline(ContentPipeline):
         env = self.app.env
         env.abort_source_use = True
         try:
-            rdr_ctx = RenderingContext(page)
+            rdr_ctx = RenderingContext(
+                page, force_render=job.get('force_render', False))
             render_page_segments(rdr_ctx)
         except AbortedSourceUseError:
             logger.debug("Page was aborted for using source: %s" %
@@ -316,12 +473,113 @@ class PagePipeline(ContentPipeline):
         result['subs'] = rdr_subs
 
 
-def _find_used_path_spec(records, path):
-    for rec in records:
-        up = rec.user_data.get('used_paths')
-        if up is not None:
-            entry_spec = up.get(path)
-            if entry_spec is not None:
-                src_name = rec.name.split('@')[0]
-                return (src_name, entry_spec)
+class _UsedSourceChecker:
+    """ Figures out if a page that used some items from other sources
+        needs to be re-baked, given what changed in those sources.
+    """
+    def __init__(self, record_histories, dirty_source_names, draft_setting):
+        self._record_histories = record_histories
+        self._dirty_source_names = dirty_source_names
+        self._draft_setting = draft_setting
+        self._changes = {}
+
+    def getAffectedSubs(self, entry):
+        """ Returns the numbers of the given page's sub-pages that need
+            their segments re-rendered, and the ones that need their
+            layout re-rendered.
+        """
+        segments_subs = []
+        layout_subs = []
+        for i, (usi1, usi2) in enumerate(entry.getUsedSourceItemsPerSub()):
+            if self._isAffected(usi1):
+                segments_subs.append(i + 1)
+            if self._isAffected(usi2):
+                layout_subs.append(i + 1)
+        return segments_subs, layout_subs
+
+    def _isAffected(self, used_source_items):
+        for sn, usage in used_source_items.items():
+            if (sn in self._dirty_source_names and
+                    self._isUsageAffected(sn, usage)):
+                return True
+        return False
+
+    def _isUsageAffected(self, source_name, usage):
+        if usage is None:
+            return True
+        changes = self._getChanges(source_name)
+        if changes is None:
+            return True
+
+        items = usage['items']
+        settings = usage['settings']
+        no_drafts = (settings is not None and
+                     self._draft_setting in settings)
+        for prev, cur in changes:
+            # An item we listed has changed.
+            if (cur or prev).item_spec in items:
+                return True
+
+            # Drafts don't get listed.
+            if no_drafts and all(
+                    [e is None or
+                     e.hasFlag(PagePipelineRecordEntry.FLAG_IS_DRAFT)
+                     for e in (prev, cur)]):
+                continue
+
+            # An item was added or removed, or some item changed in a way
+            # that could move it in or out of what we listed.
+            if prev is None or cur is None:
+                return True
+            if prev.timestamp != cur.timestamp:
+                return True
+            if settings is None:
+                if prev.config_hash != cur.config_hash:
+                    return True
+            elif any([prev.config.get(n) != cur.config.get(n)
+                      for n in settings]):
+                return True
+        return False
+
+    def _getChanges(self, source_name):
+        try:
+            return self._changes[source_name]
+        except KeyError:
+            pass
+
+        record_name = '%s@%s' % (source_name, PagePipeline.PIPELINE_NAME)
+        prev_rec = _find_record(self._record_histories.previous, record_name)
+        cur_rec = _find_record(self._record_histories.current, record_name)
+        if prev_rec is None or cur_rec is None:
+            changes = None
+        else:
+            changes = []
+            for cur in cur_rec.getEntries():
+                prev = prev_rec.getEntry(cur.item_spec)
+                if prev is None or cur.hasFlag(
+                        PagePipelineRecordEntry.FLAG_SOURCE_MODIFIED):
+                    changes.append((prev, cur))
+            for prev in prev_rec.getEntries():
+                if cur_rec.getEntry(prev.item_spec) is None:
+                    changes.append((prev, None))
+
+        self._changes[source_name] = changes
+        return changes
+
+
+def _get_config_hash(config):
+    return hashlib.md5(repr(config).encode('utf8')).hexdigest()
+
+
+def _find_record(multi_record, record_name):
+    for rec in multi_record.records:
+        if rec.name == record_name:
+            return rec
     return None
+
+
+def _has_fresh_segments(entry):
+    return (entry.hasFlag(PagePipelineRecordEntry.FLAG_SEGMENTS_RENDERED) and
+            not entry.hasFlag(
+                PagePipelineRecordEntry.FLAG_ABORTED_FOR_SOURCE_USE))
+
@@ -1,8 +1,11 @@
 import os
 import os.path
 import pickle
+import sqlite3
+import fnmatch
 import hashlib
 import logging
+import threading
 from piecrust import APP_VERSION
 
 
@@ -12,9 +15,12 @@ logger = logging.getLogger(__name__)
 class RecordEntry:
     """ An entry in a record, for a specific content item.
     """
+    __slots__ = ('item_spec', 'errors', 'job_times')
+
     def __init__(self):
         self.item_spec = None
         self.errors = []
+        self.job_times = {}
 
     @property
     def success(self):
@@ -33,6 +39,9 @@ class RecordEntry:
 class Record:
     """ A class that represents a 'record' of a bake operation on a
         content source.
+
+        Records loaded from disk only load their entries when they're
+        needed.
     """
     def __init__(self, name):
         self.name = name
@@ -40,29 +49,77 @@ class Record:
         self.user_data = {}
         self.success = True
         self._entries = {}
+        self._store = None
+
+    def __getstate__(self):
+        self._loadAllEntries()
+        return self.__dict__
 
     @property
     def entry_count(self):
+        self._loadAllEntries()
         return len(self._entries)
 
     def addEntry(self, entry):
+        self._loadAllEntries()
         if entry.item_spec in self._entries:
             raise ValueError("Entry '%s' is already in the record." %
                              entry.item_spec)
         self._entries[entry.item_spec] = entry
 
     def getEntries(self):
+        self._loadAllEntries()
         return self._entries.values()
 
     def getEntry(self, item_spec):
-        return self._entries.get(item_spec)
+        try:
+            return self._entries[item_spec]
+        except KeyError:
+            pass
+        if self._store is None:
+            return None
+        entry = self._store.getEntry(self.name, item_spec)
+        if entry is not None:
+            self._entries[item_spec] = entry
+        return entry
+
+    def queryEntries(self, *, spec_pattern=None, out_pattern=None,
+                     failed_only=False):
+        """ Returns the entries whose item spec and/or any output path
+            match the given glob patterns.
+        """
+        if self._store is not None:
+            return self._store.queryEntries(
+                self.name, spec_pattern=spec_pattern,
+                out_pattern=out_pattern, failed_only=failed_only)
+
+        res = []
+        for e in self._entries.values():
+            if failed_only and e.success:
+                continue
+            if spec_pattern and not fnmatch.fnmatch(
+                    e.item_spec, spec_pattern):
+                continue
+            if out_pattern and not any(
+                    [fnmatch.fnmatch(op, out_pattern)
+                     for op in (e.getAllOutputPaths() or [])]):
+                continue
+            res.append(e)
+        return res
+
+    def _loadAllEntries(self):
+        if self._store is None:
+            return
+        for e in self._store.getEntries(self.name):
+            self._entries.setdefault(e.item_spec, e)
+        self._store = None
 
 
 class MultiRecord:
     """ A container that includes multiple `Record` instances -- one for
         each content source that was baked.
     """
-    RECORD_VERSION = 13
+    RECORD_VERSION = 20
 
     def __init__(self):
         self.records = []
@@ -70,6 +127,8 @@ class MultiRecord:
         self.bake_time = 0
         self.incremental_count = 0
         self.invalidated = False
+        self.input_snapshots = None
+        self.config_values = None
         self.stats = None
         self._app_version = APP_VERSION
         self._record_version = self.RECORD_VERSION
@@ -84,19 +143,178 @@ class MultiRecord:
         self.records.append(record)
         return record
 
+    def loadAllEntries(self):
+        """ Loads all the entries in memory, and closes the file they came
+            from, if any.
+        """
+        stores = [r._store for r in self.records if r._store is not None]
+        for r in self.records:
+            r._loadAllEntries()
+        for s in stores:
+            s.close()
+
+    def close(self):
+        """ Closes the file these records were loaded from, if any. Entries
+            that weren't loaded yet can't be loaded anymore after that.
+        """
+        for r in self.records:
+            if r._store is not None:
+                r._store.close()
+
     def save(self, path):
         path_dir = os.path.dirname(path)
         if not os.path.isdir(path_dir):
             os.makedirs(path_dir, 0o755)
+        if os.path.exists(path):
+            os.remove(path)
 
-        with open(path, 'wb') as fp:
-            pickle.dump(self, fp, pickle.HIGHEST_PROTOCOL)
+        meta = dict((k, v) for k, v in self.__dict__.items()
+                    if k != 'records')
+        _RecordStore.write(path, meta, self.records)
 
     @staticmethod
     def load(path):
         logger.debug("Loading bake records from: %s" % path)
-        with open(path, 'rb') as fp:
-            return pickle.load(fp)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(path)
+
+        store = _RecordStore(path)
+        multi_record = MultiRecord()
+        multi_record.__dict__.update(store.getMetadata())
+        if _are_records_valid(multi_record):
+            for name, success, user_data, deleted_out_paths in \
+                    store.getRecords():
+                record = Record(name)
+                record.success = success
+                record.user_data = user_data
+                record.deleted_out_paths = deleted_out_paths
+                record._store = store
+                multi_record.records.append(record)
+        return multi_record
+
+
+class _RecordStore:
+    """ An SQLite database of bake records, which lets us load only the
+        record entries we need.
+    """
+    SCHEMA = [
+        "CREATE TABLE meta (key TEXT PRIMARY KEY, value BLOB)",
+        "CREATE TABLE records (name TEXT PRIMARY KEY, success INTEGER, "
+        "user_data BLOB, deleted_out_paths BLOB)",
+        "CREATE TABLE entries (record_name TEXT, item_spec TEXT, "
+        "success INTEGER, data BLOB, PRIMARY KEY (record_name, item_spec))",
+        "CREATE TABLE outputs (record_name TEXT, item_spec TEXT, "
+        "out_path TEXT)",
+        "CREATE INDEX outputs_by_entry ON outputs (record_name, item_spec)"]
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._conn_pid = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._conn_pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+            self._closed = True
+
+    def getMetadata(self):
+        rows = self._query("SELECT key, value FROM meta")
+        return dict((k, pickle.loads(v)) for k, v in rows)
+
+    def getRecords(self):
+        rows = self._query(
+            "SELECT name, success, user_data, deleted_out_paths "
+            "FROM records ORDER BY rowid")
+        return [(n, bool(s), pickle.loads(ud), pickle.loads(dop))
+                for n, s, ud, dop in rows]
+
+    def getEntry(self, record_name, item_spec):
+        rows = self._query(
+            "SELECT data FROM entries "
+            "WHERE record_name = ? AND item_spec = ?",
+            (record_name, item_spec))
+        if rows:
+            return pickle.loads(rows[0][0])
+        return None
+
+    def getEntries(self, record_name):
+        rows = self._query(
+            "SELECT data FROM entries WHERE record_name = ? ORDER BY rowid",
+            (record_name,))
+        return [pickle.loads(r[0]) for r in rows]
+
+    def queryEntries(self, record_name, *, spec_pattern=None,
+                     out_pattern=None, failed_only=False):
+        sql = "SELECT data FROM entries AS e WHERE e.record_name = ?"
+        params = [record_name]
+        if failed_only:
+            sql += " AND e.success = 0"
+        if spec_pattern:
+            sql += " AND fnmatch(e.item_spec, ?)"
+            params.append(spec_pattern)
+        if out_pattern:
+            sql += (" AND EXISTS (SELECT 1 FROM outputs AS o "
+                    "WHERE o.record_name = e.record_name AND "
+                    "o.item_spec = e.item_spec AND fnmatch(o.out_path, ?))")
+            params.append(out_pattern)
+        sql += " ORDER BY e.rowid"
+        rows = self._query(sql, params)
+        return [pickle.loads(r[0]) for r in rows]
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            # Don't re-open a file that might have been moved, or replaced
+            # by newer records, since we were closed.
+            if self._closed:
+                raise Exception("Bake records '%s' were closed." % self.path)
+            # Connections can't be shared with forked worker processes.
+            if self._conn is None or self._conn_pid != os.getpid():
+                self._conn = sqlite3.connect(self.path,
+                                             check_same_thread=False)
+                # Match patterns like `fnmatch` does, which is case
+                # insensitive on some platforms, unlike `GLOB`.
+                self._conn.create_function('fnmatch', 2, _sql_fnmatch)
+                self._conn_pid = os.getpid()
+            return self._conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def write(path, meta, records):
+        dump = pickle.dumps
+        proto = pickle.HIGHEST_PROTOCOL
+        conn = sqlite3.connect(path)
+        try:
+            with conn:
+                for stmt in _RecordStore.SCHEMA:
+                    conn.execute(stmt)
+                conn.executemany(
+                    "INSERT INTO meta VALUES (?, ?)",
+                    [(k, dump(v, proto)) for k, v in meta.items()])
+                for rec in records:
+                    conn.execute(
+                        "INSERT INTO records VALUES (?, ?, ?, ?)",
+                        (rec.name, rec.success,
+                         dump(rec.user_data, proto),
+                         dump(rec.deleted_out_paths, proto)))
+                    entries = list(rec.getEntries())
+                    conn.executemany(
+                        "INSERT INTO entries VALUES (?, ?, ?, ?)",
+                        [(rec.name, e.item_spec, e.success, dump(e, proto))
+                         for e in entries])
+                    conn.executemany(
+                        "INSERT INTO outputs VALUES (?, ?, ?)",
+                        [(rec.name, e.item_spec, op)
+                         for e in entries
+                         for op in (e.getAllOutputPaths() or [])])
+        finally:
+            conn.close()
+
+
+def _sql_fnmatch(name, pattern):
+    return 1 if fnmatch.fnmatch(name, pattern) else 0
 
 
 def get_flag_descriptions(flags, flag_descriptions):
@@ -213,6 +431,31 @@ class RecordHistory:
         return RecordHistory(self._previous, self._current)
 
 
+class OutputPathIndex:
+    """ Keeps track of which record entry gets baked to which output
+        path, so that pipelines can figure out if an item is overriden
+        by another one.
+    """
+    def __init__(self):
+        self.conflicts = []
+        self._owners = {}
+
+    def claim(self, out_path, record_name, item_spec):
+        """ Claims the given output path for the given record entry.
+            Returns `None` if that worked, or the `(record_name,
+            item_spec)` of the entry that claimed it first otherwise.
+        """
+        owner = (record_name, item_spec)
+        cur_owner = self._owners.setdefault(out_path, owner)
+        if cur_owner == owner:
+            return None
+        self.conflicts.append((out_path, cur_owner, owner))
+        return cur_owner
+
+    def getOwner(self, out_path):
+        return self._owners.get(out_path)
+
+
 class MultiRecordHistory:
     """ Tracks the differences between an 'old' and a 'new' record
         container.
@@ -224,6 +467,7 @@ class MultiRecordHistory:
         self.previous = previous
         self.current = current
         self.histories = []
+        self.output_paths = OutputPathIndex()
         self._linkHistories(previous, current)
 
     def getPreviousRecord(self, record_name, auto_create=True):
@@ -21,7 +21,7 @@ class BuiltInPlugin(PieCrustPlugin):
         from piecrust.commands.builtin.tasks import TasksCommand
         from piecrust.commands.builtin.themes import ThemesCommand
         from piecrust.commands.builtin.util import (
-            InitCommand, PurgeCommand, ImportCommand)
+            InitCommand, PurgeCommand, CacheCommand, ImportCommand)
 
         return [
             InitCommand(),
@@ -29,6 +29,7 @@ class BuiltInPlugin(PieCrustPlugin):
             HelpCommand(),
             RootCommand(),
             PurgeCommand(),
+            CacheCommand(),
             ShowConfigCommand(),
             FindCommand(),
             PrepareCommand(),
@@ -1,6 +1,8 @@
 import re
+import copy
 import os.path
 import logging
+from piecrust.cache import get_data_size
 from piecrust.data.builder import (
     DataBuildingContext, build_page_data, add_layout_data)
 from piecrust.templating.base import TemplateNotFoundError, TemplatingError
@@ -23,9 +25,29 @@ class TemplateEngineNotFound(Exception):
 
 
 class RenderedSegments(object):
-    def __init__(self, segments, used_templating=False):
+    def __init__(self, segments, used_templating=False, used_templates=None,
+                 used_config_keys=None, used_source_names=None,
+                 used_source_items=None, pagination=None):
         self.segments = segments
         self.used_templating = used_templating
+        self.used_templates = used_templates
+        self.used_config_keys = used_config_keys
+        self.used_source_names = used_source_names
+        self.used_source_items = used_source_items
+        # If the segments used pagination, whether there were items on
+        # this page, and whether there are more pages after this one.
+        self.pagination = pagination
+
+
+def get_rendered_segments_size(render_result):
+    """ Returns an estimate of how much memory some rendered segments
+        take, for use in the rendered segments repository.
+    """
+    return (get_data_size(render_result.segments) +
+            get_data_size(render_result.used_templates) +
+            get_data_size(render_result.used_config_keys) +
+            get_data_size(render_result.used_source_names) +
+            get_data_size(render_result.used_source_items))
 
 
 class RenderedLayout(object):
@@ -53,6 +75,9 @@ def create_render_info():
     """
     return {
         'used_source_names': {'segments': [], 'layout': []},
+        'used_source_items': {'segments': {}, 'layout': {}},
+        'used_templates': {'segments': [], 'layout': []},
+        'used_config_keys': {'segments': [], 'layout': []},
         'used_pagination': False,
         'pagination_has_items': False,
         'pagination_has_more': False,
@@ -69,6 +94,7 @@ class RenderingContext(object):
         self.pagination_filter = None
         self.render_info = create_render_info()
         self.custom_data = {}
+        self._current_render_pass = None
         self._current_used_source_names = None
 
     @property
@@ -84,6 +110,7 @@ class RenderingContext(object):
             raise Exception("No render pass specified.")
 
     def setRenderPass(self, name):
+        self._current_render_pass = name
         if name is not None:
             self._current_used_source_names = \
                 self.render_info['used_source_names'][name]
@@ -98,12 +125,128 @@ class RenderingContext(object):
         ri['used_pagination'] = True
         ri['pagination_has_items'] = paginator.has_items
         ri['pagination_has_more'] = paginator.has_more
-        self.addUsedSource(paginator._source)
+        if not paginator._is_content_source:
+            # Otherwise, the paginator's page iterator keeps track of what
+            # items we used.
+            self.addUsedSource(paginator._source)
 
     def addUsedSource(self, source):
+        """ Marks the given source as used by the current render pass,
+            in a way that depends on all of its items.
+        """
+        self._addUsedSourceName(source.name)
+        usi = self.render_info['used_source_items'][self._current_render_pass]
+        usi[source.name] = None
+
+    def addUsedSourceItems(self, source_name, item_specs, setting_names):
+        """ Marks the given items of a source as used by the current
+            render pass. The page also depends on which items of that
+            source get listed, and in what order, which can change when
+            the given settings change on any of the source's items.
+            `None` means any setting could matter.
+        """
+        self._addUsedSourceName(source_name)
+        usi = self.render_info['used_source_items'][self._current_render_pass]
+        if source_name not in usi:
+            usi[source_name] = {'items': [], 'settings': []}
+        usage = usi[source_name]
+        if usage is None:
+            return
+        usage['items'] = _merge_lists(usage['items'], item_specs)
+        if setting_names is None or usage['settings'] is None:
+            usage['settings'] = None
+        else:
+            usage['settings'] = _merge_lists(usage['settings'],
+                                             setting_names)
+
+    def _addUsedSourceName(self, source_name):
         usn = self.current_used_source_names
-        if source.name not in usn:
-            usn.append(source.name)
+        if source_name not in usn:
+            usn.append(source_name)
+
+    def addUsedTemplate(self, name):
+        if self._current_render_pass is None:
+            return
+        ut = self.render_info['used_templates'][self._current_render_pass]
+        if ut is not None and name not in ut:
+            ut.append(name)
+
+    def addUsedConfigKey(self, key_path):
+        if self._current_render_pass is None:
+            return
+        uck = self.render_info['used_config_keys'][self._current_render_pass]
+        if key_path not in uck:
+            uck.append(key_path)
+
+    def getDependencies(self, since=None):
+        """ Returns the sources, templates, and settings used so far by
+            the current render pass, minus those in `since` if given.
+        """
+        ri = self.render_info
+        pass_name = self._current_render_pass
+        if pass_name is None:
+            raise Exception("No render pass specified.")
+
+        ut = ri['used_templates'][pass_name]
+        deps = {
+            'used_source_names': set(ri['used_source_names'][pass_name]),
+            'used_templates': set(ut) if ut is not None else None,
+            'used_config_keys': set(ri['used_config_keys'][pass_name])}
+        if since is not None:
+            for k, v in since.items():
+                if (k in deps and v is not None and
+                        deps[k] is not None):
+                    deps[k] -= v
+
+        usi = copy.deepcopy(ri['used_source_items'][pass_name])
+        if since is not None:
+            for sn, usage in since['used_source_items'].items():
+                if usi.get(sn, _MISSING) == usage:
+                    del usi[sn]
+        deps['used_source_items'] = usi
+        return deps
+
+    def addDependencies(self, deps):
+        """ Adds dependencies returned by `getDependencies` to the current
+            render pass.
+        """
+        for sn in deps['used_source_names']:
+            self._addUsedSourceName(sn)
+        for sn, usage in deps['used_source_items'].items():
+            if usage is None:
+                self.addUsedSource(self.app.getSource(sn))
+            else:
+                self.addUsedSourceItems(sn, usage['items'],
+                                        usage['settings'])
+        if deps['used_templates'] is None:
+            self.setUsedTemplatesUnknown()
+        else:
+            for t in deps['used_templates']:
+                self.addUsedTemplate(t)
+        for k in deps['used_config_keys']:
+            self.addUsedConfigKey(k)
+
+    def setUsedTemplatesUnknown(self):
+        """ Marks the current render pass as having used templates we
+            can't know about, e.g. because the template engine doesn't
+            keep track of them.
+        """
+        if self._current_render_pass is not None:
+            self.render_info['used_templates'][self._current_render_pass] = \
+                None
+
+
+_MISSING = object()
+
+
+def _merge_lists(items, other_items):
+    res = list(items)
+    known = set(items)
+    for i in other_items:
+        if i not in known:
+            res.append(i)
+            known.add(i)
+    return res
 
 
 class RenderingContextStack(object):
@@ -175,6 +318,24 @@ def render_page(ctx):
                 if repo:
                     repo.put(page_uri, render_result, save_to_fs)
 
+        # The segments may have come from the cache, so get the templates
+        # and settings they used from there.
+        used_templates = render_result.used_templates
+        if used_templates is not None:
+            used_templates = list(used_templates)
+        ctx.render_info['used_templates']['segments'] = used_templates
+        ctx.render_info['used_config_keys']['segments'] = list(
+            render_result.used_config_keys or [])
+        ctx.render_info['used_source_names']['segments'] = list(
+            render_result.used_source_names or [])
+        ctx.render_info['used_source_items']['segments'] = copy.deepcopy(
+            render_result.used_source_items or {})
+        if render_result.pagination is not None:
+            ri = ctx.render_info
+            ri['used_pagination'] = True
+            ri['pagination_has_items'], ri['pagination_has_more'] = \
+                render_result.pagination
+
         # Render layout.
         layout_name = page.config.get('layout')
         if layout_name is None:
@@ -289,6 +450,8 @@ def _do_render_page_segments(ctx, page_data):
                     page.content_spec, seg, page_data)
                 if was_rendered:
                     used_templating = True
+                    if not engine.TRACKS_USED_TEMPLATES:
+                        ctx.setUsedTemplatesUnknown()
         except TemplatingError as err:
             err.lineno += seg.line
             raise err
@@ -304,7 +467,21 @@ def _do_render_page_segments(ctx, page_data):
                 content_abstract = seg_text[:offset]
                 formatted_segments['content.abstract'] = content_abstract
 
-    res = RenderedSegments(formatted_segments, used_templating)
+    used_templates = ctx.render_info['used_templates']['segments']
+    if used_templates is not None:
+        used_templates = list(used_templates)
+    used_config_keys = list(ctx.render_info['used_config_keys']['segments'])
+    used_source_names = list(ctx.render_info['used_source_names']['segments'])
+    used_source_items = copy.deepcopy(
+        ctx.render_info['used_source_items']['segments'])
+    pagination = None
+    if ctx.render_info['used_pagination']:
+        pagination = (ctx.render_info['pagination_has_items'],
+                      ctx.render_info['pagination_has_more'])
+    res = RenderedSegments(formatted_segments, used_templating,
+                           used_templates, used_config_keys,
+                           used_source_names, used_source_items,
+                           pagination)
 
     app.env.stats.stepCounter('PageRenderSegments')
 
@@ -330,6 +507,8 @@ def _do_render_layout(layout_name, page, layout_data):
     _, engine_name = os.path.splitext(full_names[0])
     engine_name = engine_name.lstrip('.')
     engine = get_template_engine(app, engine_name)
+    if not engine.TRACKS_USED_TEMPLATES:
+        cur_ctx.setUsedTemplatesUnknown()
 
     try:
         with app.env.stats.timerScope(
@@ -135,6 +135,14 @@ class ProcessingLoopBase:
                 continue
             yield src
 
+    def getTemplatesDirs(self):
+        return []
+
+    def onFilesChanged(self, sources, paths):
+        logger.debug("Processing: %s" % [s.name for s in sources])
+        for s in sources:
+            self.runPipelines(s)
+
     def runPipelines(self, only_for_source=None):
         try:
             self._doRunPipelines(only_for_source)
@@ -199,7 +207,10 @@ class ProcessingLoopBase:
 
 try:
     from watchdog.observers import Observer
-    from watchdog.events import FileSystemEventHandler
+    from watchdog.events import (
+        FileSystemEventHandler,
+        EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED, EVENT_TYPE_MOVED,
+        EVENT_TYPE_DELETED)
     _has_watchdog = True
 except ImportError:
     _has_watchdog = False
@@ -207,6 +218,12 @@ except ImportError:
 
 if _has_watchdog:
     class _AssetFileEventHandler(FileSystemEventHandler):
+        # Some platforms also tell us about files being opened or closed
+        # without being written to, which doesn't change anything for us.
+        CHANGE_EVENT_TYPES = [
+            EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED, EVENT_TYPE_MOVED,
+            EVENT_TYPE_DELETED]
+
         def __init__(self, proc_loop, source):
             self._proc_loop = proc_loop
             self._source = source
@@ -214,6 +231,8 @@ if _has_watchdog:
         def on_any_event(self, event):
             if event.is_directory:
                 return
+            if event.event_type not in self.CHANGE_EVENT_TYPES:
+                return
 
             pl = self._proc_loop
             with pl._lock:
@@ -274,6 +293,11 @@ if _has_watchdog:
                 event_handler = _AssetFileEventHandler(self, src)
                 observer.schedule(event_handler, path, recursive=True)
 
+            for path in self.getTemplatesDirs():
+                logger.debug(" - %s" % path)
+                event_handler = _AssetFileEventHandler(self, None)
+                observer.schedule(event_handler, path, recursive=True)
+
             observer.start()
             self._op_thread.start()
 
@@ -302,22 +326,146 @@ if _has_watchdog:
                         continue
 
                     sources = set()
+                    paths = set()
                     ops = list(filter(lambda o: o['op'] == 'bake', ops))
                     for op in ops:
                         logger.info("Detected file-system change: "
                                     "%s [%s]" %
                                     (op['path'], op['change']))
-                        sources.add(op['source'])
+                        # Changes to templates don't have a source.
+                        if op['source'] is not None:
+                            sources.add(op['source'])
+                        paths.add(op['path'])
 
-                    logger.debug("Processing: %s" % [s.name for s in sources])
-                    for s in sources:
-                        self.runPipelines(s)
+                    self.onFilesChanged(sources, paths)
 
                     self._last_op_time = time.time()
 
                 except (KeyboardInterrupt, SystemExit):
                     break
 
+    class BakeWatchLoop(WatchdogProcessingLoop):
+        """ A processing loop that keeps a whole website baked into the
+            given output directory, re-baking whatever is affected by the
+            files that change.
+
+            The app and the bake records stay in memory between bakes, and
+            the records are only saved to disk every now and then, when
+            `checkpointRecords` is called.
+        """
+        def __init__(self, appfactory, out_dir, *,
+                     force=False,
+                     allowed_pipelines=None,
+                     forbidden_pipelines=None,
+                     allowed_sources=None,
+                     config_overrides=None):
+            WatchdogProcessingLoop.__init__(self, appfactory, out_dir)
+            self.force = force
+            self.allowed_pipelines = allowed_pipelines
+            self.forbidden_pipelines = forbidden_pipelines
+            self.allowed_sources = allowed_sources
+            self.config_overrides = config_overrides or {}
+            self._bake_lock = threading.Lock()
+            self._records = None
+            self._records_dirty = False
+            self._last_checkpoint_time = 0
+
+        def initialize(self):
+            # A new app means the site configuration changed, so we start
+            # over with a regular bake.
+            self.checkpointRecords(force=True)
+            with self._bake_lock:
+                self._records = None
+            WatchdogProcessingLoop.initialize(self)
+
+        def onInitialize(self):
+            for k, v in self.config_overrides.items():
+                self._app.config.set(k, v)
+
+        def getSources(self):
+            # Generated sources (like taxonomies) are baked whenever the
+            # sources they depend on change.
+            for src in self._app.sources:
+                if getattr(src, 'fs_endpoint_path', None):
+                    yield src
+
+        def getTemplatesDirs(self):
+            return self._app.templates_dirs
+
+        def onFilesChanged(self, sources, paths):
+            reload_templates = False
+            for d in self.getTemplatesDirs():
+                d = os.path.join(d, '')
+                if any([p.startswith(d) for p in paths]):
+                    reload_templates = True
+                    break
+
+            with self._bake_lock:
+                self._app.reloadContents(reload_templates=reload_templates)
+            self.runPipelines()
+
+        def checkpointRecords(self, *, force=False):
+            from piecrust.baking.baker import (
+                get_bake_records_path, save_bake_records)
+
+            with self._bake_lock:
+                if not self._records_dirty:
+                    return
+
+                interval = self._app.config.get(
+                    'baker/watch_checkpoint_interval')
+                since = time.time() - self._last_checkpoint_time
+                if not force and since < interval:
+                    return
+
+                records_path = get_bake_records_path(self._app, self.out_dir)
+                with format_timed_scope(logger, "checkpointed bake records",
+                                        level=logging.DEBUG, colored=False):
+                    save_bake_records(self._records, records_path,
+                                      rotate_previous=False)
+                self._records_dirty = False
+                self._last_checkpoint_time = time.time()
+
+        def _doRunPipelines(self, only_for_source):
+            from piecrust.baking.baker import Baker
+            from piecrust.workerpool import BACKEND_INLINE
+
+            with self._bake_lock:
+                # The first bake is a regular one. After that, jobs run
+                # inline, with our app and in-memory records. They can't run
+                # in worker threads because the app and the rendering
+                # context aren't thread-safe.
+                is_first = self._records is None
+                self._app.env.stats.reset()
+                baker = Baker(
+                    self.appfactory, self._app, self.out_dir,
+                    force=(self.force and is_first),
+                    allowed_pipelines=self.allowed_pipelines,
+                    forbidden_pipelines=self.forbidden_pipelines,
+                    allowed_sources=self.allowed_sources,
+                    previous_records=self._records,
+                    save_bake_records=is_first,
+                    worker_backend=(None if is_first else BACKEND_INLINE))
+                try:
+                    records = baker.bake()
+                except Exception:
+                    # We can't trust our in-memory records anymore, so go
+                    # back to the last ones saved to disk.
+                    self._records = None
+                    self._records_dirty = False
+                    raise
+
+                self._records = records
+                if is_first:
+                    self._last_checkpoint_time = time.time()
+                else:
+                    self._records_dirty = True
+
+            self._onPipelinesRun(records)
+
+        def _onPipelinesRun(self, records):
+            logger.info("Waiting for changes...")
+
     ProcessingLoop = WatchdogProcessingLoop
 
 else:
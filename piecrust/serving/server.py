@@ -123,6 +123,9 @@ class _ServerImpl(object):
             logger.error(str(ex))
             msg = "There was an error trying to serve: %s" % request.path
             raise InternalServerError(msg) from ex
+        finally:
+            # Each request gets a new app, so save what it cached.
+            app.cache.flush()
 
     def _try_serve_asset(self, environ, request):
         offset = len(self.root_url)
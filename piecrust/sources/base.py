@@ -102,6 +102,10 @@ class ContentSource:
     def getItemMtime(self, item):
         raise NotImplementedError()
 
+    def clearCache(self):
+        self._cache = None
+        self._page_cache = None
+
     def getAllPages(self):
         if self._page_cache is not None:
             return self._page_cache
@@ -133,6 +133,8 @@ class _MonthlyArchiveData(collections.abc.Mapping):
 
 
 class BlogArchivesPipelineRecordEntry(PagePipelineRecordEntry):
+    __slots__ = ('year',)
+
     def __init__(self):
         super().__init__()
         self.year = None
@@ -238,6 +240,14 @@ class BlogArchivesPipeline(ContentPipeline):
                     PagePipelineRecordEntry.FLAG_SEGMENTS_RENDERED):
                 dirty_years.add(dt.year)
 
+        # Also re-bake the archives that use templates or settings that
+        # changed since last bake.
+        if self.ctx.has_changed_inputs:
+            for prev_entry in ctx.previous_record.getEntries():
+                if (prev_entry.year in all_years and
+                        any(self.ctx.getChangedInputsUsage(prev_entry))):
+                    dirty_years.add(prev_entry.year)
+
         self._all_years = all_years
         self._dirty_years = dirty_years
 
@@ -61,7 +61,7 @@ class FSContentSourceBase(ContentSource):
         return open(item.spec, mode, **kwargs)
 
     def getItemMtime(self, item):
-        return os.path.getmtime(item.spec)
+        return self.app.file_times.getMtime(item.spec)
 
     def describe(self):
         return {'endpoint_path': self.fs_endpoint_path}
@@ -241,6 +241,8 @@ def _get_slugifier(app, taxonomy, slugify_mode=None):
 
 
 class TaxonomyPipelineRecordEntry(PagePipelineRecordEntry):
+    __slots__ = ('term',)
+
     def __init__(self):
         super().__init__()
         self.term = None
@@ -278,6 +280,7 @@ class TaxonomyPipeline(ContentPipeline):
                      (self.taxonomy.name, self.inner_source.name))
         self._analyzer = _TaxonomyTermsAnalyzer(self, ctx.record_histories)
         self._analyzer.analyze()
+        self._addTermsUsingChangedInputs(ctx)
 
         logger.debug("Queuing %d '%s' jobs." %
                      (len(self._analyzer.dirty_slugified_terms),
@@ -299,6 +302,24 @@ class TaxonomyPipeline(ContentPipeline):
             return jobs, "taxonomize"
         return None, None
 
+    def _addTermsUsingChangedInputs(self, ctx):
+        if not self.ctx.has_changed_inputs:
+            return
+
+        analyzer = self._analyzer
+        dirty_slugified_terms = analyzer.dirty_slugified_terms
+        for prev_entry in ctx.previous_record.getEntries():
+            t = prev_entry.term
+            if t is None or t in dirty_slugified_terms:
+                continue
+            is_known = all(
+                (analyzer.isKnownSlugifiedTerm(st)
+                 for st in t.split(self.taxonomy.separator)))
+            if is_known and any(self.ctx.getChangedInputsUsage(prev_entry)):
+                logger.debug("Term '%s' uses changed templates or "
+                             "settings." % t)
+                dirty_slugified_terms.append(t)
+
     def run(self, job, ctx, result):
         term = job['term']
         content_item = ContentItem('_index[%s]' % term,
@@ -468,7 +489,7 @@ class _TaxonomyTermsAnalyzer(object):
 def _get_all_entry_taxonomy_terms(entry):
     res = set()
     for o in entry.subs:
-        pinfo = o['render_info']
+        pinfo = o.render_info
         terms = pinfo.get('used_taxonomy_terms')
         if terms:
             res |= set([tuple(t) for t in terms])
@@ -23,6 +23,13 @@ class TemplatingError(Exception):
 
 class TemplateEngine(object):
     EXTENSIONS = []
+    # Whether the engine tells the current rendering context about all the
+    # templates it loads (see `RenderingContext.addUsedTemplate`).
+    TRACKS_USED_TEMPLATES = False
+    # Whether `populateCache` only caches things in memory, which is only
+    # useful to worker processes forked from this one, as opposed to on
+    # disk, where all the workers can use them.
+    CACHES_IN_MEMORY_ONLY = False
 
     def initialize(self, app):
         self.app = app
@@ -30,6 +37,9 @@ class TemplateEngine(object):
     def populateCache(self):
         pass
 
+    def clearCache(self):
+        pass
+
     def renderSegment(self, path, segment, data):
         raise NotImplementedError()
 
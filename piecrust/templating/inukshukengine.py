@@ -40,6 +40,9 @@ class InukshukTemplateEngine(TemplateEngine):
 
         self.engine.cacheAllTemplates(cache_condition=_filter_names)
 
+    def clearCache(self):
+        self.engine = None
+
     def renderSegment(self, path, segment, data):
         if not _string_needs_render(segment.content):
             return segment.content, False
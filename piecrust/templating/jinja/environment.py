@@ -78,6 +78,17 @@ class PieCrustEnvironment(Environment):
 
         self.filters['raw'] = self.filters['safe']
 
+    def _load_template(self, name, globals):
+        # Every template loaded while rendering a page (including extended,
+        # included, and imported ones) goes through here, even if it was
+        # already compiled, so it's a good place to figure out what
+        # templates a page depends on.
+        if not name.startswith('$seg='):
+            ctx = self.app.env.render_ctx_stack.current_ctx
+            if ctx is not None:
+                ctx.addUsedTemplate(name)
+        return super(PieCrustEnvironment, self)._load_template(name, globals)
+
     def _paginate(self, value, items_per_page=5):
         ctx = self.app.env.render_ctx_stack.current_ctx
         if ctx is None or ctx.page is None:
@@ -153,15 +153,13 @@ class PieCrustCacheExtension(Extension):
         # it in the cache.
         pair = self.environment.piecrust_cache.get(key)
         if pair is not None:
-            for usn in pair[1]:
-                ctx.addUsedSource(usn)
+            ctx.addDependencies(pair[1])
             return pair[0]
 
-        prev_used = set(ctx.current_used_source_names)
+        prev_deps = ctx.getDependencies()
         rv = caller()
-        after_used = set(ctx.current_used_source_names)
-        used_delta = after_used.difference(prev_used)
-        self.environment.piecrust_cache[key] = (rv, used_delta)
+        deps_delta = ctx.getDependencies(since=prev_deps)
+        self.environment.piecrust_cache[key] = (rv, deps_delta)
         return rv
 
 
@@ -11,12 +11,31 @@ logger = logging.getLogger(__name__)
 class JinjaTemplateEngine(TemplateEngine):
     ENGINE_NAMES = ['jinja', 'jinja2', 'j2']
     EXTENSIONS = ['html', 'jinja', 'jinja2', 'j2']
+    TRACKS_USED_TEMPLATES = True
+    CACHES_IN_MEMORY_ONLY = True
 
     def __init__(self):
         self.env = None
         self._jinja_syntax_error = None
         self._jinja_not_found = None
 
+    def populateCache(self):
+        self._ensureLoaded()
+
+        # Compile all the templates we can find, so that worker processes
+        # forked from this one don't have to do it again.
+        for name in self.env.list_templates():
+            try:
+                self.env.get_template(name)
+            except Exception as ex:
+                logger.debug("Can't pre-compile template '%s': %s" %
+                             (name, ex))
+
+    def clearCache(self):
+        # Templates are never reloaded while baking, so start over with a
+        # new environment.
+        self.env = None
+
     def renderSegment(self, path, segment, data):
         if not _string_needs_render(segment.content):
             return segment.content, False
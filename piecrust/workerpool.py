@@ -1,13 +1,23 @@
 import io
 import os
 import sys
+import math
 import time
+import queue
 import logging
 import threading
+import collections
 import traceback
 import multiprocessing
+import multiprocessing.connection
 from piecrust.environment import ExecutionStats
 
+try:
+    from multiprocessing import shared_memory
+    from multiprocessing import resource_tracker
+except ImportError:
+    shared_memory = None
+
 
 logger = logging.getLogger(__name__)
 
@@ -58,6 +68,8 @@ TASK_JOB_BATCH = 1
 TASK_END = 2
 _TASK_ABORT_WORKER = 10
 _CRITICAL_WORKER_ERROR = 11
+_WORKER_RETIRED = 12
+_WORKER_READY = 13
 
 
 def worker_func(params):
@@ -86,7 +98,7 @@ def _real_worker_func(params):
         logger.exception(ex)
         msg = ("CRITICAL ERROR IN WORKER %d\n%s" % (params.wid, str(ex)))
         params.outqueue.put((
-            _CRITICAL_WORKER_ERROR, None, False, params.wid, msg))
+            _CRITICAL_WORKER_ERROR, params.wid, None, [(None, msg, False)]))
 
 
 def _pre_parse_pytest_args():
@@ -121,30 +133,13 @@ def _real_worker_func_unsafe(params):
     stats = ExecutionStats()
     stats.registerTimer('WorkerInit')
 
-    # In a context where `multiprocessing` is using the `spawn` forking model,
-    # the new process doesn't inherit anything, so we lost all our logging
-    # configuration here. Let's set it up again.
-    if (hasattr(multiprocessing, 'get_start_method') and
-            multiprocessing.get_start_method() == 'spawn'):
-        if not params.is_unit_testing:
-            from piecrust.main import _pre_parse_chef_args
-            _pre_parse_chef_args(sys.argv[1:])
-        else:
-            _pre_parse_pytest_args()
-    elif params.is_unit_testing:
-        _pre_parse_pytest_args()
-
-    from piecrust.main import ColoredFormatter
-    root_logger = logging.getLogger()
-    root_logger.handlers[0].setFormatter(ColoredFormatter(
-        ('[W-%d]' % wid) + '[%(name)s] %(message)s'))
+    # Worker threads share everything with the main process, so there's
+    # nothing to setup for them.
+    if params.backend == BACKEND_PROCESS:
+        _setup_worker_process(params)
 
     logger.debug("Worker %d initializing..." % wid)
 
-    # We don't need those.
-    params.inqueue._writer.close()
-    params.outqueue._reader.close()
-
     # Initialize the underlying worker class.
     w = params.worker_class(*params.initargs)
     w.wid = wid
@@ -157,6 +152,14 @@ def _real_worker_func_unsafe(params):
 
     stats.stepTimerSince('WorkerInit', init_start_time)
 
+    # Keep track of how long it takes to start a worker process, so the
+    # main process can figure out if it's worth starting one next time.
+    if params.backend == BACKEND_PROCESS:
+        stats.registerTimer('WorkerProcessInit',
+                            time=stats.timers['WorkerInit'])
+        stats.registerCounter('WorkerProcessCount')
+        stats.stepCounter('WorkerProcessCount')
+
     # Start pumping!
     completed = 0
     time_in_get = 0
@@ -165,6 +168,11 @@ def _real_worker_func_unsafe(params):
     get = params.inqueue.get
     put = params.outqueue.put
 
+    # The main process only sends us work when we ask for it, so that it
+    # always knows which batch we're working on, in case we crash and it
+    # needs to give those jobs to another worker.
+    put((_WORKER_READY, wid, None, None))
+
     while True:
         get_start_time = time.perf_counter()
         task = get()
@@ -178,9 +186,9 @@ def _real_worker_func_unsafe(params):
         # Job task(s)... just do it.
         if task_type == TASK_JOB or task_type == TASK_JOB_BATCH:
 
-            task_data_list = task_data
+            batch_id, task_data_list = task_data
             if task_type == TASK_JOB:
-                task_data_list = [task_data]
+                task_data_list = [task_data_list]
 
             result_list = []
 
@@ -195,31 +203,33 @@ def _real_worker_func_unsafe(params):
                     error_res = _get_worker_exception_data(wid)
                     result_list.append((td, error_res, False))
 
-            res = (task_type, wid, result_list)
+            res = (task_type, wid, batch_id, result_list)
             put_start_time = time.perf_counter()
             put(res)
             time_in_put += (time.perf_counter() - put_start_time)
 
             completed += len(task_data_list)
 
+            # Retire if we've done enough work, or if we're using too much
+            # memory. The main process will start a new worker to replace
+            # us.
+            retire_reason = _get_retire_reason(params, completed)
+            if retire_reason:
+                logger.debug("Worker %d is retiring: %s" %
+                             (wid, retire_reason))
+                put(_get_worker_report(
+                    _WORKER_RETIRED, None, wid, w, stats,
+                    time_in_get, time_in_put))
+                break
+
+            put((_WORKER_READY, wid, None, None))
+
         # End task... gather stats to send back to the main process.
         elif task_type == TASK_END:
             logger.debug("Worker %d got end task, exiting." % wid)
-            stats.registerTimer('Worker_%d_TaskGet' % wid, time=time_in_get)
-            stats.registerTimer('Worker_all_TaskGet', time=time_in_get)
-            stats.registerTimer('Worker_%d_ResultPut' % wid, time=time_in_put)
-            stats.registerTimer('Worker_all_ResultPut', time=time_in_put)
-            try:
-                stats.mergeStats(w.getStats())
-                stats_data = stats.toData()
-                rep = (task_type, wid, [(task_data, (wid, stats_data), True)])
-            except Exception as e:
-                logger.debug(
-                    "Error getting report, sending exception to main process:")
-                logger.debug(traceback.format_exc())
-                we = _get_worker_exception_data(wid)
-                rep = (task_type, wid, [(task_data, (wid, we), False)])
-            put(rep)
+            put(_get_worker_report(
+                task_type, task_data, wid, w, stats,
+                time_in_get, time_in_put))
             break
 
         # Emergy abort.
@@ -240,9 +250,171 @@ def _real_worker_func_unsafe(params):
     logger.debug("Worker %d completed %d tasks." % (wid, completed))
 
 
+def get_job_batches(jobs, costs=None, batch_size=None, worker_count=1):
+    """ Cuts the given jobs into batches.
+
+        Without any costs, jobs are cut into batches of `batch_size` in
+        list order. With costs (one estimated duration per job, or `None`
+        when unknown), jobs are sorted longest-first, and batches are
+        sized so that each one costs about half of a worker's fair share
+        of the remaining work. This makes batches shrink towards the end
+        of the queue, so that workers finish at roughly the same time.
+    """
+    job_count = len(jobs)
+    if job_count == 0:
+        return []
+
+    if costs is None:
+        if not batch_size:
+            return [jobs]
+        return [jobs[i:i + batch_size]
+                for i in range(0, job_count, batch_size)]
+
+    if len(costs) != job_count:
+        raise ValueError("Expected %d job costs, got %d." %
+                         (job_count, len(costs)))
+
+    # Jobs we don't know anything about are assumed to be average.
+    known_costs = [c for c in costs if c is not None]
+    default_cost = 1
+    if known_costs:
+        default_cost = sum(known_costs) / len(known_costs)
+    costs = [c if c is not None else default_cost for c in costs]
+
+    # Longest jobs first. The sort is stable so jobs of equal cost keep
+    # their original order.
+    order = sorted(range(job_count), key=lambda i: costs[i], reverse=True)
+    if not batch_size:
+        return [[jobs[i] for i in order]]
+
+    worker_count = max(1, worker_count)
+    remaining_cost = sum(costs)
+    batches = []
+    cur_batch = []
+    cur_cost = 0
+    target_cost = remaining_cost / (2 * worker_count)
+    for i in order:
+        cur_batch.append(jobs[i])
+        cur_cost += costs[i]
+        if len(cur_batch) >= batch_size or cur_cost >= target_cost:
+            batches.append(cur_batch)
+            remaining_cost -= cur_cost
+            cur_batch = []
+            cur_cost = 0
+            target_cost = remaining_cost / (2 * worker_count)
+    if cur_batch:
+        batches.append(cur_batch)
+    return batches
+
+
+def get_wanted_worker_count(costs, worker_spawn_cost, max_count):
+    """ Returns how many workers are worth starting for jobs with the
+        given estimated costs (one duration per job, or `None` when
+        unknown), given how long it takes to start a worker.
+
+        Each worker should get at least enough work to make up for its
+        own startup time. When nothing is known about the jobs, one
+        worker per job is wanted.
+    """
+    job_count = len(costs)
+    if job_count == 0:
+        return 0
+
+    known_costs = [c for c in costs if c is not None]
+    if not known_costs or not worker_spawn_cost:
+        return min(job_count, max_count)
+
+    default_cost = sum(known_costs) / len(known_costs)
+    total_cost = (sum(known_costs) +
+                  default_cost * (job_count - len(known_costs)))
+    wanted = int(math.ceil(total_cost / worker_spawn_cost))
+    return max(1, min(wanted, job_count, max_count))
+
+
+def _setup_worker_process(params):
+    # In a context where `multiprocessing` is using the `spawn` or
+    # `forkserver` forking models, the new process doesn't inherit anything
+    # from us, so we lost all our logging configuration here. Let's set it
+    # up again.
+    start_method = params.start_method
+    if start_method is None and hasattr(multiprocessing, 'get_start_method'):
+        start_method = multiprocessing.get_start_method()
+    if start_method in ['spawn', 'forkserver']:
+        if not params.is_unit_testing:
+            from piecrust.main import _pre_parse_chef_args
+            _pre_parse_chef_args(sys.argv[1:])
+        else:
+            _pre_parse_pytest_args()
+    elif params.is_unit_testing:
+        _pre_parse_pytest_args()
+
+    from piecrust.main import ColoredFormatter
+    root_logger = logging.getLogger()
+    if root_logger.handlers:
+        root_logger.handlers[0].setFormatter(ColoredFormatter(
+            ('[W-%d]' % params.wid) + '[%(name)s] %(message)s'))
+
+    # We don't need those.
+    params.inqueue._writer.close()
+    params.outqueue._reader.close()
+
+
+def _get_worker_report(task_type, task_data, wid, w, stats,
+                       time_in_get, time_in_put):
+    stats.registerTimer('Worker_%d_TaskGet' % wid, time=time_in_get)
+    stats.registerTimer('Worker_all_TaskGet', time=time_in_get)
+    stats.registerTimer('Worker_%d_ResultPut' % wid, time=time_in_put)
+    stats.registerTimer('Worker_all_ResultPut', time=time_in_put)
+    try:
+        stats.mergeStats(w.getStats())
+        stats_data = stats.toData()
+        return (task_type, wid, None,
+                [(task_data, (wid, stats_data), True)])
+    except Exception as e:
+        logger.debug(
+            "Error getting report, sending exception to main process:")
+        logger.debug(traceback.format_exc())
+        we = _get_worker_exception_data(wid)
+        return (task_type, wid, None, [(task_data, (wid, we), False)])
+
+
+def _get_retire_reason(params, completed):
+    if params.max_jobs and completed >= params.max_jobs:
+        return "processed %d jobs" % completed
+    if params.max_memory:
+        rss = get_process_memory()
+        if rss is not None and rss > params.max_memory:
+            return "using %.1fMB of memory" % (rss / (1024 * 1024))
+    return None
+
+
+def get_process_memory():
+    """ Returns the resident memory of the current process, in bytes, or
+        `None` if it can't be figured out.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    # This is the peak memory usage, in kilobytes (or bytes on macOS),
+    # which is the best we can do here.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss
+    return rss * 1024
+
+
 class _WorkerParams:
     def __init__(self, wid, inqueue, outqueue, worker_class, initargs=(),
-                 is_profiling=False, is_unit_testing=False):
+                 is_profiling=False, is_unit_testing=False,
+                 start_method=None, max_jobs=None, max_memory=None,
+                 backend=None):
         self.wid = wid
         self.inqueue = inqueue
         self.outqueue = outqueue
@@ -250,13 +422,57 @@ class _WorkerParams:
         self.initargs = initargs
         self.is_profiling = is_profiling
         self.is_unit_testing = is_unit_testing
+        self.start_method = start_method
+        self.max_jobs = max_jobs
+        self.max_memory = max_memory
+        self.backend = backend or BACKEND_PROCESS
+
+
+def _get_respawn_start_method():
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return 'forkserver'
+    return 'spawn'
+
+
+BACKEND_PROCESS = 'process'
+BACKEND_THREAD = 'thread'
+BACKEND_INLINE = 'inline'
+
+TRANSPORT_SIMPLE = 'simple'
+TRANSPORT_FAST = 'fast'
+TRANSPORT_SHARED_MEMORY = 'shm'
+
+
+def create_queue(transport=None, mp_ctx=None):
+    """ Creates a queue for talking to worker processes, using the given
+        transport. See the `TRANSPORT_*` constants.
+    """
+    if transport is None:
+        transport = TRANSPORT_FAST if use_fastqueue else TRANSPORT_SIMPLE
+    if mp_ctx is None:
+        mp_ctx = multiprocessing.get_context()
+
+    if transport == TRANSPORT_SIMPLE:
+        return mp_ctx.SimpleQueue()
+    if transport == TRANSPORT_FAST:
+        return FastQueue(mp_ctx=mp_ctx)
+    if transport == TRANSPORT_SHARED_MEMORY:
+        if shared_memory is None:
+            logger.warning("Shared memory isn't available on this version "
+                           "of Python, falling back to the fast queue.")
+            return FastQueue(mp_ctx=mp_ctx)
+        return SharedMemoryQueue(mp_ctx=mp_ctx)
+    raise Exception("Unknown worker transport: %s" % transport)
 
 
 class WorkerPool:
     def __init__(self, worker_class, initargs=(), *,
                  callback=None, error_callback=None,
                  worker_count=None, batch_size=None,
-                 userdata=None):
+                 transport=None, start_method=None, preload_modules=None,
+                 max_job_retries=2, max_jobs_per_worker=None,
+                 max_worker_memory=None, backend=None,
+                 worker_spawn_cost=None, userdata=None):
         init_start_time = time.perf_counter()
 
         stats = ExecutionStats()
@@ -269,26 +485,94 @@ class WorkerPool:
 
         worker_count = worker_count or os.cpu_count() or 1
 
-        if use_fastqueue:
-            self._task_queue = FastQueue()
-            self._result_queue = FastQueue()
-            self._quick_put = self._task_queue.put
-            self._quick_get = self._result_queue.get
-        else:
-            self._task_queue = multiprocessing.SimpleQueue()
-            self._result_queue = multiprocessing.SimpleQueue()
-            self._quick_put = self._task_queue.put
-            self._quick_get = self._result_queue.get
+        # Workers are either processes or threads. Threads are cheaper to
+        # start and don't need anything to be pickled, but only make sense
+        # for I/O bound jobs. There can also be no workers at all, with
+        # jobs running right away on the calling thread, which is best for
+        # when there are only a handful of jobs.
+        backend = backend or BACKEND_PROCESS
+        if backend not in [BACKEND_PROCESS, BACKEND_THREAD, BACKEND_INLINE]:
+            raise Exception("Unknown worker backend: %s" % backend)
+        self._backend = backend
 
         self._callback = callback
         self._error_callback = error_callback
+        self._worker_class = worker_class
+        self._initargs = initargs
+        self._closed = False
+
+        if backend == BACKEND_INLINE:
+            self._inline_worker = None
+            self._worker_count = 1
+            self._jobs_left = 0
+            self._error_on_join = None
+            stats.stepTimerSince('MasterInit', init_start_time)
+            return
+
+        if backend == BACKEND_PROCESS:
+            # Workers can be started with a specific method, like `fork` (so
+            # they inherit the state of the main process) or `forkserver`
+            # (so they start from a clean process that has already imported
+            # the modules they need).
+            mp_ctx = multiprocessing.get_context(start_method)
+
+            # Workers that replace crashed or retired ones are started from
+            # our helper threads, and forking a process that has several
+            # threads running can leave the child stuck on a lock that
+            # another thread was holding, like an import lock. So they're
+            # started by a fork server instead. This means our queues can't
+            # be tied to the `fork` context, whose semaphores can't be
+            # passed to processes that aren't forked from us.
+            respawn_ctx = mp_ctx
+            if mp_ctx.get_start_method() == 'fork':
+                respawn_ctx = multiprocessing.get_context(
+                    _get_respawn_start_method())
+            for ctx in [mp_ctx, respawn_ctx]:
+                if ctx.get_start_method() == 'forkserver' and preload_modules:
+                    ctx.set_forkserver_preload(preload_modules)
+            self._mp_ctx = mp_ctx
+            self._respawn_ctx = respawn_ctx
+            self._result_queue = create_queue(transport, respawn_ctx)
+        else:
+            self._mp_ctx = None
+            self._respawn_ctx = None
+            self._result_queue = queue.SimpleQueue()
+        self._transport = transport
+        self._quick_get = self._result_queue.get
+
         self._batch_size = batch_size
         self._jobs_left = 0
         self._lock_jobs_left = threading.Lock()
         self._lock_workers = threading.Lock()
         self._event = threading.Event()
         self._error_on_join = None
-        self._closed = False
+        self._closing = False
+
+        # Keep track of the job batches that haven't been completed yet,
+        # and of which batch each worker is working on, so that we can give
+        # them to another worker if one crashes. Each worker has its own
+        # task queue, and we hand out a batch whenever a worker asks for
+        # one, so we know who's got what.
+        self._next_batch_id = 0
+        self._pending_batches = {}
+        self._queued_batches = collections.deque()
+        self._idle_workers = []
+        self._lock_batches = threading.Lock()
+        self._task_queues = [None] * worker_count
+        self._in_flight = [-1] * worker_count
+        self._max_job_retries = max_job_retries
+        self._respawns_left = worker_count * (max_job_retries + 1)
+
+        # Workers can retire after a number of jobs, or when they use too
+        # much memory (in bytes), and get replaced by fresh ones. This
+        # doesn't apply to threads, which don't have their own memory.
+        self._max_jobs_per_worker = None
+        self._max_worker_memory = None
+        if backend == BACKEND_PROCESS:
+            self._max_jobs_per_worker = max_jobs_per_worker
+            self._max_worker_memory = max_worker_memory
+        self._retired_workers = []
+        self._retired_stats = []
 
         main_module = sys.modules['__main__']
         is_profiling = os.path.basename(main_module.__file__) in [
@@ -296,19 +580,18 @@ class WorkerPool:
         is_unit_testing = os.path.basename(main_module.__file__) in [
             'py.test']
 
+        self._is_profiling = is_profiling
+        self._is_unit_testing = is_unit_testing
+
+        # Workers are either all started right away, or started as jobs
+        # come in, as long as there's enough work to make up for the time
+        # (in seconds) it takes to start them.
+        self._worker_count = worker_count
+        self._worker_spawn_cost = worker_spawn_cost
+        self._wave_costs = []
         self._pool = []
-        for i in range(worker_count):
-            worker_params = _WorkerParams(
-                i, self._task_queue, self._result_queue,
-                worker_class, initargs,
-                is_profiling=is_profiling,
-                is_unit_testing=is_unit_testing)
-            w = multiprocessing.Process(target=worker_func,
-                                        args=(worker_params,))
-            w.name = w.name.replace('Process', 'PoolWorker')
-            w.daemon = True
-            w.start()
-            self._pool.append(w)
+        if worker_spawn_cost is None:
+            self._spawnWorkers(worker_count)
 
         self._result_handler = threading.Thread(
             target=WorkerPool._handleResults,
@@ -316,38 +599,68 @@ class WorkerPool:
         self._result_handler.daemon = True
         self._result_handler.start()
 
+        # Watch for worker processes that crash. Worker threads can't
+        # disappear without telling us.
+        if backend == BACKEND_PROCESS:
+            self._monitor = threading.Thread(
+                target=WorkerPool._monitorWorkers,
+                args=(self,))
+            self._monitor.daemon = True
+            self._monitor.start()
+
         stats.stepTimerSince('MasterInit', init_start_time)
 
     @property
     def pool_size(self):
+        return self._worker_count
+
+    @property
+    def started_worker_count(self):
+        if self._backend == BACKEND_INLINE:
+            return 0
         return len(self._pool)
 
-    def queueJobs(self, jobs):
+    def queueJobs(self, jobs, *, costs=None):
         if self._closed:
             if self._error_on_join:
                 raise self._error_on_join
             raise Exception("This worker pool has been closed.")
 
         jobs = list(jobs)
+        if self._backend == BACKEND_INLINE:
+            self._runJobsInline(jobs)
+            return
+
         new_job_count = len(jobs)
         if new_job_count > 0:
             put_start_time = time.perf_counter()
 
             with self._lock_jobs_left:
+                # Start a new "wave" of jobs if the previous ones are all
+                # done. Workers are started based on the cost of the
+                # whole wave.
+                if self._jobs_left == 0:
+                    self._wave_costs = []
                 self._jobs_left += new_job_count
 
+            worker_count = self._worker_count
+            if self._worker_spawn_cost is not None:
+                self._wave_costs += (costs or [None] * new_job_count)
+                worker_count = get_wanted_worker_count(
+                    self._wave_costs, self._worker_spawn_cost,
+                    self._worker_count)
+                self._spawnWorkers(worker_count)
+                worker_count = len(self._pool)
+
             self._event.clear()
             bs = self._batch_size
-            if not bs:
-                for job in jobs:
-                    self._quick_put((TASK_JOB, job))
-            else:
-                cur_offset = 0
-                while cur_offset < new_job_count:
-                    next_batch_idx = min(cur_offset + bs, new_job_count)
-                    job_batch = jobs[cur_offset:next_batch_idx]
-                    self._quick_put((TASK_JOB_BATCH, job_batch))
-                    cur_offset = next_batch_idx
+            batches = get_job_batches(jobs, costs, bs, worker_count)
+            for job_batch in batches:
+                if not bs:
+                    for job in job_batch:
+                        self._putBatch(TASK_JOB, [job])
+                else:
+                    self._putBatch(TASK_JOB_BATCH, job_batch)
 
             self._time_in_put += (time.perf_counter() - put_start_time)
         else:
@@ -360,6 +673,9 @@ class WorkerPool:
         if self._closed:
             raise Exception("This worker pool has been closed.")
 
+        if self._backend == BACKEND_INLINE:
+            return True
+
         ret = self._event.wait(timeout)
         if self._error_on_join:
             raise self._error_on_join
@@ -370,26 +686,37 @@ class WorkerPool:
             raise Exception("This worker pool has been closed.")
         if self._jobs_left > 0:
             raise Exception("A previous job queue has not finished yet.")
+        if self._backend == BACKEND_INLINE:
+            return self._closeInline()
         if not self._event.is_set():
             raise Exception("A previous job queue hasn't been cleared.")
 
         close_start_time = time.perf_counter()
         logger.debug("Closing worker pool...")
-        live_workers = list(filter(lambda w: w is not None, self._pool))
-        handler = _ReportHandler(len(live_workers))
-        self._callback = handler._handle
-        self._error_callback = handler._handleError
-        for w in live_workers:
-            self._quick_put((TASK_END, None))
-        for w in live_workers:
+        # Stop watching for crashed workers, since they're about to exit.
+        self._closing = True
+
+        with self._lock_workers:
+            live_workers = [(wid, w) for wid, w in enumerate(self._pool)
+                            if w is not None]
+            handler = _ReportHandler(len(self._pool), len(live_workers))
+            self._callback = handler._handle
+            self._error_callback = handler._handleError
+            for wid, _ in live_workers:
+                self._putEndTask(wid)
+        for _, w in live_workers:
+            w.join()
+        for w in self._retired_workers:
             w.join()
 
         logger.debug("Waiting for reports...")
         if not handler.wait(2):
-            missing = handler.reports.index(None)
+            missing = [wid for wid, w in enumerate(self._pool)
+                       if w is not None and handler.reports[wid] is None]
             logger.warning(
                 "Didn't receive all worker reports before timeout. "
-                "Missing report from worker %d." % missing)
+                "Missing report from worker(s): %s." %
+                ', '.join(map(str, missing)))
 
         logger.debug("Exiting result handler thread...")
         self._result_queue.put(None)
@@ -402,11 +729,242 @@ class WorkerPool:
         stats.registerTimer('MasterClose',
                             time=(time.perf_counter() - close_start_time))
 
-        return [stats] + handler.reports
+        return [stats] + self._retired_stats + handler.reports
+
+    def _runJobsInline(self, jobs):
+        stats = self._stats
+        w = self._inline_worker
+        if w is None and jobs:
+            init_start_time = time.perf_counter()
+            stats.registerTimer('WorkerInit')
+            w = self._worker_class(*self._initargs)
+            w.wid = 0
+            w.initialize()
+            self._inline_worker = w
+            stats.stepTimerSince('WorkerInit', init_start_time)
+
+        for job in jobs:
+            try:
+                res = w.process(job)
+                success = True
+            except Exception:
+                logger.debug("Error processing job inline:")
+                logger.debug(traceback.format_exc())
+                res = _get_worker_exception_data(0)
+                success = False
+
+            try:
+                if success:
+                    if self._callback:
+                        self._callback(job, res, self.userdata)
+                elif self._error_callback:
+                    self._error_callback(job, res, self.userdata)
+                else:
+                    logger.error("Failed to process a job:")
+                    logger.error(res)
+            except Exception as ex:
+                logger.exception(ex)
+
+    def _closeInline(self):
+        self._closed = True
+        w = self._inline_worker
+        if w is None:
+            return [self._stats]
+
+        try:
+            w.shutdown()
+        except Exception as ex:
+            logger.error("Inline worker failed to shutdown.")
+            logger.exception(ex)
+        return [self._stats, w.getStats()]
+
+    def _spawnWorkers(self, count):
+        count = min(count, self._worker_count)
+        with self._lock_workers:
+            for wid in range(len(self._pool), count):
+                logger.debug("Starting worker %d." % wid)
+                self._pool.append(None)
+                self._startWorker(wid)
+
+    def _startWorker(self, wid, *, respawn=False):
+        if self._backend == BACKEND_THREAD:
+            task_queue = queue.SimpleQueue()
+            worker_params = _WorkerParams(
+                wid, task_queue, self._result_queue,
+                self._worker_class, self._initargs,
+                backend=BACKEND_THREAD)
+            w = threading.Thread(target=_real_worker_func,
+                                 args=(worker_params,))
+            w.name = 'PoolWorkerThread-%d' % wid
+            w.daemon = True
+            self._task_queues[wid] = task_queue
+            w.start()
+            self._pool[wid] = w
+            return
+
+        mp_ctx = self._respawn_ctx if respawn else self._mp_ctx
+        task_queue = create_queue(self._transport, self._respawn_ctx)
+        worker_params = _WorkerParams(
+            wid, task_queue, self._result_queue,
+            self._worker_class, self._initargs,
+            is_profiling=self._is_profiling,
+            is_unit_testing=self._is_unit_testing,
+            start_method=mp_ctx.get_start_method(),
+            max_jobs=self._max_jobs_per_worker,
+            max_memory=self._max_worker_memory)
+        w = mp_ctx.Process(target=worker_func, args=(worker_params,))
+        w.name = w.name.replace('Process', 'PoolWorker')
+        w.daemon = True
+        self._task_queues[wid] = task_queue
+        w.start()
+        # Only the worker reads from its task queue, and this way we get an
+        # error instead of blocking if we write to it after it's gone.
+        task_queue._reader.close()
+        self._pool[wid] = w
+
+    def _putBatch(self, task_type, job_batch, batch_id=None):
+        with self._lock_batches:
+            if batch_id is None:
+                batch_id = self._next_batch_id
+                self._next_batch_id += 1
+                self._pending_batches[batch_id] = [task_type, job_batch, 0]
+
+            if not self._idle_workers:
+                self._queued_batches.append(batch_id)
+                return
+            wid = self._idle_workers.pop()
+            task_queue = self._handOutBatch(wid, batch_id)
+
+        self._sendBatch(wid, task_queue, task_type, job_batch, batch_id)
+
+    def _onWorkerReady(self, wid):
+        with self._lock_batches:
+            if not self._queued_batches:
+                self._idle_workers.append(wid)
+                return
+            batch_id = self._queued_batches.popleft()
+            task_queue = self._handOutBatch(wid, batch_id)
+            task_type, job_batch, _ = self._pending_batches[batch_id]
+
+        self._sendBatch(wid, task_queue, task_type, job_batch, batch_id)
+
+    def _handOutBatch(self, wid, batch_id):
+        # Must be called with the batches lock held.
+        self._in_flight[wid] = batch_id
+        return self._task_queues[wid]
+
+    def _sendBatch(self, wid, task_queue, task_type, job_batch, batch_id):
+        if task_type == TASK_JOB:
+            task = (TASK_JOB, (batch_id, job_batch[0]))
+        else:
+            task = (TASK_JOB_BATCH, (batch_id, job_batch))
+        try:
+            task_queue.put(task)
+        except OSError:
+            # The worker is gone... the monitor thread will give the batch
+            # to another worker.
+            logger.debug("Couldn't send batch %d to worker %d." %
+                         (batch_id, wid))
+
+    def _putEndTask(self, wid):
+        try:
+            self._task_queues[wid].put((TASK_END, None))
+        except OSError:
+            # The worker just retired, and its replacement will get its own
+            # end task.
+            logger.debug("Couldn't send end task to worker %d." % wid)
+
+    def _onBatchDone(self, wid, batch_id):
+        with self._lock_batches:
+            if self._in_flight[wid] == batch_id:
+                self._in_flight[wid] = -1
+            return self._pending_batches.pop(batch_id, None) is not None
+
+    def _requeueInFlightBatch(self, wid):
+        with self._lock_batches:
+            if wid in self._idle_workers:
+                self._idle_workers.remove(wid)
+            batch_id = self._in_flight[wid]
+            self._in_flight[wid] = -1
+            if batch_id < 0:
+                return
+
+            pending = self._pending_batches.get(batch_id)
+            if pending is None:
+                # The worker died after sending its results.
+                return
+            pending[2] += 1
+            task_type, job_batch, tries = pending
+            give_up = (tries > self._max_job_retries)
+            if give_up:
+                del self._pending_batches[batch_id]
+
+        if not give_up:
+            logger.debug("Re-queuing %d jobs from worker %d (attempt %d)." %
+                         (len(job_batch), wid, tries + 1))
+            self._putBatch(task_type, job_batch, batch_id)
+            return
+
+        logger.error("Giving up on %d jobs after %d worker crashes." %
+                     (len(job_batch), tries))
+        error_data = {
+            'wid': wid,
+            'type': 'WorkerCrash',
+            'value': ("Worker crashed %d times while processing this "
+                      "job." % tries),
+            'traceback': ''}
+        for job in job_batch:
+            try:
+                if self._error_callback:
+                    self._error_callback(job, error_data, self.userdata)
+            except Exception as ex:
+                logger.exception(ex)
+        self._onTaskDone(len(job_batch))
+
+    def _onWorkerCrashed(self, wid, exitcode):
+        logger.error("Worker %d died unexpectedly (exit code %s)." %
+                     (wid, exitcode))
+        self._requeueInFlightBatch(wid)
+        return self._respawnWorker(wid)
+
+    def _onWorkerRetired(self, wid, res_data_list):
+        for _, data, success in res_data_list:
+            if success:
+                stats = ExecutionStats()
+                stats.fromData(data[1])
+                self._retired_stats.append(stats)
+            else:
+                logger.error("Worker %d failed to send its report." % wid)
+                logger.error(data)
+
+        # Always replace the worker, even if we're closing, because the new
+        # one will be expected to handle an end task.
+        with self._lock_workers:
+            self._retired_workers.append(self._pool[wid])
+            logger.debug("Starting a new worker %d." % wid)
+            self._startWorker(wid, respawn=True)
+            if self._closing:
+                self._putEndTask(wid)
 
     def _onResultHandlerCriticalError(self, wid):
         logger.error("Result handler received a critical error from "
                      "worker %d." % wid)
+        self._requeueInFlightBatch(wid)
+        # The worker exits cleanly after sending a critical error, so the
+        # monitor thread won't replace it.
+        return self._respawnWorker(wid)
+
+    def _respawnWorker(self, wid):
+        with self._lock_workers:
+            if self._respawns_left > 0 and not self._closing:
+                self._respawns_left -= 1
+                self._retired_workers.append(self._pool[wid])
+                logger.debug("Starting a new worker %d." % wid)
+                self._startWorker(wid, respawn=True)
+                return True
+        return self._onWorkerLost(wid)
+
+    def _onWorkerLost(self, wid):
         with self._lock_workers:
             self._pool[wid] = None
             if all(map(lambda w: w is None, self._pool)):
@@ -443,7 +1001,33 @@ class WorkerPool:
                 logger.debug("Result handler exiting.")
                 return
 
-            task_type, wid, res_data_list = res
+            task_type, wid, batch_id, res_data_list = res
+
+            if task_type == _CRITICAL_WORKER_ERROR:
+                for _, data, _ in res_data_list:
+                    logger.error(data)
+                do_continue = pool._onResultHandlerCriticalError(wid)
+                if not do_continue:
+                    logger.debug("Aborting result handling thread.")
+                    return
+                continue
+
+            if task_type == _WORKER_READY:
+                pool._onWorkerReady(wid)
+                continue
+
+            if task_type == _WORKER_RETIRED:
+                pool._onWorkerRetired(wid, res_data_list)
+                continue
+
+            if (batch_id is not None and
+                    not pool._onBatchDone(wid, batch_id)):
+                # We already got results for this batch from another
+                # worker, after re-queuing it.
+                logger.debug("Ignoring duplicate results for batch %d." %
+                             batch_id)
+                continue
+
             for res_data in res_data_list:
                 try:
                     task_data, data, success = res_data
@@ -451,40 +1035,61 @@ class WorkerPool:
                         if pool._callback:
                             pool._callback(task_data, data, userdata)
                     else:
-                        if task_type == _CRITICAL_WORKER_ERROR:
-                            logger.error(data)
-                            do_continue = pool._onResultHandlerCriticalError(wid)
-                            if not do_continue:
-                                logger.debug("Aborting result handling thread.")
-                                return
+                        if pool._error_callback:
+                            pool._error_callback(task_data, data, userdata)
                         else:
-                            if pool._error_callback:
-                                pool._error_callback(task_data, data, userdata)
-                            else:
-                                logger.error(
-                                    "Worker %d failed to process a job:" % wid)
-                                logger.error(data)
+                            logger.error(
+                                "Worker %d failed to process a job:" % wid)
+                            logger.error(data)
                 except Exception as ex:
                     logger.exception(ex)
 
             if task_type == TASK_JOB or task_type == TASK_JOB_BATCH:
                 pool._onTaskDone(len(res_data_list))
 
+    @staticmethod
+    def _monitorWorkers(pool):
+        handled = set()
+        while not pool._closing:
+            with pool._lock_workers:
+                workers = [(wid, w) for wid, w in enumerate(pool._pool)
+                           if w is not None and w.pid not in handled]
+            if not workers:
+                time.sleep(0.1)
+                continue
+
+            ready = multiprocessing.connection.wait(
+                [w.sentinel for _, w in workers], timeout=0.1)
+            for wid, w in workers:
+                if w.sentinel not in ready:
+                    continue
+                # The sentinel can be ready slightly before the process
+                # can be reaped.
+                exitcode = w.exitcode
+                if exitcode is None:
+                    continue
+                handled.add(w.pid)
+                if exitcode != 0 and not pool._closing:
+                    pool._onWorkerCrashed(wid, exitcode)
+
 
 class _ReportHandler:
-    def __init__(self, worker_count):
+    def __init__(self, worker_count, expected_count):
         self.reports = [None] * worker_count
         self._count = worker_count
+        self._expected = expected_count
         self._received = 0
         self._lock = threading.Lock()
         self._event = threading.Event()
+        if expected_count == 0:
+            self._event.set()
 
     def wait(self, timeout=None):
         return self._event.wait(timeout)
 
     def _handle(self, job, res, _):
         wid, data = res
-        if wid < 0 or wid > self._count:
+        if wid < 0 or wid >= self._count:
             logger.error("Ignoring report from unknown worker %d." % wid)
             return
 
@@ -494,7 +1099,7 @@ class _ReportHandler:
         with self._lock:
             self.reports[wid] = stats
             self._received += 1
-            if self._received == self._count:
+            if self._received == self._expected:
                 self._event.set()
 
     def _handleError(self, job, res, _):
@@ -503,10 +1108,11 @@ class _ReportHandler:
 
 
 class FastQueue:
-    def __init__(self):
-        self._reader, self._writer = multiprocessing.Pipe(duplex=False)
-        self._rlock = multiprocessing.Lock()
-        self._wlock = multiprocessing.Lock()
+    def __init__(self, mp_ctx=None):
+        mp_ctx = mp_ctx or multiprocessing.get_context()
+        self._reader, self._writer = mp_ctx.Pipe(duplex=False)
+        self._rlock = mp_ctx.Lock()
+        self._wlock = mp_ctx.Lock()
         self._initBuffers()
         self._initSerializer()
 
@@ -515,6 +1121,9 @@ class FastQueue:
         self._rbuf.truncate(256)
         self._wbuf = io.BytesIO()
         self._wbuf.truncate(256)
+        # Several threads can put things in the same queue (like the main
+        # thread and the worker monitor), so protect the write buffer.
+        self._wbuf_lock = threading.Lock()
 
     def _initSerializer(self):
         pass
@@ -527,6 +1136,17 @@ class FastQueue:
         self._initBuffers()
 
     def get(self):
+        bufsize = self._recvBytes()
+        self._rbuf.seek(0)
+        return _unpickle(self, self._rbuf, bufsize)
+
+    def put(self, obj):
+        with self._wbuf_lock:
+            self._wbuf.seek(0)
+            _pickle(self, obj, self._wbuf)
+            self._sendBytes(self._wbuf.tell())
+
+    def _recvBytes(self):
         with self._rlock:
             self._rbuf.seek(0)
             try:
@@ -537,19 +1157,87 @@ class FastQueue:
                 self._rbuf.truncate(bufsize * 2)
                 self._rbuf.seek(0)
                 self._rbuf.write(e.args[0])
+        return bufsize
+
+    def _sendBytes(self, size):
+        self._wbuf.seek(0)
+        with self._wlock:
+            with self._wbuf.getbuffer() as b:
+                self._writer.send_bytes(b, 0, size)
+
+
+_SHM_INLINE = b'\x00'
+_SHM_SEGMENT = b'\x01'
 
+
+class SharedMemoryQueue(FastQueue):
+    """ A `FastQueue` that moves large payloads through shared memory.
+
+        Payloads bigger than `threshold` bytes are copied into a new
+        shared memory segment, and only the name and size of that segment
+        go through the pipe. The receiving end copies the payload out and
+        destroys the segment. Smaller payloads are sent inline.
+
+        Creating and destroying a segment isn't cheap (it also involves
+        messages to the `multiprocessing` resource tracker), so it's only
+        worth it for very large payloads. Use `garcon/benchqueues.py` to
+        see how it does on a given machine.
+    """
+    def __init__(self, threshold=1024 * 1024, mp_ctx=None):
+        self._threshold = threshold
+        super().__init__(mp_ctx)
+
+    def __getstate__(self):
+        return super().__getstate__() + (self._threshold,)
+
+    def __setstate__(self, state):
+        super().__setstate__(state[:-1])
+        self._threshold = state[-1]
+
+    def get(self):
+        bufsize = self._recvBytes()
         self._rbuf.seek(0)
-        return _unpickle(self, self._rbuf, bufsize)
+        marker = self._rbuf.read(1)
+        if marker == _SHM_INLINE:
+            return _unpickle(self, self._rbuf, bufsize - 1)
+
+        name, size = self._rbuf.read(bufsize - 1).decode('ascii').split(':')
+        size = int(size)
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            data = io.BytesIO(shm.buf[:size])
+        finally:
+            shm.close()
+            shm.unlink()
+        return _unpickle(self, data, size)
 
     def put(self, obj):
+        with self._wbuf_lock:
+            self._putLocked(obj)
+
+    def _putLocked(self, obj):
         self._wbuf.seek(0)
+        self._wbuf.write(_SHM_INLINE)
         _pickle(self, obj, self._wbuf)
         size = self._wbuf.tell()
 
-        self._wbuf.seek(0)
-        with self._wlock:
+        payload_size = size - 1
+        if payload_size > self._threshold:
+            shm = shared_memory.SharedMemory(create=True, size=payload_size)
+            # The receiving end is in charge of destroying the segment, so
+            # don't let the resource tracker think we leaked it.
+            resource_tracker.unregister(shm._name, 'shared_memory')
             with self._wbuf.getbuffer() as b:
-                self._writer.send_bytes(b, 0, size)
+                shm.buf[:payload_size] = b[1:size]
+            desc = '%s:%d' % (shm.name, payload_size)
+            shm.close()
+
+            self._wbuf.seek(0)
+            self._wbuf.write(_SHM_SEGMENT)
+            self._wbuf.write(desc.encode('ascii'))
+            size = self._wbuf.tell()
+
+        self._sendBytes(size)
 
 
 class _BufferWrapper:
@@ -1,4 +1,5 @@
 from invoke import Collection, task, run
+from garcon.benchqueues import benchqueues
 from garcon.benchsite import genbenchsite
 from garcon.changelog import genchangelog
 from garcon.documentation import gendocs
@@ -7,6 +8,7 @@ from garcon.pypi import makerelease
 
 
 ns = Collection()
+ns.add_task(benchqueues, name='benchqueues')
 ns.add_task(genbenchsite, name='benchsite')
 ns.add_task(genchangelog, name='changelog')
 ns.add_task(gendocs, name='docs')
@@ -1,4 +1,10 @@
+import os
 import time
+import shutil
+import threading
+import subprocess
+import pytest
+from unittest import mock
 from .mockutil import get_mock_app, mock_fs, mock_fs_scope
 
 
@@ -111,3 +117,745 @@ def test_bake_four_times_again():
         assert structure['2017']['01']['01']['first.html'] == 'something 1'
         assert structure['2017']['01']['02']['second.html'] == 'something 2'
 
+
+def test_null_bake():
+    from unittest import mock
+    from piecrust.baking.baker import Baker
+
+    fs = (mock_fs()
+          .withConfig()
+          .withPage('pages/foo.md', {'layout': 'none', 'format': 'none'},
+                    "a foo page")
+          .withPage('pages/bar.md', {'layout': 'none', 'format': 'none'},
+                    "a bar page"))
+    with mock_fs_scope(fs):
+        bake_passes = Baker._bakePipelinePasses
+        with mock.patch.object(Baker, '_bakePipelinePasses', autospec=True,
+                               side_effect=bake_passes) as m:
+            fs.runChef('bake')
+            assert m.call_count == 1
+
+            fs.runChef('bake')
+            assert m.call_count == 1
+
+            fs.withPage('pages/foo.md', {'layout': 'none', 'format': 'none'},
+                        "an updated foo page")
+            fs.runChef('bake')
+            assert m.call_count == 2
+
+            fs.runChef('bake', '--html-only')
+            assert m.call_count == 3
+
+            os.remove(fs.path('kitchen/pages/bar.md'))
+            fs.runChef('bake')
+            assert m.call_count == 4
+
+            fs.runChef('bake')
+            assert m.call_count == 4
+
+        structure = fs.getStructure('kitchen/_counter')
+        assert structure['foo.html'] == 'an updated foo page'
+        assert 'bar.html' not in structure
+
+
+def test_null_bake_returns_loaded_records():
+    from piecrust.app import PieCrustFactory
+    from piecrust.baking.baker import Baker
+
+    fs = (mock_fs()
+          .withConfig()
+          .withPage('pages/foo.md', {'layout': 'none', 'format': 'none'},
+                    "a foo page"))
+    with mock_fs_scope(fs):
+        def _make_baker():
+            app = fs.getApp()
+            return Baker(PieCrustFactory(app.root_dir), app,
+                         fs.path('kitchen/_counter'))
+
+        _make_baker().bake()
+
+        baker = _make_baker()
+        app = baker.app
+        with mock.patch.object(Baker, '_bakePipelinePasses') as m_bake, \
+                mock.patch.object(app.cache, 'flush',
+                                  wraps=app.cache.flush) as m_flush:
+            records = baker.bake()
+            assert m_bake.call_count == 0
+            assert m_flush.call_count == 1
+
+        # We're done with the records file, but the entries are still there.
+        assert all([r._store is None for r in records.records])
+        specs = [e.item_spec for r in records.records
+                 for e in r.getEntries()]
+        assert fs.path('kitchen/pages/foo.md') in specs
+
+
+def test_bake_after_deleting_output():
+    fs = (mock_fs()
+          .withConfig()
+          .withPage('pages/foo.md', {'layout': 'none', 'format': 'none'},
+                    "a foo page")
+          .withPage('pages/bar.md', {'layout': 'none', 'format': 'none'},
+                    "a bar page"))
+    with mock_fs_scope(fs):
+        fs.runChef('bake')
+        shutil.rmtree(fs.path('kitchen/_counter'))
+        fs.runChef('bake')
+        structure = fs.getStructure('kitchen/_counter')
+        assert structure['foo.html'] == 'a foo page'
+        assert structure['bar.html'] == 'a bar page'
+
+
+def _add_paginated_posts(fs, layout):
+    fs.withPage('pages/_index.html', {'layout': layout, 'format': 'none'},
+                "{% for p in pagination.posts %}{{p.title}} {% endfor %}")
+    for i in range(1, 4):
+        fs.withPage('posts/2017-01-0%d_post%d.html' % (i, i),
+                    {'title': "Post%d" % i, 'format': 'none',
+                     'layout': 'none'},
+                    "post %d" % i)
+    return fs
+
+
+def test_bake_after_template_change():
+    fs = (mock_fs()
+          .withConfig({'site': {'posts_per_page': 2}})
+          .withFile('kitchen/templates/first.html',
+                    "FIRST {{content|safe}}")
+          .withFile('kitchen/templates/second.html',
+                    "SECOND {{content|safe}}")
+          .withFile('kitchen/templates/part.html', "part")
+          .withPage('pages/foo.md', {'layout': 'first', 'format': 'none'},
+                    "foo {% include 'part.html' %}")
+          .withPage('pages/bar.md', {'layout': 'second', 'format': 'none'},
+                    "bar"))
+    _add_paginated_posts(fs, 'second')
+    with mock_fs_scope(fs):
+        fs.runChef('bake', '-o', fs.path('counter'))
+        structure = fs.getStructure('counter')
+        assert structure['foo.html'] == 'FIRST foo part'
+        assert structure['bar.html'] == 'SECOND bar'
+        assert structure['index.html'] == 'SECOND Post3 Post2 '
+        assert structure['2.html'] == 'SECOND Post1 '
+        bar_mtime = os.path.getmtime(fs.path('counter/bar.html'))
+
+        time.sleep(1)
+        fs.withFile('kitchen/templates/part.html', "new part")
+        fs.runChef('bake', '-o', fs.path('counter'))
+        structure = fs.getStructure('counter')
+        assert structure['foo.html'] == 'FIRST foo new part'
+        assert structure['bar.html'] == 'SECOND bar'
+        assert bar_mtime == os.path.getmtime(fs.path('counter/bar.html'))
+        foo_mtime = os.path.getmtime(fs.path('counter/foo.html'))
+
+        time.sleep(1)
+        fs.withFile('kitchen/templates/second.html',
+                    "NEW SECOND {{content|safe}}")
+        fs.runChef('bake', '-o', fs.path('counter'))
+        structure = fs.getStructure('counter')
+        assert structure['foo.html'] == 'FIRST foo new part'
+        assert structure['bar.html'] == 'NEW SECOND bar'
+        assert foo_mtime == os.path.getmtime(fs.path('counter/foo.html'))
+        # Pages after the first one of a paginated page are still there,
+        # even though its segments came from the cache.
+        assert structure['index.html'] == 'NEW SECOND Post3 Post2 '
+        assert structure['2.html'] == 'NEW SECOND Post1 '
+
+
+def test_bake_after_config_change():
+    fs = (mock_fs()
+          .withConfig({'site': {'footer': "F1", 'tagline': "T1",
+                                'posts_per_page': 2}})
+          .withFile('kitchen/templates/first.html',
+                    "{{content|safe}} {{site.footer}}")
+          .withFile('kitchen/templates/second.html',
+                    "{{content|safe}} {{site.tagline}}")
+          .withPage('pages/foo.md', {'layout': 'first', 'format': 'none'},
+                    "foo")
+          .withPage('pages/bar.md', {'layout': 'second', 'format': 'none'},
+                    "bar"))
+    _add_paginated_posts(fs, 'first')
+    with mock_fs_scope(fs):
+        fs.runChef('bake', '-o', fs.path('counter'))
+        structure = fs.getStructure('counter')
+        assert structure['foo.html'] == 'foo F1'
+        assert structure['bar.html'] == 'bar T1'
+        assert structure['index.html'] == 'Post3 Post2  F1'
+        assert structure['2.html'] == 'Post1  F1'
+        bar_mtime = os.path.getmtime(fs.path('counter/bar.html'))
+
+        time.sleep(1)
+        fs.withConfig({'site': {'footer': "F2", 'tagline': "T1",
+                                'posts_per_page': 2}})
+        fs.runChef('bake', '-o', fs.path('counter'))
+        structure = fs.getStructure('counter')
+        assert structure['foo.html'] == 'foo F2'
+        assert structure['bar.html'] == 'bar T1'
+        assert bar_mtime == os.path.getmtime(fs.path('counter/bar.html'))
+        assert structure['index.html'] == 'Post3 Post2  F2'
+        assert structure['2.html'] == 'Post1  F2'
+
+        # Settings used by PieCrust itself make everything re-bake.
+        time.sleep(1)
+        fs.withConfig({'site': {'footer': "F2", 'tagline': "T1",
+                                'posts_per_page': 2,
+                                'slugify_mode': 'lowercase'}})
+        fs.runChef('bake', '-o', fs.path('counter'))
+        structure = fs.getStructure('counter')
+        assert structure['foo.html'] == 'foo F2'
+        assert structure['bar.html'] == 'bar T1'
+        assert bar_mtime < os.path.getmtime(fs.path('counter/bar.html'))
+
+
+def test_bake_after_old_post_change():
+    fs = (mock_fs()
+          .withConfig({'site': {'default_post_layout': 'none'}})
+          .withPage('pages/recent.html',
+                    {'layout': 'none', 'format': 'none'},
+                    "{% for p in blog.posts.limit(2) -%}\n"
+                    "{{p.title}}\n"
+                    "{% endfor %}")
+          .withPage('posts/2017-01-01_first.html', {'title': "First"},
+                    "something")
+          .withPage('posts/2017-01-02_second.html', {'title': "Second"},
+                    "something")
+          .withPage('posts/2017-01-03_third.html', {'title': "Third"},
+                    "something"))
+    with mock_fs_scope(fs):
+        fs.runChef('bake')
+        structure = fs.getStructure('kitchen/_counter')
+        assert structure['recent.html'] == 'Third\nSecond\n'
+        recent_mtime = os.path.getmtime(
+            fs.path('kitchen/_counter/recent.html'))
+
+        # The page doesn't list the oldest post.
+        time.sleep(1)
+        fs.withPage('posts/2017-01-01_first.html', {'title': "First"},
+                    "something else")
+        fs.runChef('bake')
+        assert recent_mtime == os.path.getmtime(
+            fs.path('kitchen/_counter/recent.html'))
+
+        # ...but it lists this one.
+        time.sleep(1)
+        fs.withPage('posts/2017-01-02_second.html', {'title': "Second!"},
+                    "something")
+        fs.runChef('bake')
+        structure = fs.getStructure('kitchen/_counter')
+        assert structure['recent.html'] == 'Third\nSecond!\n'
+
+        # New posts change what the page lists.
+        fs.withPage('posts/2017-01-04_fourth.html', {'title': "Fourth"},
+                    "something")
+        fs.runChef('bake')
+        structure = fs.getStructure('kitchen/_counter')
+        assert structure['recent.html'] == 'Fourth\nThird\n'
+
+        # ...and so do deleted ones.
+        os.remove(fs.path('kitchen/posts/2017-01-04_fourth.html'))
+        fs.runChef('bake')
+        structure = fs.getStructure('kitchen/_counter')
+        assert structure['recent.html'] == 'Third\nSecond!\n'
+
+
+def test_bake_after_old_post_change_only_rebakes_its_sub_page():
+    fs = (mock_fs()
+          .withConfig({'site': {'default_post_layout': 'none',
+                                'posts_per_page': 2}})
+          .withPage('pages/_index.html', {'layout': 'none', 'format': 'none'},
+                    "{% for p in pagination.posts -%}\n"
+                    "{{p.title}}\n"
+                    "{% endfor %}"))
+    for i in range(1, 5):
+        fs.withPage('posts/2017-01-0%d_post%d.html' % (i, i),
+                    {'title': "Post%d" % i}, "something")
+    with mock_fs_scope(fs):
+        fs.runChef('bake')
+        structure = fs.getStructure('kitchen/_counter')
+        assert structure['index.html'] == 'Post4\nPost3\n'
+        assert structure['2.html'] == 'Post2\nPost1\n'
+        index_mtime = os.path.getmtime(fs.path('kitchen/_counter/index.html'))
+
+        # Only the second page lists this post.
+        time.sleep(1)
+        fs.withPage('posts/2017-01-01_post1.html', {'title': "Post1!"},
+                    "something")
+        fs.runChef('bake')
+        structure = fs.getStructure('kitchen/_counter')
+        assert structure['index.html'] == 'Post4\nPost3\n'
+        assert structure['2.html'] == 'Post2\nPost1!\n'
+        assert index_mtime == os.path.getmtime(
+            fs.path('kitchen/_counter/index.html'))
+
+
+def test_bake_from_scratch_postpones_known_pages():
+    from unittest import mock
+    from piecrust.pipelines.page import PagePipeline
+
+    fs = (mock_fs()
+          .withConfig({'site': {'default_post_layout': 'none'}})
+          .withPage('pages/_index.html', {'layout': 'none', 'format': 'none'},
+                    "{% for p in pagination.posts -%}\n"
+                    "{{p.content}}\n"
+                    "{% endfor %}")
+          .withPage('posts/2017-01-01_first.html', {'title': "First"},
+                    "something"))
+    with mock_fs_scope(fs):
+        index_spec = fs.path('kitchen/pages/_index.html')
+        render_segments = PagePipeline._renderSegments
+        with mock.patch.object(PagePipeline, '_renderSegments',
+                               autospec=True,
+                               side_effect=render_segments) as m:
+            # The first time, we don't know that the home page lists posts,
+            # so we try to render it and abort.
+            fs.runChef('bake')
+            specs = [c[0][1]['job_spec'][1] for c in m.call_args_list]
+            assert index_spec in specs
+
+            # Now we know, even when baking from scratch.
+            m.reset_mock()
+            fs.runChef('bake', '-f')
+            specs = [c[0][1]['job_spec'][1] for c in m.call_args_list]
+            assert index_spec not in specs
+            assert len(specs) > 0
+
+        structure = fs.getStructure('kitchen/_counter')
+        assert structure['index.html'] == '<p>something</p>\n'
+
+
+def test_bake_and_override_theme_page():
+    fs = (mock_fs()
+          .withConfig()
+          .withPage('pages/foo.html', {'layout': 'none', 'format': 'none'},
+                    "a foo page"))
+    with mock_fs_scope(fs):
+        fs.runChef('bake')
+        structure = fs.getStructure('kitchen/_counter')
+        assert 'Untitled PieCrust website' in structure['index.html']
+
+        fs.withPage('pages/_index.html', {'layout': 'none', 'format': 'none'},
+                    "my own home page")
+        fs.runChef('bake')
+        structure = fs.getStructure('kitchen/_counter')
+        assert structure['index.html'] == 'my own home page'
+
+
+def test_bake_with_content_hashes():
+    fs = (mock_fs()
+          .withConfig({'baker': {'change_detection': 'hash'}})
+          .withFile('kitchen/templates/first.html', "{{content|safe}}!")
+          .withPage('pages/foo.md', {'layout': 'first', 'format': 'none'},
+                    "foo")
+          .withPage('pages/bar.md', {'layout': 'first', 'format': 'none'},
+                    "bar"))
+    with mock_fs_scope(fs):
+        fs.runChef('bake', '-o', fs.path('counter'))
+        structure = fs.getStructure('counter')
+        assert structure['foo.html'] == 'foo!'
+        assert structure['bar.html'] == 'bar!'
+        bar_mtime = os.path.getmtime(fs.path('counter/bar.html'))
+
+        # Touch all the files, like a fresh checkout would, and change
+        # only one page.
+        time.sleep(1)
+        for dpath, _, filenames in os.walk(fs.path('kitchen')):
+            for fn in filenames:
+                os.utime(os.path.join(dpath, fn))
+        fs.withPage('pages/foo.md', {'layout': 'first', 'format': 'none'},
+                    "updated foo")
+        fs.runChef('bake', '-o', fs.path('counter'))
+        structure = fs.getStructure('counter')
+        assert structure['foo.html'] == 'updated foo!'
+        assert structure['bar.html'] == 'bar!'
+        assert bar_mtime == os.path.getmtime(fs.path('counter/bar.html'))
+
+
+@pytest.mark.skipif(shutil.which('git') is None,
+                    reason="Git isn't available")
+def test_bake_with_git_changes():
+    fs = (mock_fs()
+          .withConfig({'baker': {'change_detection': 'git'}})
+          .withFile('kitchen/templates/first.html', "{{content|safe}}!")
+          .withPage('pages/foo.md', {'layout': 'first', 'format': 'none'},
+                    "foo")
+          .withPage('pages/bar.md', {'layout': 'first', 'format': 'none'},
+                    "bar"))
+    with mock_fs_scope(fs):
+        def git(*args):
+            subprocess.check_call(
+                ['git', '-c', 'user.name=Test', '-c', 'user.email=t@t',
+                 *args],
+                cwd=fs.path('kitchen'), stdout=subprocess.DEVNULL)
+
+        git('init', '-q')
+        git('add', 'config.yml', 'templates', 'pages')
+        git('commit', '-q', '-m', "Initial")
+
+        fs.runChef('bake', '-o', fs.path('counter'))
+        structure = fs.getStructure('counter')
+        assert structure['foo.html'] == 'foo!'
+        assert structure['bar.html'] == 'bar!'
+        bar_mtime = os.path.getmtime(fs.path('counter/bar.html'))
+
+        # Touch all the files, and change only one page without
+        # committing it.
+        time.sleep(1)
+        for dpath, _, filenames in os.walk(fs.path('kitchen')):
+            for fn in filenames:
+                os.utime(os.path.join(dpath, fn))
+        fs.withPage('pages/foo.md', {'layout': 'first', 'format': 'none'},
+                    "updated foo")
+        fs.runChef('bake', '-o', fs.path('counter'))
+        structure = fs.getStructure('counter')
+        assert structure['foo.html'] == 'updated foo!'
+        assert structure['bar.html'] == 'bar!'
+        assert bar_mtime == os.path.getmtime(fs.path('counter/bar.html'))
+
+        # Committed changes are picked up too.
+        time.sleep(1)
+        fs.withPage('pages/bar.md', {'layout': 'first', 'format': 'none'},
+                    "updated bar")
+        git('commit', '-q', '-a', '-m', "Update pages")
+        fs.runChef('bake', '-o', fs.path('counter'))
+        structure = fs.getStructure('counter')
+        assert structure['foo.html'] == 'updated foo!'
+        assert structure['bar.html'] == 'updated bar!'
+
+
+@pytest.mark.parametrize('baker_config', [
+    {'warm_workers': True, 'inline_threshold': 0},
+    {'warm_workers': True, 'worker_start_method': 'forkserver',
+     'inline_threshold': 0},
+    {'worker_transport': 'shm', 'inline_threshold': 0},
+    {'worker_max_jobs': 1, 'inline_threshold': 0},
+    {'inline_threshold': 0},
+    {'inline_threshold': 100},
+    {'cache_durability': 'write_behind', 'inline_threshold': 0},
+    {'cache_durability': 'write_behind', 'warm_workers': True,
+     'inline_threshold': 0},
+    {'cache_memory': 0.001, 'inline_threshold': 0},
+    {'cache_memory': {'pages': 1}, 'worker_cache_memory': 0.001,
+     'inline_threshold': 100}
+])
+def test_bake_with_worker_options(baker_config):
+    fs = (mock_fs()
+          .withConfig({'baker': baker_config})
+          .withPage('pages/_index.html', {'layout': 'none', 'format': 'none'},
+                    "{% for p in pagination.posts -%}\n"
+                    "{{p.title}}\n"
+                    "{% endfor %}")
+          .withPage('posts/2017-01-01_first.html', {'title': "First"},
+                    "something"))
+    with mock_fs_scope(fs):
+        fs.runChef('bake')
+        structure = fs.getStructure('kitchen/_counter')
+        assert structure['index.html'] == 'First\n'
+
+        time.sleep(1)
+        fs.withPage('posts/2017-01-02_second.html', {'title': "Second"},
+                    "something else")
+        fs.runChef('bake')
+        structure = fs.getStructure('kitchen/_counter')
+        assert structure['index.html'] == 'Second\nFirst\n'
+
+
+def test_bake_with_shared_render_cache():
+    fs = (mock_fs()
+          .withConfig({'site': {'posts_per_page': 30},
+                       'baker': {'workers': 4, 'inline_threshold': 0}})
+          .withPage('pages/_index.html', {'layout': 'none', 'format': 'none'},
+                    "{% for p in pagination.posts -%}\n"
+                    "{{p.content}}\n"
+                    "{% endfor %}"))
+    for i in range(10):
+        fs.withPage('pages/list%d.html' % i,
+                    {'layout': 'none', 'format': 'none'},
+                    "{% for p in blog.posts -%}\n"
+                    "{{p.content}}\n"
+                    "{% endfor %}")
+    for i in range(1, 21):
+        fs.withPage('posts/2017-01-%02d_post%d.html' % (i, i),
+                    {'layout': 'none', 'format': 'none'},
+                    "post %d" % i)
+    expected = ''.join(['post %d\n' % i for i in range(20, 0, -1)])
+    with mock_fs_scope(fs):
+        for _ in range(3):
+            fs.runChef('bake', '-f')
+            structure = fs.getStructure('kitchen/_counter')
+            assert structure['index.html'] == expected
+            for i in range(10):
+                assert structure['list%d.html' % i] == expected
+
+
+class _MockPipeline:
+    def __init__(self, pass_num, deps):
+        self.PASS_NUM = pass_num
+        self.record_name = 'foo'
+        self._deps = deps
+
+    def getPassDependencies(self, ctx):
+        return self._deps.get(ctx.pass_num)
+
+
+class _MockSource:
+    def __init__(self, name, realm):
+        self.name = name
+        self.config = {'realm': realm}
+
+
+class _MockPipelineInfo:
+    def __init__(self, name, realm, pass_num, deps):
+        self.source = _MockSource(name, realm)
+        self.pipeline = _MockPipeline(pass_num, deps)
+
+
+def _get_ready_steps(scheduler):
+    return sorted(['%s/%d' % (s.source_name, s.pass_num)
+                   for s in scheduler.getReadySteps()])
+
+
+def _run_steps(scheduler):
+    for s in scheduler.getReadySteps():
+        scheduler.startStep(s)
+        scheduler.endStep(s)
+
+
+def test_bake_watch_loop():
+    from piecrust.app import PieCrustFactory
+    from piecrust.baking.baker import get_bake_records_path
+    from piecrust.pipelines.records import load_records
+    from piecrust.serving.procloop import BakeWatchLoop
+
+    fs = (mock_fs()
+          .withConfig()
+          .withFile('kitchen/templates/first.html',
+                    "FIRST {{content|safe}}")
+          .withPage('pages/_index.html', {'layout': 'none', 'format': 'none'},
+                    "{% for p in pagination.posts -%}\n"
+                    "{{p.title}}\n"
+                    "{% endfor %}")
+          .withPage('pages/foo.md', {'layout': 'first', 'format': 'none'},
+                    "foo")
+          .withPage('posts/2017-01-01_first.html', {'title': "First"},
+                    "something"))
+    with mock_fs_scope(fs):
+        appfactory = PieCrustFactory(fs.path('kitchen'), debug=True)
+        out_dir = fs.path('kitchen/_counter')
+        loop = BakeWatchLoop(appfactory, out_dir)
+        loop.initialize()
+        loop.runPipelines()
+        structure = fs.getStructure('kitchen/_counter')
+        assert structure['index.html'] == 'First\n'
+        assert structure['foo.html'] == 'FIRST foo'
+
+        app = loop.getApp()
+        records_path = get_bake_records_path(app, out_dir)
+        bake_time = load_records(records_path).bake_time
+
+        time.sleep(1)
+        fs.withPage('posts/2017-01-02_second.html', {'title': "Second"},
+                    "something else")
+        loop.onFilesChanged(
+            set([app.getSource('posts')]),
+            set([fs.path('kitchen/posts/2017-01-02_second.html')]))
+        structure = fs.getStructure('kitchen/_counter')
+        assert structure['index.html'] == 'Second\nFirst\n'
+        assert loop.getApp() is app
+
+        # Templates are reloaded when they change.
+        fs.withFile('kitchen/templates/first.html',
+                    "NEW FIRST {{content|safe}}")
+        loop.onFilesChanged(
+            set(), set([fs.path('kitchen/templates/first.html')]))
+        structure = fs.getStructure('kitchen/_counter')
+        assert structure['foo.html'] == 'NEW FIRST foo'
+
+        # The records are only saved when it's time for a checkpoint.
+        loop.checkpointRecords()
+        assert load_records(records_path).bake_time == bake_time
+        loop.checkpointRecords(force=True)
+        assert load_records(records_path).bake_time > bake_time
+
+
+def test_bake_watch_loop_ignores_read_only_events():
+    from watchdog.events import (
+        FileSystemEvent, FileModifiedEvent, FileClosedEvent)
+    from piecrust.serving.procloop import _AssetFileEventHandler
+
+    class _OpenedEvent(FileSystemEvent):
+        event_type = 'opened'
+
+    loop = mock.MagicMock()
+    loop._ops = []
+    handler = _AssetFileEventHandler(loop, None)
+    handler.on_any_event(_OpenedEvent('/foo.html'))
+    handler.on_any_event(FileClosedEvent('/foo.html'))
+    assert loop._ops == []
+    assert not loop._event.set.called
+
+    handler.on_any_event(FileModifiedEvent('/foo.html'))
+    assert [o['change'] for o in loop._ops] == ['modified']
+    assert loop._event.set.called
+
+
+def test_bake_watch_loop_with_workers():
+    from piecrust.app import PieCrustFactory
+    from piecrust.serving.procloop import BakeWatchLoop
+
+    fs = (mock_fs()
+          .withConfig({'site': {'posts_per_page': 50},
+                       'baker': {'workers': 4, 'inline_threshold': 0}})
+          .withPage('pages/_index.html', {'layout': 'none', 'format': 'none'},
+                    "{% for p in pagination.posts -%}\n"
+                    "{{p.title}}\n"
+                    "{% endfor %}"))
+    for i in range(1, 31):
+        fs.withPage('posts/2017-01-%02d_post%d.html' % (i, i),
+                    {'title': "Post %d" % i, 'layout': 'none',
+                     'format': 'none'},
+                    "post %d" % i)
+    with mock_fs_scope(fs):
+        appfactory = PieCrustFactory(fs.path('kitchen'), debug=True)
+        out_dir = fs.path('kitchen/_counter')
+        loop = BakeWatchLoop(appfactory, out_dir)
+        loop.initialize()
+        loop.runPipelines()
+
+        # Incremental bakes share the app, which isn't thread-safe, so
+        # pages must be rendered on the loop's thread.
+        app = loop.getApp()
+        render_threads = set()
+        push_ctx = app.env.render_ctx_stack.pushCtx
+
+        def _push_ctx(ctx):
+            render_threads.add(threading.current_thread())
+            push_ctx(ctx)
+
+        app.env.render_ctx_stack.pushCtx = _push_ctx
+
+        time.sleep(1)
+        for i in range(1, 31):
+            fs.withPage('posts/2017-01-%02d_post%d.html' % (i, i),
+                        {'title': "New Post %d" % i, 'layout': 'none',
+                         'format': 'none'},
+                        "new post %d" % i)
+        loop.onFilesChanged(
+            set([app.getSource('posts')]),
+            set([fs.path('kitchen/posts/2017-01-%02d_post%d.html' % (i, i))
+                 for i in range(1, 31)]))
+        structure = fs.getStructure('kitchen/_counter')
+        assert structure['index.html'] == ''.join(
+            ['New Post %d\n' % i for i in range(30, 0, -1)])
+        posts = structure['2017']['01']
+        for i in range(1, 31):
+            assert posts['%02d' % i]['post%d.html' % i] == 'new post %d' % i
+        assert render_threads == set([threading.current_thread()])
+
+
+@pytest.mark.parametrize('baker_config, expected', [
+    ({}, False),
+    ({'warm_workers': True, 'worker_start_method': 'forkserver'}, False),
+    ({'worker_start_method': 'fork'}, False),
+    ({'warm_workers': True, 'worker_start_method': 'fork'}, True)
+])
+def test_bake_precompiles_templates_for_warm_workers(baker_config, expected):
+    from piecrust.templating.jinjaengine import JinjaTemplateEngine
+
+    fs = (mock_fs()
+          .withConfig({'baker': baker_config})
+          .withPage('pages/foo.html', {'layout': 'none', 'format': 'none'},
+                    "foo"))
+    with mock_fs_scope(fs):
+        with mock.patch.object(JinjaTemplateEngine, 'populateCache') as pc:
+            fs.runChef('bake')
+        assert pc.called == expected
+        structure = fs.getStructure('kitchen/_counter')
+        assert structure['foo.html'] == 'foo'
+
+
+def test_bake_always_populates_on_disk_template_caches():
+    from piecrust.templating.jinjaengine import JinjaTemplateEngine
+
+    fs = (mock_fs()
+          .withConfig()
+          .withPage('pages/foo.html', {'layout': 'none', 'format': 'none'},
+                    "foo"))
+    with mock_fs_scope(fs):
+        with mock.patch.object(JinjaTemplateEngine, 'CACHES_IN_MEMORY_ONLY',
+                               False), \
+                mock.patch.object(JinjaTemplateEngine, 'populateCache') as pc:
+            fs.runChef('bake')
+        assert pc.called
+
+
+@pytest.mark.parametrize('override, config, pipeline, expected', [
+    (None, None, 'asset', 'thread'),
+    (None, None, 'page', 'process'),
+    (None, 'process', 'asset', 'process'),
+    (None, 'thread', 'page', 'error'),
+    ('thread', None, 'asset', 'thread'),
+    ('thread', None, 'page', 'inline'),
+    ('inline', None, 'asset', 'inline'),
+    ('process', None, 'page', 'process')
+])
+def test_bake_worker_backend(override, config, pipeline, expected):
+    from piecrust.baking.baker import _get_worker_backend
+    from piecrust.configuration import ConfigurationError
+    from piecrust.pipelines.asset import AssetPipeline
+    from piecrust.pipelines.page import PagePipeline
+
+    site_config = {}
+    if config is not None:
+        site_config = {'pipelines': {pipeline: {'worker_backend': config}}}
+    fs = mock_fs().withConfig(site_config)
+    with mock_fs_scope(fs):
+        app = fs.getApp()
+        baker = mock.Mock(app=app, worker_backend=override)
+        ppclass = AssetPipeline if pipeline == 'asset' else PagePipeline
+        if expected == 'error':
+            with pytest.raises(ConfigurationError):
+                _get_worker_backend(baker, ppclass)
+        else:
+            assert _get_worker_backend(baker, ppclass) == expected
+
+
+def test_bake_scheduler():
+    from piecrust.baking.baker import _BakeScheduler
+    from piecrust.sources.base import REALM_USER, REALM_THEME
+
+    page_deps = {0: {}, 1: {}, 2: {0: None, 1: ['posts']}}
+    scheduler = _BakeScheduler([
+        _MockPipelineInfo('pages', REALM_USER, [0, 1, 2], page_deps),
+        _MockPipelineInfo('posts', REALM_USER, [0, 1, 2], page_deps),
+        _MockPipelineInfo('other', REALM_USER, [0, 1, 2], page_deps),
+        _MockPipelineInfo('theme', REALM_THEME, [0, 1, 2], page_deps),
+        _MockPipelineInfo('tags', REALM_USER, 10, {})],
+        None)
+
+    assert _get_ready_steps(scheduler) == ['other/0', 'pages/0', 'posts/0']
+    _run_steps(scheduler)
+    assert _get_ready_steps(scheduler) == [
+        'other/1', 'pages/1', 'posts/1', 'theme/0']
+
+    # Start rendering segments for everything, but only finish with the
+    # posts: layouts for the pages and the theme can't start yet.
+    steps = scheduler.getReadySteps()
+    for s in steps:
+        scheduler.startStep(s)
+    posts_step = [s for s in steps if s.source_name == 'posts'][0]
+    theme_step = [s for s in steps if s.source_name == 'theme'][0]
+    scheduler.endStep(posts_step)
+    assert _get_ready_steps(scheduler) == []
+    scheduler.endStep(theme_step)
+    assert _get_ready_steps(scheduler) == ['posts/2']
+
+    # The taxonomy waits for everything else.
+    for s in steps:
+        if not s.is_done:
+            scheduler.endStep(s)
+    while not scheduler.is_done:
+        ready = _get_ready_steps(scheduler)
+        assert ready
+        if 'tags/10' in ready:
+            assert ready == ['tags/10']
+        _run_steps(scheduler)
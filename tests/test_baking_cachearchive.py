@@ -0,0 +1,161 @@
+import io
+import os
+import time
+import pickle
+import tarfile
+import pytest
+from unittest import mock
+from .mockutil import mock_fs, mock_fs_scope
+
+
+def _make_site():
+    return (mock_fs()
+            .withConfig()
+            .withPage('pages/_index.html',
+                      {'layout': 'none', 'format': 'none'},
+                      "{% for p in pagination.posts -%}\n"
+                      "{{p.title}}: {{p.content}}\n"
+                      "{% endfor %}")
+            .withPage('posts/2017-01-01_first.html',
+                      {'title': "First", 'format': 'none', 'layout': 'none'},
+                      "something")
+            .withPage('posts/2017-01-02_second.html',
+                      {'title': "Second", 'format': 'none', 'layout': 'none'},
+                      "something else"))
+
+
+def test_export_and_import_cache():
+    from piecrust import rendering
+
+    fs1 = _make_site()
+    fs2 = _make_site()
+    with mock_fs_scope(fs1), mock_fs_scope(fs2):
+        fs1.runChef('bake')
+        archive_path = fs1.path('cache.tar.gz')
+        fs1.runChef('cache', 'export', archive_path)
+        assert os.path.isfile(archive_path)
+
+        # Pretend the second site is a fresh checkout of the first one,
+        # with one post that changed.
+        time.sleep(1)
+        for dirpath, _, filenames in os.walk(fs2.path('kitchen')):
+            for fn in filenames:
+                os.utime(os.path.join(dirpath, fn))
+        fs2.withPage('posts/2017-01-02_second.html',
+                     {'title': "Second", 'format': 'none', 'layout': 'none'},
+                     "something new")
+        fs2.runChef('cache', 'import', archive_path)
+
+        render_segments = rendering._do_render_page_segments
+        with mock.patch.object(rendering, '_do_render_page_segments',
+                               side_effect=render_segments) as m:
+            fs2.runChef('bake')
+            rendered_pages = set([c[0][0].page.content_spec
+                                  for c in m.call_args_list])
+        assert fs2.path('kitchen/posts/2017-01-02_second.html') in \
+            rendered_pages
+        assert fs2.path('kitchen/posts/2017-01-01_first.html') not in \
+            rendered_pages
+
+        structure = fs2.getStructure('kitchen/_counter')
+        assert structure['index.html'] == (
+            'Second: something new\nFirst: something\n')
+        assert structure['2017']['01']['01']['first.html'] == 'something'
+        assert structure['2017']['01']['02']['second.html'] == \
+            'something new'
+
+
+def test_import_invalid_cache_archive():
+    from piecrust.baking.cachearchive import (
+        import_cache, CacheArchiveError)
+
+    fs = _make_site().withFile('kitchen/foo.txt', "not an archive")
+    with mock_fs_scope(fs):
+        fs.runChef('bake')
+        app = fs.getApp()
+        cache_names = sorted(os.listdir(app.cache_dir))
+        with pytest.raises(CacheArchiveError):
+            import_cache(app, fs.path('kitchen/_counter'),
+                         fs.path('kitchen/foo.txt'))
+        assert sorted(os.listdir(app.cache_dir)) == cache_names
+
+
+def _add_archive_file(tf, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tf.addfile(info, io.BytesIO(data))
+
+
+def test_import_cache_archive_with_invalid_member():
+    from piecrust.baking.cachearchive import (
+        import_cache, CacheArchiveError)
+
+    fs = _make_site()
+    with mock_fs_scope(fs):
+        fs.runChef('bake')
+        archive_path = fs.path('kitchen/cache.tar.gz')
+        fs.runChef('cache', 'export', archive_path)
+
+        # Add a bad item at the end of the archive: nothing should have
+        # been touched by the time we find it.
+        bad_path = fs.path('kitchen/bad.tar.gz')
+        with tarfile.open(archive_path, 'r:gz') as src, \
+                tarfile.open(bad_path, 'w:gz') as dst:
+            for m in src.getmembers():
+                dst.addfile(m, src.extractfile(m) if m.isfile() else None)
+            _add_archive_file(dst, 'cache/../../evil.txt', b"evil")
+
+        app = fs.getApp()
+        cache_dir = app.cache_dir
+        cache_names = sorted(os.listdir(cache_dir))
+        with pytest.raises(CacheArchiveError):
+            import_cache(app, fs.path('kitchen/_counter'), bad_path)
+        assert sorted(os.listdir(cache_dir)) == cache_names
+        assert not any([n.startswith('import-')
+                        for n in os.listdir(os.path.dirname(cache_dir))])
+
+
+def test_import_truncated_cache_archive():
+    from piecrust.baking.cachearchive import (
+        import_cache, CacheArchiveError)
+
+    fs = _make_site()
+    with mock_fs_scope(fs):
+        fs.runChef('bake')
+        archive_path = fs.path('kitchen/cache.tar.gz')
+        fs.runChef('cache', 'export', archive_path)
+        with open(archive_path, 'rb') as fp:
+            data = fp.read()
+        with open(archive_path, 'wb') as fp:
+            fp.write(data[:len(data) // 2])
+
+        app = fs.getApp()
+        cache_names = sorted(os.listdir(app.cache_dir))
+        with pytest.raises(CacheArchiveError):
+            import_cache(app, fs.path('kitchen/_counter'), archive_path)
+        assert sorted(os.listdir(app.cache_dir)) == cache_names
+
+
+def test_relocate_text():
+    from piecrust.baking.cachearchive import _relocate_text
+
+    path_map = [('/old/site', '/new/site')]
+    assert _relocate_text('/old/site', path_map) == '/new/site'
+    assert (_relocate_text('"/old/site/pages/foo.md"', path_map) ==
+            '"/new/site/pages/foo.md"')
+    assert (_relocate_text('/old/site2/foo.md /old/site-bak', path_map) ==
+            '/old/site2/foo.md /old/site-bak')
+    assert _relocate_text('/x/old/site/foo', path_map) == '/x/old/site/foo'
+
+
+def test_relocate_data_only_unpickles_pickled_caches():
+    from piecrust.baking.cachearchive import _relocate_data
+
+    path_map = [('/old/site', '/new/site')]
+    data = pickle.dumps({'path': '/old/site/foo.md'})
+    new_data = _relocate_data(data, path_map, True)
+    assert pickle.loads(new_data) == {'path': '/new/site/foo.md'}
+
+    with mock.patch('pickle.loads') as m:
+        assert _relocate_data(data, path_map, False) is data
+        assert not m.called
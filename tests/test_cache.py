@@ -0,0 +1,200 @@
+import os
+import time
+import sqlite3
+from unittest import mock
+import pytest
+from piecrust.cache import ExtensibleCache, PackedCache, MemCache
+from piecrust.configuration import ConfigurationError
+from piecrust.environment import Environment
+
+
+def test_packed_cache(tmpdir):
+    base_dir = str(tmpdir)
+    cache = PackedCache(base_dir, batch_size=2)
+    assert not cache.has('foo')
+    assert not cache.isValid('foo', 0)
+
+    start = time.time()
+    cache.write('foo', b'FOO')
+    assert cache.read('foo') == b'FOO'
+    assert cache.isValid('foo', start)
+    assert not cache.isValid('foo', time.time() + 10)
+
+    # Items are only written to disk in batches.
+    other = PackedCache(base_dir)
+    assert not other.has('foo')
+    cache.write('bar', 'BAR')
+    assert other.read('foo') == b'FOO'
+    assert other.read('bar') == 'BAR'
+
+    cache.write('baz', b'BAZ')
+    assert not other.has('baz')
+    cache.flush()
+    assert other.read('baz') == b'BAZ'
+
+
+def test_clear_packed_cache(tmpdir):
+    cache = ExtensibleCache(str(tmpdir))
+    pc = cache.getPackedCache('pages')
+    pc.write('foo', b'FOO')
+    cache.flush()
+    pc.write('bar', b'BAR')
+
+    cache.clearCache('pages')
+    assert not pc.has('foo')
+    assert not pc.has('bar')
+    pc.write('foo', b'NEW FOO')
+    assert pc.read('foo') == b'NEW FOO'
+
+
+def test_write_behind_cache(tmpdir):
+    cache = ExtensibleCache(str(tmpdir))
+    sc = cache.getCache('renders')
+    cache.setDurability('write_behind')
+    sc.write('foo', 'FOO')
+    sc.write('bar', b'BAR')
+    assert sc.has('foo')
+    assert sc.read('foo') == 'FOO'
+    assert sc.readBytes('bar') == b'BAR'
+
+    cache.flush()
+    assert sc.writer.getPending(sc.getCachePath('foo')) is None
+    with open(sc.getCachePath('foo'), 'r', encoding='utf8') as fp:
+        assert fp.read() == 'FOO'
+    with open(sc.getCachePath('bar'), 'rb') as fp:
+        assert fp.read() == b'BAR'
+    assert sorted(os.listdir(sc.base_dir)) == ['bar', 'foo']
+
+
+def test_write_behind_cache_syncs_written_files(tmpdir):
+    cache = ExtensibleCache(str(tmpdir))
+    sc = cache.getCache('renders')
+    cache.setDurability('write_behind')
+    sc.write('foo', 'FOO')
+    sc.write('bar', 'BAR')
+    sc.write('foo', 'NEW FOO')
+    cache.writer.wait()
+
+    synced = []
+    real_open = os.open
+
+    def _open(path, flags, *args, **kwargs):
+        synced.append(path)
+        return real_open(path, flags, *args, **kwargs)
+
+    with mock.patch('os.open', side_effect=_open), \
+            mock.patch('os.sync', create=True) as sync:
+        cache.flush()
+    assert not sync.called
+    expected = [sc.getCachePath('bar'), sc.getCachePath('foo')]
+    if os.name != 'nt':
+        expected.append(sc.base_dir)
+    assert sorted(synced) == sorted(expected)
+
+    # Nothing was written since, so there's nothing to sync.
+    synced = []
+    with mock.patch('os.open', side_effect=_open):
+        cache.flush()
+    assert synced == []
+
+
+def test_memcache_with_memory_budget():
+    cache = MemCache(size_getter=len)
+    cache.setMaxBytes(10)
+    cache.get('foo', lambda: 'FOO')
+    cache.get('bar', lambda: 'BARBAR')
+    assert cache.item_count == 2
+    assert cache.resident_bytes == 9
+
+    # Evicts the least recently used items first.
+    assert cache.get('foo', lambda: 'NOPE') == 'FOO'
+    cache.get('baz', lambda: 'BAZ')
+    assert cache.item_count == 2
+    assert cache.resident_bytes == 6
+    assert cache.evictions == 1
+    assert cache.get('bar', lambda: 'NEWBAR') == 'NEWBAR'
+    assert cache._hits == 1
+    assert cache._misses == 4
+
+
+def test_memcache_with_unknown_item_sizes():
+    sizes = {}
+    cache = MemCache(size_getter=lambda i: sizes.get(i))
+    cache.setMaxBytes(3000)
+    cache.get('foo', lambda: 'FOO')
+    cache.get('bar', lambda: 'BAR')
+    assert cache.resident_bytes == 2048
+    assert cache.evictions == 0
+
+    # Sizes are re-estimated when items are accessed again.
+    sizes['FOO'] = 10
+    cache.get('foo', lambda: 'NOPE')
+    assert cache.resident_bytes == 1034
+
+    sizes['BAR'] = 2995
+    cache.get('bar', lambda: 'NOPE')
+    assert cache.resident_bytes == 2995
+    assert cache.evictions == 1
+    assert cache.get('foo', lambda: 'NEWFOO') == 'NEWFOO'
+
+
+def test_cache_memory_budget_stats():
+    env = Environment()
+    env.page_repository.size_getter = len
+    env.setCacheMemoryBudgets({'pages': 0.001})
+    assert env.page_repository.max_bytes == 1048
+    assert env.rendered_segments_repository.max_bytes is None
+
+    for i in range(10):
+        env.page_repository.get('item%d' % i, lambda: 'x' * 200)
+    env.reportCacheStats()
+    counters = env.stats.counters
+    assert counters['PagesRepo_miss'] == 10
+    assert counters['PagesRepo_evictions'] == 5
+    assert counters['PagesRepo_entries'] == 5
+    assert counters['PagesRepo_bytes'] == 1000
+    assert 'RenderedSegmentsRepo_bytes' not in counters
+
+    with pytest.raises(ConfigurationError):
+        env.setCacheMemoryBudgets({'whatever': 10})
+
+
+def test_memcache_with_shared_cache(tmpdir):
+    def _make_repo():
+        cache = ExtensibleCache(str(tmpdir))
+        repo = MemCache()
+        repo.fs_cache = cache.getCache('renders')
+        repo.shared_cache = cache.getPackedCache('shared', batch_size=1)
+        return repo
+
+    def _fail():
+        raise Exception("Shouldn't be rendered again.")
+
+    start = time.time() - 1
+    repo1 = _make_repo()
+    repo2 = _make_repo()
+    assert repo1.get('foo', lambda: 'FOO', start, save_to_fs=False) == 'FOO'
+    assert not repo1.fs_cache.has('foo')
+    assert repo2.get('foo', _fail, start, save_to_fs=False) == 'FOO'
+    assert repo2._shared_hits == 1
+
+    # Invalidated items are rendered again.
+    repo2.invalidate('foo')
+    assert repo2.get('foo', lambda: 'NEW FOO', start,
+                     save_to_fs=False) == 'NEW FOO'
+    assert repo2._misses == 1
+
+
+def test_memcache_with_busy_shared_cache(tmpdir):
+    cache = ExtensibleCache(str(tmpdir))
+    repo = MemCache()
+    repo.fs_cache = cache.getCache('renders')
+    repo.shared_cache = cache.getPackedCache('shared', batch_size=1)
+
+    start = time.time() - 1
+    error = sqlite3.OperationalError("database is locked")
+    with mock.patch.object(repo.shared_cache, '_getConnection',
+                           side_effect=error):
+        assert repo.get('foo', lambda: 'FOO', start,
+                        save_to_fs=False) == 'FOO'
+    assert repo._misses == 1
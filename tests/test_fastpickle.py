@@ -15,6 +15,19 @@ class Bar(object):
         self.value = value
 
 
+class Baz(object):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __getstate__(self):
+        return {'value': self.value}
+
+    def __setstate__(self, state):
+        self.value = state['value']
+
+
 @pytest.mark.parametrize(
         'obj, expected',
         [
@@ -60,6 +73,15 @@ def test_objects():
         assert f.bars[i].value == o.bars[i].value
 
 
+def test_objects_with_slots():
+    data = pickle([Baz(1), Baz({'two': 2})])
+    o = unpickle(data)
+
+    assert [type(b) for b in o] == [Baz, Baz]
+    assert o[0].value == 1
+    assert o[1].value == {'two': 2}
+
+
 def test_reentrance():
     a = {'test_ints': 42, 'test_set': set([1, 2])}
     data = pickle(a)
@@ -99,3 +99,36 @@ def test_record_version_change():
         finally:
             MultiRecord.RECORD_VERSION -= 1
 
+
+def test_unchanged_pages_are_not_reloaded():
+    from unittest import mock
+    from piecrust.pipelines.page import PagePipeline
+
+    fs = (mock_fs()
+          .withConfig({'baker': {'inline_threshold': 100}})
+          .withPage('pages/foo.md', {'layout': 'none', 'format': 'none'},
+                    'a foo page')
+          .withPage('pages/bar.md', {'layout': 'none', 'format': 'none'},
+                    'a bar page'))
+    with mock_fs_scope(fs):
+        load_page = PagePipeline._loadPage
+        with mock.patch.object(PagePipeline, '_loadPage', autospec=True,
+                               side_effect=load_page) as m:
+            fs.runChef('bake', '-o', fs.path('counter'))
+            assert m.call_count >= 2
+
+            m.reset_mock()
+            fs.runChef('bake', '-o', fs.path('counter'))
+            assert m.call_count == 0
+
+            time.sleep(1)
+            with open(fs.path('kitchen/pages/foo.md'), 'w') as fp:
+                fp.write("---\nlayout: none\nformat: none\n---\n"
+                         "an updated foo page")
+            m.reset_mock()
+            fs.runChef('bake', '-o', fs.path('counter'))
+            assert m.call_count == 1
+
+        structure = fs.getStructure('counter')
+        assert structure['foo.html'] == 'an updated foo page'
+        assert structure['bar.html'] == 'a bar page'
@@ -0,0 +1,116 @@
+import os.path
+from unittest import mock
+import pytest
+from piecrust.baking.baker import save_bake_records
+from piecrust.pipelines.records import MultiRecord, load_records
+from piecrust.pipelines._pagerecords import (
+    PagePipelineRecordEntry, SubPageRecordEntry)
+
+
+def _make_entry(spec, out_paths, errors=None):
+    e = PagePipelineRecordEntry()
+    e.item_spec = spec
+    e.errors = errors or []
+    for op in out_paths:
+        e.subs.append(SubPageRecordEntry(op, op))
+    return e
+
+
+def _make_records():
+    records = MultiRecord()
+    records.bake_time = 42
+    rec = records.getRecord('pages@page')
+    rec.user_data['foo'] = 'bar'
+    rec.addEntry(_make_entry('/pages/foo.md', ['/out/foo.html']))
+    rec.addEntry(_make_entry('/pages/bar.md',
+                             ['/out/bar.html', '/out/bar/2.html'],
+                             errors=['oops']))
+    rec.addEntry(_make_entry('/pages/baz.md', ['/out/baz.html']))
+    return records
+
+
+def test_save_and_load_records(tmpdir):
+    path = os.path.join(str(tmpdir), 'test.records')
+    _make_records().save(path)
+
+    records = load_records(path, True)
+    assert records.bake_time == 42
+    rec = records.getRecord('pages@page', auto_create=False)
+    assert rec.user_data == {'foo': 'bar'}
+
+    # Entries are loaded one at a time, until all of them are needed.
+    assert rec.getEntry('/pages/bar.md').errors == ['oops']
+    assert rec.getEntry('/pages/nope.md') is None
+    assert list(rec._entries.keys()) == ['/pages/bar.md']
+    assert sorted([e.item_spec for e in rec.getEntries()]) == [
+        '/pages/bar.md', '/pages/baz.md', '/pages/foo.md']
+
+
+def test_query_records(tmpdir):
+    path = os.path.join(str(tmpdir), 'test.records')
+    in_memory = _make_records()
+    in_memory.save(path)
+    on_disk = load_records(path, True)
+
+    for records in [in_memory, on_disk]:
+        rec = records.getRecord('pages@page')
+
+        def _query(**kwargs):
+            return [e.item_spec for e in rec.queryEntries(**kwargs)]
+
+        assert _query(spec_pattern='*ba*') == [
+            '/pages/bar.md', '/pages/baz.md']
+        assert _query(out_pattern='*/2.html') == ['/pages/bar.md']
+        assert _query(failed_only=True) == ['/pages/bar.md']
+        assert _query(spec_pattern='*foo*', failed_only=True) == []
+
+
+def test_query_records_with_normalized_case(tmpdir):
+    path = os.path.join(str(tmpdir), 'test.records')
+    in_memory = _make_records()
+    in_memory.save(path)
+    on_disk = load_records(path, True)
+
+    # Patterns are matched like `fnmatch` does, so they're case-insensitive
+    # on platforms that normalize the case of paths.
+    for records in [in_memory, on_disk]:
+        rec = records.getRecord('pages@page')
+        assert rec.queryEntries(spec_pattern='*FOO*') == []
+        with mock.patch('os.path.normcase', lambda p: p.lower()):
+            res = rec.queryEntries(spec_pattern='*FOO*')
+            assert [e.item_spec for e in res] == ['/pages/foo.md']
+            res = rec.queryEntries(out_pattern='*/BAR/*')
+            assert [e.item_spec for e in res] == ['/pages/bar.md']
+
+
+def test_save_records_closes_previous_records(tmpdir):
+    path = os.path.join(str(tmpdir), 'test.records')
+    _make_records().save(path)
+
+    previous = load_records(path, True)
+    prev_rec = previous.getRecord('pages@page')
+    assert prev_rec.getEntry('/pages/foo.md') is not None
+
+    current = MultiRecord()
+    current.bake_time = 43
+    save_bake_records(current, path, previous_records=previous)
+    assert load_records(path, True).bake_time == 43
+    assert load_records(path[:-8] + '.1.records', True).bake_time == 42
+
+    # Entries that were already loaded are still there, but the others
+    # can't be loaded from a file that was moved.
+    assert prev_rec.getEntry('/pages/foo.md') is not None
+    with pytest.raises(Exception):
+        prev_rec.getEntry('/pages/bar.md')
+
+
+def test_load_all_records_entries(tmpdir):
+    path = os.path.join(str(tmpdir), 'test.records')
+    _make_records().save(path)
+
+    records = load_records(path, True)
+    records.loadAllEntries()
+    os.remove(path)
+    rec = records.getRecord('pages@page')
+    assert rec.getEntry('/pages/bar.md').errors == ['oops']
+    assert rec.entry_count == 3
@@ -0,0 +1,367 @@
+import os
+import os.path
+import threading
+import multiprocessing
+import pytest
+from unittest import mock
+from piecrust import workerpool
+from piecrust.environment import ExecutionStats
+from piecrust.workerpool import (
+    IWorker, WorkerPool, SharedMemoryQueue, BACKEND_INLINE, BACKEND_THREAD,
+    get_job_batches, get_wanted_worker_count)
+
+
+@pytest.mark.parametrize('jobs, batch_size, expected', [
+    ([], None, []),
+    ([1, 2, 3], None, [[1, 2, 3]]),
+    ([1, 2, 3, 4, 5], 2, [[1, 2], [3, 4], [5]])
+])
+def test_job_batches_without_costs(jobs, batch_size, expected):
+    assert get_job_batches(jobs, None, batch_size) == expected
+
+
+def test_job_batches_longest_first():
+    jobs = ['a', 'b', 'c', 'd']
+    costs = [1, 5, None, 3]
+    batches = get_job_batches(jobs, costs)
+    # Job 'c' has no known cost so it's assumed to cost the average (3).
+    assert batches == [['b', 'c', 'd', 'a']]
+
+
+def test_job_batches_shrink_towards_the_end():
+    jobs = list(range(40))
+    costs = [1] * 40
+    batches = get_job_batches(jobs, costs, batch_size=10, worker_count=2)
+    sizes = [len(b) for b in batches]
+    assert sum(sizes) == 40
+    assert sizes == sorted(sizes, reverse=True)
+    assert sizes[0] == 10
+    assert sizes[-1] == 1
+    assert sorted(sum(batches, [])) == jobs
+
+
+def test_job_batches_isolate_expensive_jobs():
+    jobs = ['small1', 'big', 'small2', 'small3']
+    costs = [1, 100, 1, 1]
+    batches = get_job_batches(jobs, costs, batch_size=10, worker_count=2)
+    assert batches[0] == ['big']
+    assert sum(batches, []) == ['big', 'small1', 'small2', 'small3']
+
+
+def test_job_batches_bad_costs():
+    with pytest.raises(ValueError):
+        get_job_batches([1, 2], [1])
+
+
+@pytest.mark.parametrize('costs, spawn_cost, expected', [
+    ([], 0.5, 0),
+    ([None, None, None], 0.5, 3),
+    ([1, 1, 1, 1, 1, 1], 0, 4),
+    ([0.01, 0.01, 0.01], 0.5, 1),
+    ([1, 1, 1, 1, 1, 1], 0.5, 4),
+    ([0.1, 0.2, None, 0.3], 0.5, 2)
+])
+def test_wanted_worker_count(costs, spawn_cost, expected):
+    assert get_wanted_worker_count(costs, spawn_cost, 4) == expected
+
+
+class _CrashingWorker(IWorker):
+    def __init__(self, marker_path, always_crash):
+        self.marker_path = marker_path
+        self.always_crash = always_crash
+
+    def initialize(self):
+        pass
+
+    def process(self, job):
+        if job == 'crash':
+            if self.always_crash or not os.path.exists(self.marker_path):
+                with open(self.marker_path, 'w'):
+                    pass
+                os._exit(1)
+        return job
+
+
+def _run_crashing_pool(tmpdir, always_crash, batch_size=None):
+    results = []
+    errors = []
+    marker_path = os.path.join(str(tmpdir), 'crashed')
+    pool = WorkerPool(
+        _CrashingWorker, (marker_path, always_crash),
+        callback=lambda job, res, _: results.append(res),
+        error_callback=lambda job, err, _: errors.append((job, err)),
+        worker_count=2, batch_size=batch_size, max_job_retries=1)
+    pool.queueJobs(['a', 'b', 'crash', 'c', 'd'])
+    assert pool.wait(30)
+    pool.close()
+    return results, errors
+
+
+@pytest.mark.parametrize('batch_size', [None, 2])
+def test_pool_requeues_jobs_from_crashed_worker(tmpdir, batch_size):
+    results, errors = _run_crashing_pool(tmpdir, False, batch_size)
+    assert sorted(results) == ['a', 'b', 'c', 'crash', 'd']
+    assert errors == []
+
+
+def test_pool_gives_up_on_jobs_that_always_crash(tmpdir):
+    results, errors = _run_crashing_pool(tmpdir, True)
+    assert sorted(results) == ['a', 'b', 'c', 'd']
+    assert len(errors) == 1
+    assert errors[0][0] == 'crash'
+    assert errors[0][1]['type'] == 'WorkerCrash'
+
+
+def _crash_once(marker_path):
+    if not os.path.exists(marker_path):
+        with open(marker_path, 'w'):
+            pass
+        os._exit(1)
+    return 'unpickled'
+
+
+class _CrashOnUnpickle:
+    def __init__(self, marker_path):
+        self.marker_path = marker_path
+
+    def __reduce__(self):
+        return (_crash_once, (self.marker_path,))
+
+
+def test_pool_requeues_jobs_from_worker_crashed_while_getting_them(tmpdir):
+    # The worker dies while reading the batch from its queue, before it
+    # could do anything about it.
+    results = []
+    marker_path = os.path.join(str(tmpdir), 'crashed')
+    pool = WorkerPool(
+        _CrashingWorker, (marker_path, False),
+        callback=lambda job, res, _: results.append(res),
+        worker_count=2, max_job_retries=1)
+    pool.queueJobs(['a', _CrashOnUnpickle(marker_path), 'b'])
+    assert pool.wait(30)
+    pool.close()
+    assert sorted(results) == ['a', 'b', 'unpickled']
+
+
+class _UnpicklableResultWorker(IWorker):
+    def initialize(self):
+        pass
+
+    def process(self, job):
+        if job == 'bad':
+            return threading.Lock()
+        return job
+
+
+def test_pool_replaces_worker_that_cant_send_results():
+    results = []
+    errors = []
+    pool = WorkerPool(
+        _UnpicklableResultWorker,
+        callback=lambda job, res, _: results.append(res),
+        error_callback=lambda job, err, _: errors.append(job),
+        worker_count=1, max_job_retries=1)
+    pool.queueJobs(['a', 'bad', 'b'])
+    assert pool.wait(30)
+    pool.close()
+    assert sorted(results) == ['a', 'b']
+    assert errors == ['bad']
+
+
+class _CountingWorker(IWorker):
+    def initialize(self):
+        self.stats = ExecutionStats()
+        self.stats.registerCounter('JobsDone')
+
+    def process(self, job):
+        self.stats.stepCounter('JobsDone')
+        return job
+
+    def getStats(self):
+        return self.stats
+
+
+def test_pool_retires_workers():
+    results = []
+    pool = WorkerPool(
+        _CountingWorker,
+        callback=lambda job, res, _: results.append(res),
+        worker_count=2, max_jobs_per_worker=2)
+    pool.queueJobs(list(range(10)))
+    assert pool.wait(30)
+    reports = pool.close()
+
+    assert sorted(results) == list(range(10))
+    # The main process' stats, the retired workers' stats, and the stats
+    # from the workers that were alive at the end.
+    worker_reports = [r for r in reports[1:] if r is not None]
+    assert len(worker_reports) > 2
+    assert sum([r.counters['JobsDone'] for r in worker_reports]) == 10
+
+
+class _StartMethodWorker(IWorker):
+    def initialize(self):
+        pass
+
+    def process(self, job):
+        return multiprocessing.get_start_method()
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason="Workers aren't forked on this platform.")
+def test_pool_doesnt_fork_replacement_workers():
+    # Replacement workers are started from the pool's helper threads, so
+    # they shouldn't be forked.
+    results = []
+    pool = WorkerPool(
+        _StartMethodWorker,
+        callback=lambda job, res, _: results.append(res),
+        worker_count=1, max_jobs_per_worker=1)
+    pool.queueJobs(['a', 'b'])
+    assert pool.wait(30)
+    pool.close()
+    assert sorted(results) == ['fork', 'forkserver']
+
+
+def test_pool_spawns_workers_lazily():
+    results = []
+    pool = WorkerPool(
+        _CountingWorker,
+        callback=lambda job, res, _: results.append(res),
+        worker_count=4, worker_spawn_cost=1)
+    assert pool.started_worker_count == 0
+    pool.queueJobs(['a', 'b'], costs=[0.1, 0.1])
+    assert pool.wait(30)
+    assert pool.started_worker_count == 1
+    pool.queueJobs(['c', 'd', 'e'])
+    assert pool.wait(30)
+    assert pool.started_worker_count == 3
+    pool.close()
+    assert sorted(results) == ['a', 'b', 'c', 'd', 'e']
+
+
+def test_pool_runs_jobs_inline():
+    results = []
+    pool = WorkerPool(
+        _CountingWorker,
+        callback=lambda job, res, _: results.append(res),
+        backend=BACKEND_INLINE)
+    pool.queueJobs(['a', 'b', 'c'])
+    assert results == ['a', 'b', 'c']
+    assert pool.wait()
+    reports = pool.close()
+    assert pool.started_worker_count == 0
+    assert reports[1].counters['JobsDone'] == 3
+
+
+class _ThreadRecordingWorker(IWorker):
+    def __init__(self, threads):
+        self.threads = threads
+
+    def initialize(self):
+        self.stats = ExecutionStats()
+        self.stats.registerCounter('JobsDone')
+
+    def process(self, job):
+        if job == 'fail':
+            raise Exception("Failed job")
+        self.threads.add(threading.current_thread())
+        self.stats.stepCounter('JobsDone')
+        return job
+
+    def getStats(self):
+        return self.stats
+
+
+def test_pool_runs_jobs_on_threads():
+    results = []
+    threads = set()
+    pool = WorkerPool(
+        _ThreadRecordingWorker, (threads,),
+        callback=lambda job, res, _: results.append(res),
+        worker_count=2, backend=BACKEND_THREAD)
+    pool.queueJobs(list(range(10)))
+    assert pool.wait(30)
+    reports = pool.close()
+
+    assert sorted(results) == list(range(10))
+    assert pool.started_worker_count == 2
+    assert threading.current_thread() not in threads
+    assert all(t.name.startswith('PoolWorkerThread-') for t in threads)
+    worker_reports = [r for r in reports[1:] if r is not None]
+    assert sum([r.counters['JobsDone'] for r in worker_reports]) == 10
+
+
+def test_pool_reports_errors_from_threads():
+    results = []
+    errors = []
+    pool = WorkerPool(
+        _ThreadRecordingWorker, (set(),),
+        callback=lambda job, res, _: results.append(res),
+        error_callback=lambda job, err, _: errors.append(job),
+        worker_count=2, backend=BACKEND_THREAD)
+    pool.queueJobs(['a', 'fail', 'b'])
+    assert pool.wait(30)
+    pool.close()
+
+    assert sorted(results) == ['a', 'b']
+    assert errors == ['fail']
+
+
+@pytest.mark.skipif(workerpool.shared_memory is None,
+                    reason="Shared memory isn't available.")
+@pytest.mark.parametrize('payload_size, uses_segment', [
+    (10, False),
+    (1000, False),
+    (5000, True),
+    (100000, True)
+])
+def test_shared_memory_queue_round_trip(payload_size, uses_segment):
+    created = []
+    shm_class = workerpool.shared_memory.SharedMemory
+
+    def _create_shm(*args, **kwargs):
+        shm = shm_class(*args, **kwargs)
+        if kwargs.get('create'):
+            created.append(shm.name)
+        return shm
+
+    payload = (1, 0, [('job', {'data': 'x' * payload_size}, True)])
+    queue = SharedMemoryQueue(threshold=2048)
+    with mock.patch.object(workerpool.shared_memory, 'SharedMemory',
+                           side_effect=_create_shm):
+        for _ in range(3):
+            queue.put(payload)
+            assert queue.get() == payload
+
+    if not uses_segment:
+        assert created == []
+        return
+
+    # Each payload had its own segment, destroyed once it was received.
+    assert len(created) == 3
+    for name in created:
+        with pytest.raises(FileNotFoundError):
+            shm_class(name=name)
+
+
+def _put_payloads(queue, payloads):
+    for p in payloads:
+        queue.put(p)
+
+
+@pytest.mark.skipif(workerpool.shared_memory is None,
+                    reason="Shared memory isn't available.")
+def test_shared_memory_queue_between_processes():
+    import multiprocessing
+
+    payloads = [{'data': 'x' * size} for size in [10, 5000, 100, 100000]]
+    queue = SharedMemoryQueue(threshold=2048)
+    p = multiprocessing.Process(target=_put_payloads,
+                                args=(queue, payloads))
+    p.start()
+    try:
+        assert [queue.get() for _ in payloads] == payloads
+    finally:
+        p.join(30)
+    assert p.exitcode == 0